@@ -0,0 +1 @@
+"""Benchmarks for briefy.reflex."""
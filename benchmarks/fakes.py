@@ -0,0 +1,295 @@
+"""Local stand-ins for google drive, S3, Leica and Alexandria used by the pipeline benchmark.
+
+Each fake sleeps a configurable latency per call, fails a fraction of the calls with the
+exception the real client raises on network errors and keeps its data in memory, so the real
+tasks can be executed without any external service.
+"""
+from botocore.exceptions import ClientError
+from briefy.common.utilities.interfaces import IRemoteRestEndpoint
+from briefy.reflex import configure
+from briefy.reflex import metrics
+from briefy.reflex.tasks import gdrive
+from briefy.reflex.tasks import s3 as s3_tasks
+from collections import defaultdict
+from requests.exceptions import ConnectionError
+from zope.component import provideUtility
+
+import hashlib
+import random
+import threading
+import time
+import uuid
+
+
+class Service:
+    """Latency and faults of one fake service."""
+
+    def __init__(
+            self, latency: float=0.0, jitter: float=0.5, error_rate: float=0.0,
+            error: type=OSError
+    ):
+        """Initialize service.
+
+        :param latency: mean seconds per call
+        :param jitter: relative variation of the latency, 0.5 means +/- 50%
+        :param error_rate: fraction of the calls failing
+        :param error: exception class raised by failing calls
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error = error
+        self.calls = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def call(self, name: str):
+        """Simulate the network round trip of one call, failing it randomly."""
+        if self.latency:
+            variation = self.latency * self.jitter
+            time.sleep(random.uniform(self.latency - variation, self.latency + variation))
+        failed = self.error_rate and random.random() < self.error_rate
+        with self._lock:
+            self.calls += 1
+            self.errors += int(bool(failed))
+        if failed:
+            raise self.error(f'Fake failure calling {name}')
+
+
+class SizeDistribution:
+    """File sizes in bytes, parsed from a string.
+
+    - ``fixed:SIZE``: all files with the same size;
+    - ``uniform:MIN:MAX``: uniform distribution between MIN and MAX;
+    - ``lognormal:MEDIAN:SIGMA``: log-normal distribution, the usual shape of photo sizes.
+    """
+
+    def __init__(self, spec: str='lognormal:4000000:0.5'):
+        """Initialize distribution.
+
+        :param spec: distribution name and parameters separated by colons
+        """
+        name, *params = spec.split(':')
+        if name not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f'Unknown size distribution: {spec}')
+        self.name = name
+        self.params = [float(param) for param in params]
+
+    def sample(self) -> int:
+        """Return one file size."""
+        if self.name == 'fixed':
+            size = self.params[0]
+        elif self.name == 'uniform':
+            size = random.uniform(*self.params)
+        else:
+            median, sigma = self.params
+            size = median * random.lognormvariate(0, sigma)
+        return max(1, int(size))
+
+
+class FakeDrive:
+    """Stand-in for the briefy.gdrive.api module."""
+
+    def __init__(self, service: Service=None, sizes: SizeDistribution=None):
+        """Initialize drive.
+
+        :param service: latency and faults of the drive api
+        :param sizes: distribution of the image sizes
+        """
+        self.service = service or Service()
+        self.sizes = sizes or SizeDistribution()
+        self.folders = {}
+        self.files = {}
+        self.bytes_downloaded = 0
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    def add_folder(self, images: int) -> str:
+        """Create one folder with a number of images and return its url."""
+        folder_id = uuid.uuid4().hex
+        payloads = []
+        for index in range(images):
+            file_id = uuid.uuid4().hex
+            size = self.sizes.sample()
+            self.files[file_id] = size
+            payloads.append({
+                'id': file_id,
+                'name': f'IMG_{index:04d}.jpg',
+                'mimeType': 'image/jpeg',
+                'size': str(size),
+                'md5Checksum': hashlib.md5(bytes(size)).hexdigest(),
+                'imageMediaMetadata': {},
+                'webViewLink': f'https://drive.google.com/file/d/{file_id}/view',
+                'webContentLink': f'https://drive.google.com/uc?id={file_id}',
+            })
+        self.folders[folder_id] = {'id': folder_id, 'images': payloads, 'folders': []}
+        return f'https://drive.google.com/drive/folders/{folder_id}'
+
+    def get_folder_id_from_url(self, url: str) -> str:
+        """Return the folder id from a folder url."""
+        return url.rstrip('/').rsplit('/', 1)[-1]
+
+    def contents(self, folder_id: str, subfolders: bool=True, permissions: bool=False) -> dict:
+        """Return the contents of one folder."""
+        self.service.call('contents')
+        return self.folders[folder_id]
+
+    def list(self, folder_id: str) -> list:
+        """Return the images of one folder."""
+        self.service.call('list')
+        return self.folders[folder_id]['images']
+
+    def get_file(self, file_id: str) -> bytes:
+        """Return the contents of one file, all bytes are zero as in its md5Checksum."""
+        self.service.call('get_file')
+        size = self.files[file_id]
+        with self._lock:
+            if len(self._buffer) < size:
+                self._buffer = bytes(size)
+            self.bytes_downloaded += size
+        return self._buffer[:size]
+
+
+class FakeS3Object:
+    """Stand-in for a boto3 S3 object resource."""
+
+    def __init__(self, s3: 'FakeS3', bucket: str, key: str):
+        """Initialize object."""
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        """Load the object metadata, raise a 404 ClientError if it does not exist."""
+        self.s3.service.call('head_object')
+        if (self.bucket, self.key) not in self.s3.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+
+
+class FakeS3:
+    """Stand-in for the boto3 module, only the S3 calls used by the tasks."""
+
+    def __init__(self, service: Service=None, bandwidth: float=0.0):
+        """Initialize S3.
+
+        :param service: latency and faults of the S3 api
+        :param bandwidth: upload bandwidth in bytes per second, 0 for unlimited
+        """
+        self.service = service or Service()
+        self.bandwidth = bandwidth
+        self.objects = {}
+        self.bytes_uploaded = 0
+        self._lock = threading.Lock()
+
+    @property
+    def meta(self) -> 'FakeS3':
+        """Resource meta, the fake is its own client."""
+        return self
+
+    @property
+    def client(self) -> 'FakeS3':
+        """Low level client, the fake is its own client."""
+        return self
+
+    def resource(self, name: str) -> 'FakeS3':
+        """Return the S3 resource."""
+        return self
+
+    def Object(self, bucket: str, key: str) -> FakeS3Object:  # noQA
+        """Return one object resource."""
+        return FakeS3Object(self, bucket, key)
+
+    def upload_file(self, file_path: str, bucket: str, key: str, **kwargs):
+        """Upload one file from the file system."""
+        with open(file_path, 'rb') as data:
+            size = len(data.read())
+        self.service.call('upload_file')
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+        with self._lock:
+            self.objects[(bucket, key)] = size
+            self.bytes_uploaded += size
+
+    def put_object(self, Bucket: str, Key: str, Body, **kwargs) -> dict:  # noQA
+        """Upload one object from memory or from a file."""
+        size = len(Body.read() if hasattr(Body, 'read') else Body)
+        self.service.call('put_object')
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+        with self._lock:
+            self.objects[(Bucket, Key)] = size
+            self.bytes_uploaded += size
+        return {}
+
+
+class FakeEndpoint:
+    """Stand-in for a briefy.common RemoteRestEndpoint, items are kept in a dict."""
+
+    def __init__(self, service: Service, items: dict):
+        """Initialize endpoint.
+
+        :param service: latency and faults of the remote service
+        :param items: dict with item id as key and payload as value
+        """
+        self.service = service
+        self.items = items
+
+    def get(self, item_id: str) -> dict:
+        """Return one item or None."""
+        self.service.call('get')
+        return self.items.get(str(item_id))
+
+    def post(self, payload: dict) -> dict:
+        """Create one item."""
+        self.service.call('post')
+        item = {key: str(value) if isinstance(value, uuid.UUID) else value
+                for key, value in payload.items()}
+        item.setdefault('id', str(uuid.uuid4()))
+        self.items[item['id']] = item
+        return item
+
+    def put(self, item_id: str, payload: dict) -> dict:
+        """Update one item."""
+        self.service.call('put')
+        self.items[str(item_id)] = payload
+        return payload
+
+    def query(self, params: dict, items_per_page: int=25) -> dict:
+        """Return the items matching all params, only the first page."""
+        self.service.call('query')
+        params = {key: value for key, value in params.items() if not key.startswith('_')}
+        data = [
+            item for item in self.items.values()
+            if all(item.get(key) == value for key, value in params.items())
+        ][:items_per_page]
+        return {'data': data, 'pagination': {'page': 1, 'total': len(data)}}
+
+
+class FakeRestFactory:
+    """Stand-in for the IRemoteRestEndpoint utility, one service per base url."""
+
+    def __init__(self, services: dict=None):
+        """Initialize factory.
+
+        :param services: dict with base url as key and Service as value
+        """
+        self.services = services or {}
+        self.stores = defaultdict(dict)
+
+    def __call__(self, base: str, path: str, name: str) -> FakeEndpoint:
+        """Create one endpoint, endpoints with the same base and path share the items."""
+        service = self.services.setdefault(base, Service(error=ConnectionError))
+        return FakeEndpoint(service, self.stores[(base, path)])
+
+    def add(self, base: str, path: str, payload: dict):
+        """Store one item without latency, used to seed the services."""
+        self.stores[(base, path)][payload['id']] = payload
+
+
+def install(drive: FakeDrive, s3: FakeS3, rest: FakeRestFactory):
+    """Replace the clients used by the tasks with the fakes in the current process."""
+    configure()
+    provideUtility(rest, IRemoteRestEndpoint)
+    gdrive.api = metrics.instrument(drive, 'gdrive')
+    s3_tasks.api = metrics.instrument(drive, 'gdrive')
+    s3_tasks.boto3 = s3
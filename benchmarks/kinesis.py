@@ -0,0 +1,104 @@
+"""Benchmark KinesisProducer and KinesisConsumer against a local file backed stream.
+
+Usage::
+
+    python -m benchmarks.kinesis --records 20000 --shards 4
+    python -m benchmarks.kinesis --baseline benchmarks/baseline.json
+"""
+from benchmarks import utils
+from briefy.reflex.tasks import records
+from briefy.reflex.tasks.checkpoint import MemoryCheckpointStore
+from briefy.reflex.tasks.kinesis import KinesisConsumer
+from briefy.reflex.tasks.kinesis import KinesisProducer
+from briefy.reflex.tasks.localkinesis import LocalKinesis
+
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+
+def sample_record(images: int) -> tuple:
+    """Build one order and its folder contents with a number of images."""
+    order_id = str(uuid.uuid4())
+    folder = {
+        'id': str(uuid.uuid4()),
+        'name': 'delivery',
+        'images': [
+            {
+                'id': uuid.uuid4().hex,
+                'name': f'IMG_{index:04d}.jpg',
+                'mimeType': 'image/jpeg',
+                'size': str(random.randint(1000000, 9000000)),
+            }
+            for index in range(images)
+        ],
+        'folders': [],
+    }
+    order = {'id': order_id, 'slug': order_id[:8], 'delivery': {'gdrive': ''}, 'assignments': []}
+    return order, {'delivery': folder, 'archive': {}, 'submissions': []}
+
+
+def client(path: str, args) -> LocalKinesis:
+    """Create a local kinesis client, with AWS limits only if throttling was requested."""
+    limits = {} if args.throttle else {'read_rate': 0, 'write_rate': 0, 'write_bytes_rate': 0}
+    return LocalKinesis(path, shard_count=args.shards, **limits)
+
+
+def produce(path: str, args) -> dict:
+    """Write all records to the stream using the batched producer."""
+    samples = [sample_record(args.images) for _ in range(min(args.records, 100))]
+    producer = KinesisProducer(args.stream, client=client(path, args))
+    total_bytes = 0
+    start = time.perf_counter()
+    for index in range(args.records):
+        order, contents = samples[index % len(samples)]
+        for chunk in records.encode(order, contents):
+            producer.put(chunk, order['id'])
+            total_bytes += len(chunk)
+    producer.flush()
+    elapsed = time.perf_counter() - start
+    return {
+        'records_per_second': args.records / elapsed,
+        'bytes_per_second': total_bytes / elapsed,
+        'seconds': elapsed,
+    }
+
+
+def consume(path: str, args, parallel: bool) -> dict:
+    """Read all records from the stream."""
+    consumer = KinesisConsumer(args.stream, MemoryCheckpointStore(), client=client(path, args))
+    count = 0
+
+    def callback(order, contents):
+        nonlocal count
+        count += 1
+
+    start = time.perf_counter()
+    consumer.run(callback, parallel=parallel)
+    elapsed = time.perf_counter() - start
+    return {'records_per_second': count / elapsed, 'seconds': elapsed}
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--images', type=int, default=50, help='images per record')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--stream', default='benchmark')
+    parser.add_argument('--throttle', action='store_true', help='apply AWS shard limits')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        results = {
+            'kinesis.produce': produce(path, args),
+            'kinesis.consume': consume(path, args, parallel=False),
+            'kinesis.consume_parallel': consume(path, args, parallel=True),
+        }
+    sys.exit(utils.report(results, args))
+
+
+if __name__ == '__main__':
+    main()
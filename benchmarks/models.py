@@ -0,0 +1,120 @@
+"""Benchmark the slotted payload models against briefy.common Objectify.
+
+Usage::
+
+    python -m benchmarks.models --items 100000
+    python -m benchmarks.models --baseline benchmarks/baseline.json
+"""
+from benchmarks import utils
+from briefy.common.utils.data import Objectify
+from briefy.reflex.models import DriveFile
+from briefy.reflex.models import Order
+
+import sys
+import time
+import tracemalloc
+import uuid
+
+
+def drive_file(index: int) -> dict:
+    """Build one gdrive file payload, as returned by briefy.gdrive."""
+    file_id = uuid.uuid4().hex
+    return {
+        'id': file_id,
+        'name': f'IMG_{index:04d}.jpg',
+        'mimeType': 'image/jpeg',
+        'size': '4096000',
+        'md5Checksum': uuid.uuid4().hex,
+        'imageMediaMetadata': {'width': 6000, 'height': 4000, 'rotation': 0},
+        'webViewLink': f'https://drive.google.com/file/d/{file_id}/view',
+        'webContentLink': f'https://drive.google.com/uc?id={file_id}&export=download',
+        'parents': [uuid.uuid4().hex],
+        'kind': 'drive#file',
+    }
+
+
+def order(index: int) -> dict:
+    """Build one order payload with requirement items, as returned by Leica."""
+    def reference():
+        return {'id': str(uuid.uuid4()), 'slug': 'slug', 'title': 'Title', 'description': ''}
+
+    return {
+        'id': str(uuid.uuid4()),
+        'slug': f'1800{index:04d}',
+        'title': f'Order {index}',
+        'description': '',
+        'customer': reference(),
+        'project': reference(),
+        'delivery': {'gdrive': 'https://drive.google.com/drive/folders/xyz', 'archive': ''},
+        'requirement_items': [
+            {
+                'id': str(uuid.uuid4()),
+                'name': f'Item {item}',
+                'category': 'Interior',
+                'tags': ['interior'],
+                'folder_id': uuid.uuid4().hex,
+                'parent_folder_id': uuid.uuid4().hex,
+            }
+            for item in range(5)
+        ],
+    }
+
+
+def access_file(image) -> int:
+    """Read the fields used by add_or_update_asset."""
+    return len(image.id) + len(image.name) + len(image.mimeType) + len(image.size or '')
+
+
+def access_order(item) -> int:
+    """Read the fields used by create_collections and create_assets."""
+    total = len(item.id) + len(item.customer.id) + len(item.project.id)
+    for requirement in item.requirement_items:
+        total += len(requirement.folder_id)
+    return total
+
+
+def measure(factory, access, payloads: list) -> dict:
+    """Measure construction, access and memory of one model class."""
+    start = time.perf_counter()
+    instances = [factory(payload) for payload in payloads]
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for instance in instances:
+        access(instance)
+    accessed = time.perf_counter() - start
+    del instances
+
+    tracemalloc.start()
+    instances = [factory(payload) for payload in payloads]
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+
+    count = len(payloads)
+    return {
+        'build_per_second': count / built,
+        'access_per_second': count / accessed,
+        'bytes_per_instance': allocated / count,
+    }
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--items', type=int, default=100000)
+    args = parser.parse_args()
+
+    files = [drive_file(index) for index in range(args.items)]
+    orders = [order(index) for index in range(args.items // 10)]
+    results = {
+        'models.file.objectify': measure(Objectify, access_file, files),
+        'models.file.slotted': measure(DriveFile.from_dict, access_file, files),
+        'models.order.objectify': measure(Objectify, access_order, orders),
+        'models.order.slotted': measure(Order.from_dict, access_order, orders),
+    }
+    sys.exit(utils.report(results, args))
+
+
+if __name__ == '__main__':
+    main()
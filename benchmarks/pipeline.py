@@ -0,0 +1,224 @@
+"""End to end benchmark of the order import pipeline against local fakes of the services.
+
+Each order is imported by the real tasks: leica.get_order, alexandria.create_collections,
+alexandria.create_assets (gdrive.folder_contents) and, for each image, the chain of
+alexandria.add_or_update_asset and s3.download_and_upload_file. Google drive, S3, Leica and
+Alexandria are replaced by the fakes in benchmarks.fakes.
+
+Modes:
+
+- eager: tasks are executed in the benchmark process, without broker and result backend;
+- worker: in-process celery workers consume the tasks queues, gdrive and s3 queues using the
+  broker and result backend from the configuration (redis must be running).
+
+Usage::
+
+    python -m benchmarks.pipeline --orders 20 --images 50
+    python -m benchmarks.pipeline --mode worker --workers 4 --drive-latency 0.2
+    python -m benchmarks.pipeline --drive-error-rate 0.01 --sizes uniform:1000000:9000000
+    python -m benchmarks.pipeline --baseline benchmarks/baseline.json
+"""
+from benchmarks import utils
+from benchmarks.fakes import FakeDrive
+from benchmarks.fakes import FakeRestFactory
+from benchmarks.fakes import FakeS3
+from benchmarks.fakes import install
+from benchmarks.fakes import Service
+from benchmarks.fakes import SizeDistribution
+from briefy.reflex import config
+from briefy.reflex.celery import app
+from briefy.reflex.tasks import alexandria
+from briefy.reflex.tasks import leica
+from celery import signals
+from celery.contrib.testing import tasks as testing_tasks  # noQA: registers the ping task
+from celery.contrib.testing.worker import start_worker
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextlib import ExitStack
+from requests.exceptions import ConnectionError
+
+import sys
+import threading
+import time
+import uuid
+
+
+class StageTimes:
+    """Collect the duration of each task execution and of the stages run by the benchmark."""
+
+    def __init__(self):
+        """Initialize collector."""
+        self.durations = defaultdict(list)
+        self.retries = defaultdict(int)
+        self.failures = defaultdict(int)
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Connect to the celery task signals."""
+        signals.task_prerun.connect(self.on_prerun, weak=False)
+        signals.task_postrun.connect(self.on_postrun, weak=False)
+        signals.task_retry.connect(self.on_retry, weak=False)
+        signals.task_failure.connect(self.on_failure, weak=False)
+
+    def on_prerun(self, task_id=None, **kwargs):
+        """Task execution started."""
+        self._started[task_id] = time.perf_counter()
+
+    def on_postrun(self, task_id=None, task=None, **kwargs):
+        """Task execution finished."""
+        start = self._started.pop(task_id, None)
+        if start is not None:
+            self.add(task.name.rsplit('.', 1)[-1], time.perf_counter() - start)
+
+    def on_retry(self, sender=None, **kwargs):
+        """Task execution will be retried."""
+        with self._lock:
+            self.retries[sender.name.rsplit('.', 1)[-1]] += 1
+
+    def on_failure(self, sender=None, **kwargs):
+        """Task execution failed."""
+        with self._lock:
+            self.failures[sender.name.rsplit('.', 1)[-1]] += 1
+
+    def add(self, stage: str, seconds: float):
+        """Record the duration of one execution of a stage."""
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time one stage executed by the benchmark itself."""
+        start = time.perf_counter()
+        yield
+        self.add(name, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """Return the number of executions, retries, failures, p50 and p99 of each stage."""
+        result = {}
+        for stage, values in sorted(self.durations.items()):
+            values = sorted(values)
+            result[stage] = {
+                'count': len(values),
+                'retries': self.retries[stage],
+                'failures': self.failures[stage],
+                'p50_seconds': percentile(values, 0.5),
+                'p99_seconds': percentile(values, 0.99),
+            }
+        return result
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Return the nearest rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def seed_order(drive: FakeDrive, rest: FakeRestFactory, images: int) -> str:
+    """Create one order in the fake Leica with a delivery folder in the fake drive."""
+    order_id = str(uuid.uuid4())
+    customer_id = str(uuid.uuid4())
+    project_id = str(uuid.uuid4())
+    order = {
+        'id': order_id,
+        'slug': f'order-{order_id[:8]}',
+        'title': f'Order {order_id[:8]}',
+        'description': '',
+        'customer': {'id': customer_id, 'slug': 'customer', 'title': 'Customer'},
+        'project': {'id': project_id, 'slug': 'project', 'title': 'Project'},
+        'delivery': {'gdrive': drive.add_folder(images), 'archive': ''},
+        'requirement_items': [],
+    }
+    rest.add(config.LEICA_BASE, 'orders', order)
+    return order_id
+
+
+def import_order(order_id: str, times: StageTimes) -> int:
+    """Import one order, return the number of assets imported."""
+    order = leica.get_order.delay(order_id).get()
+    collection = alexandria.create_collections.delay(order).get()
+    with times.stage('create_assets'):
+        assets = alexandria.create_assets(collection, order)
+    result = assets()
+    return sum(1 for item in result.join(propagate=False) if isinstance(item, str))
+
+
+@contextmanager
+def workers(mode: str, count: int):
+    """Start the in-process workers of the worker mode."""
+    if mode == 'eager':
+        app.conf.task_always_eager = True
+        yield
+        return
+
+    app.conf.task_always_eager = False
+    queues = (
+        config.CELERY_DEFAULT_QUEUE,
+        config.CELERY_DEFAULT_QUEUE_DRIVE,
+        config.CELERY_DEFAULT_QUEUE_S3,
+    )
+    with ExitStack() as stack:
+        for queue in queues:
+            for _ in range(count):
+                stack.enter_context(
+                    start_worker(app, pool='solo', queues=[queue], perform_ping_check=False)
+                )
+        yield
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--mode', default='eager', choices=('eager', 'worker'))
+    parser.add_argument('--orders', type=int, default=10)
+    parser.add_argument('--images', type=int, default=20, help='images per order')
+    parser.add_argument('--parallel', type=int, default=4, help='orders imported at a time')
+    parser.add_argument('--workers', type=int, default=4, help='workers per queue')
+    parser.add_argument('--sizes', default='lognormal:4000000:0.5', help='file sizes')
+    parser.add_argument('--drive-latency', type=float, default=0.05)
+    parser.add_argument('--drive-error-rate', type=float, default=0.0)
+    parser.add_argument('--s3-latency', type=float, default=0.05)
+    parser.add_argument('--s3-error-rate', type=float, default=0.0)
+    parser.add_argument('--s3-bandwidth', type=float, default=0.0, help='bytes per second')
+    parser.add_argument('--rest-latency', type=float, default=0.02)
+    parser.add_argument('--rest-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    drive = FakeDrive(
+        Service(args.drive_latency, error_rate=args.drive_error_rate),
+        SizeDistribution(args.sizes)
+    )
+    s3 = FakeS3(Service(args.s3_latency, error_rate=args.s3_error_rate), args.s3_bandwidth)
+    rest = FakeRestFactory({
+        base: Service(args.rest_latency, error_rate=args.rest_error_rate, error=ConnectionError)
+        for base in (config.LEICA_BASE, config.ALEXANDRIA_BASE)
+    })
+    install(drive, s3, rest)
+    order_ids = [seed_order(drive, rest, args.images) for _ in range(args.orders)]
+
+    times = StageTimes()
+    times.connect()
+    with workers(args.mode, args.workers):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+            assets = sum(executor.map(lambda order_id: import_order(order_id, times), order_ids))
+        elapsed = time.perf_counter() - start
+
+    name = f'pipeline.{args.mode}'
+    results = {
+        name: {
+            'orders_per_second': args.orders / elapsed,
+            'assets_per_second': assets / elapsed,
+            'bytes_per_second': s3.bytes_uploaded / elapsed,
+            'assets': assets,
+        }
+    }
+    for stage, metrics in times.summary().items():
+        results[f'{name}.{stage}'] = metrics
+    sys.exit(utils.report(results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Verify the pool type of each worker profile against a synthetic workload of its queue.
+
+Each workload mixes waiting on the network (drive, S3 and REST latency) with CPU work (hashing
+the transferred bytes). It is executed with threads (as eventlet green threads) and
+with processes (prefork) at the profile concurrency, and the profile pool should be the
+fastest one.
+
+Usage::
+
+    python -m benchmarks.pools --tasks 200
+    python -m benchmarks.pools --baseline benchmarks/baseline.json
+"""
+from benchmarks import utils
+from briefy.reflex.tasks.worker import PREFORK_POOLS
+from briefy.reflex.tasks.worker import PROFILES
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+import hashlib
+import os
+import sys
+import time
+
+
+WORKLOADS = {
+    'tasks': {'latency': 0.05, 'cpu_bytes': 0},
+    'gdrive': {'latency': 0.2, 'cpu_bytes': 64 * 1024},
+    's3': {'latency': 0.5, 'cpu_bytes': 4 * 1024 * 1024},
+}
+"""Network latency in seconds and bytes hashed by one task of each queue."""
+
+
+def task(latency: float, cpu_bytes: int) -> int:
+    """Simulate one task: wait for the network, then hash the payload."""
+    time.sleep(latency)
+    if cpu_bytes:
+        hashlib.md5(os.urandom(cpu_bytes)).hexdigest()
+    return cpu_bytes
+
+
+def run_green(concurrency: int, tasks: int, workload: dict) -> float:
+    """Execute the workload in a thread pool, return the elapsed time.
+
+    Threads stand in for eventlet green threads: both overlap the network waits and run the
+    CPU work of all tasks in one process.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(
+            task, [workload['latency']] * tasks, [workload['cpu_bytes']] * tasks
+        ))
+    return time.perf_counter() - start
+
+
+def run_prefork(concurrency: int, tasks: int, workload: dict) -> float:
+    """Execute the workload in a process pool, return the elapsed time."""
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(
+            task, [workload['latency']] * tasks, [workload['cpu_bytes']] * tasks
+        ))
+    return time.perf_counter() - start
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--tasks', type=int, default=200, help='tasks per queue')
+    args = parser.parse_args()
+
+    results = {}
+    mismatches = []
+    for name, profile in sorted(PROFILES.items()):
+        workload = WORKLOADS[name]
+        concurrency = int(profile['concurrency'])
+        green = args.tasks / run_green(concurrency, args.tasks, workload)
+        prefork = args.tasks / run_prefork(concurrency, args.tasks, workload)
+        results[f'pools.{name}.green'] = {'tasks_per_second': green}
+        results[f'pools.{name}.prefork'] = {'tasks_per_second': prefork}
+        best = 'prefork' if prefork > green else 'eventlet'
+        chosen = 'prefork' if profile['pool'] in PREFORK_POOLS else 'eventlet'
+        if best != chosen:
+            mismatches.append(f'{name}: profile uses {chosen} but {best} is faster')
+
+    code = utils.report(results, args)
+    for mismatch in mismatches:
+        print(mismatch)
+    sys.exit(code or int(bool(mismatches)))
+
+
+if __name__ == '__main__':
+    main()
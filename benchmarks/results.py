@@ -0,0 +1,84 @@
+"""Report result backend keys and bytes written by one order import, legacy and lean policies.
+
+The legacy policy stores the STARTED state and the json result of every task, the lean policy
+stores only the msgpack result of the last link of each asset chain.
+
+Usage::
+
+    python -m benchmarks.results --images 5000
+    python -m benchmarks.results --scan redis://localhost:6379/2
+"""
+from benchmarks import utils
+from briefy.reflex.tasks.config import INTERMEDIATE_TASKS
+from kombu.serialization import dumps
+
+import redis
+import sys
+import uuid
+
+
+CHAIN = (
+    ('briefy.reflex.tasks.alexandria.add_or_update_asset', ('/tmp/assets/order', 'file.jpg')),
+    ('briefy.reflex.tasks.s3.download_and_upload_file', 'source/assets/file.jpg'),
+)
+"""Tasks executed for each asset and a typical result of each one."""
+
+
+def meta(status: str, result) -> dict:
+    """Task meta stored by the redis result backend."""
+    return {
+        'status': status,
+        'result': result,
+        'traceback': None,
+        'children': [],
+        'task_id': str(uuid.uuid4()),
+    }
+
+
+def policy(images: int, serializer: str, track_started: bool, lean: bool) -> dict:
+    """Compute the keys, writes and bytes of one import with a result policy."""
+    keys = writes = total_bytes = 0
+    for name, result in CHAIN:
+        if lean and name in INTERMEDIATE_TASKS:
+            continue
+        size = len(dumps(meta('SUCCESS', result), serializer=serializer)[2])
+        keys += 1
+        writes += 1
+        if track_started:
+            size += len(dumps(meta('STARTED', {'pid': 1, 'hostname': 'worker'}), serializer)[2])
+            writes += 1
+        total_bytes += size
+    return {'keys': keys * images, 'writes': writes * images, 'bytes': total_bytes * images}
+
+
+def scan(url: str) -> dict:
+    """Count the task result keys and bytes stored in a redis result backend."""
+    client = redis.StrictRedis.from_url(url)
+    keys = total_bytes = 0
+    for key in client.scan_iter(match='celery-task-meta-*', count=1000):
+        keys += 1
+        total_bytes += client.strlen(key)
+    return {'keys': keys, 'bytes': total_bytes}
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--images', type=int, default=5000, help='images in the order')
+    parser.add_argument('--scan', default='', help='redis result backend url to scan')
+    args = parser.parse_args()
+
+    legacy = policy(args.images, 'json', track_started=True, lean=False)
+    lean = policy(args.images, 'msgpack', track_started=False, lean=True)
+    for metric in ('keys', 'writes', 'bytes'):
+        saved = legacy[metric] - lean[metric]
+        print(f'{metric} saved: {saved} ({saved / legacy[metric]:.0%})')
+
+    results = {'results.legacy': legacy, 'results.lean': lean}
+    if args.scan:
+        results['results.backend'] = scan(args.scan)
+    sys.exit(utils.report(results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Measure the import time of each entry point in a fresh interpreter.
+
+Usage::
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --detail briefy.reflex.tasks.worker
+    python -m benchmarks.startup --baseline benchmarks/baseline.json
+"""
+from benchmarks import utils
+
+import subprocess
+import sys
+import time
+
+
+ENTRY_POINTS = (
+    'briefy.reflex',
+    'briefy.reflex.tasks.worker',
+    'briefy.reflex.queue.worker',
+    'briefy.reflex.autoscale',
+    'briefy.reflex.tasks.gdrive',
+    'briefy.reflex.tasks.kinesis',
+)
+"""Modules imported by the console scripts and command line tools."""
+
+
+def import_time(module: str, repeat: int) -> float:
+    """Return the best wall time to import a module in a new interpreter."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', f'import {module}'])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def detail(module: str, top: int=20):
+    """Print the modules with the highest cumulative import time (python -X importtime)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f'{cumulative / 1e6:8.3f}s {name}')
+
+
+def main():
+    """Execute the benchmark."""
+    parser = utils.parser(__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--detail', default='', help='print the slowest imports of a module')
+    args = parser.parse_args()
+
+    if args.detail:
+        detail(args.detail)
+        return
+
+    baseline = import_time('sys', args.repeat)
+    results = {
+        f'startup.{module}': {'seconds': import_time(module, args.repeat) - baseline}
+        for module in ENTRY_POINTS
+    }
+    sys.exit(utils.report(results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Helpers to report benchmark results and compare them with a stored baseline."""
+import argparse
+import json
+import os
+import sys
+
+
+def parser(description: str) -> argparse.ArgumentParser:
+    """Create an argument parser with the baseline options shared by all benchmarks."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--baseline', default='', help='json file with baseline results')
+    parser.add_argument(
+        '--save-baseline', action='store_true', help='save the results as the new baseline'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2, help='accepted relative regression'
+    )
+    return parser
+
+
+def higher_is_better(metric: str) -> bool:
+    """Throughput metrics should go up, all the others (latency, memory, time) should go down."""
+    return metric.endswith('_per_second')
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Compare results with the baseline.
+
+    :param results: dict with benchmark name as key and a dict of metrics as value
+    :param baseline: results of a previous execution
+    :param tolerance: accepted relative regression
+    :return: list of tuples composed of (benchmark, metric, baseline value, value)
+    """
+    found = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            expected = baseline.get(name, {}).get(metric)
+            if not isinstance(expected, (int, float)) or not expected:
+                continue
+            if higher_is_better(metric):
+                regression = value < expected * (1 - tolerance)
+            else:
+                regression = value > expected * (1 + tolerance)
+            if regression:
+                found.append((name, metric, expected, value))
+    return found
+
+
+def report(results: dict, args: argparse.Namespace) -> int:
+    """Print the results, compare with the baseline and optionally save a new baseline.
+
+    :param results: dict with benchmark name as key and a dict of metrics as value
+    :param args: parsed command line arguments
+    :return: exit code, 1 if a regression was found
+    """
+    for name, metrics in results.items():
+        values = ', '.join(
+            f'{metric}={value:.4g}' if isinstance(value, float) else f'{metric}={value}'
+            for metric, value in metrics.items()
+        )
+        print(f'{name}: {values}')
+
+    if not args.baseline:
+        return 0
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fin:
+                baseline = json.load(fin)
+        baseline.update(results)
+        with open(args.baseline, 'w') as fout:
+            json.dump(baseline, fout, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    with open(args.baseline) as fin:
+        baseline = json.load(fin)
+    found = regressions(results, baseline, args.tolerance)
+    for name, metric, expected, value in found:
+        message = f'REGRESSION {name}.{metric}: baseline {expected:.4g}, now {value:.4g}'
+        print(message, file=sys.stderr)
+    return 1 if found else 0
@@ -1,4 +1,3 @@
 #!/bin/sh
 /docker_entrypoint.sh && NEW_RELIC_CONFIG_FILE=/app/newrelic-tasks-worker.ini newrelic-admin run-program \
-celery -A briefy.reflex.tasks --events --uid=33 --concurrency=${CELERY_CONCURRENCY_DEFAULT} --loglevel=INFO \
--Q briefy_reflex -P eventlet -n briefy-reflex-tasks-dev worker
+tasks_worker tasks
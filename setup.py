@@ -16,11 +16,14 @@ requires = [
     'celery',
     'eventlet',
     'flower',
+    'msgpack',
     'prettyconf',
+    'redis',
     'setuptools',
 ]
 
 test_requirements = [
+    'fakeredis',
     'flake8',
     'pytest'
 ]
@@ -47,9 +50,15 @@ setup(
     test_suite='tests',
     tests_require=test_requirements,
     install_requires=requires,
+    extras_require={
+        'renditions': ['Pillow'],
+        'zstd': ['zstandard'],
+    },
     entry_points="""
     [console_scripts]
       tasks_worker = briefy.reflex.tasks.worker:main
       queue_worker = briefy.reflex.queue.worker:main
+      autoscaler = briefy.reflex.autoscale:main
+      reflex_profile = briefy.reflex.profiling:main
     """,
 )
@@ -1,10 +1,8 @@
 """briefy.reflex."""
-from briefy import common
-from briefy import gdrive
-from briefy import reflex
-from zope.configuration.xmlconfig import XMLConfig
+from zope.component import getUtility
 
 import logging
+import threading
 
 
 logger = logging.getLogger(__name__)
@@ -15,6 +13,39 @@ cs.setLevel(logging.INFO)
 logger.addHandler(cs)
 
 
-XMLConfig('configure.zcml', common)()
-XMLConfig('configure.zcml', gdrive)()
-XMLConfig('configure.zcml', reflex)()
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    """Load the ZCML configuration of briefy.common, briefy.gdrive and briefy.reflex.
+
+    Components are registered on first use instead of at import time, so entry points and
+    tasks that do not need them start faster. Calling it again does nothing.
+    """
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        from briefy import common
+        from briefy import gdrive
+        from briefy import reflex
+        from zope.configuration.xmlconfig import XMLConfig
+
+        XMLConfig('configure.zcml', common)()
+        XMLConfig('configure.zcml', gdrive)()
+        XMLConfig('configure.zcml', reflex)()
+        _configured = True
+
+
+def get_utility(interface, name: str=''):
+    """Return a registered utility, loading the ZCML configuration if needed.
+
+    :param interface: utility interface
+    :param name: utility name
+    :return: utility instance
+    """
+    configure()
+    return getUtility(interface, name)
@@ -0,0 +1,351 @@
+"""Queue depth driven autoscaling of the reflex celery worker pools.
+
+The controller samples the length of each pool queue in the redis broker and the mean task
+runtime recorded by the workers, computes the number of replicas needed to drain the queue in
+AUTOSCALE_DRAIN_SECONDS and applies it using a scaler backend:
+
+- scale up right away, scale down only after the demand stays lower for AUTOSCALE_DOWN_DELAY;
+- pools calling google drive (gdrive and s3) share the AUTOSCALE_DRIVE_QUOTA ceiling.
+"""
+from abc import ABC
+from abc import abstractmethod
+from briefy.reflex import config
+from briefy.reflex import logger
+from briefy.reflex.tasks.config import task_queue
+from briefy.reflex.tasks.runtime import RUNTIME_KEY
+from collections import defaultdict
+
+import argparse
+import math
+import redis
+import subprocess
+import sys
+import time
+
+
+PRIORITY_SEPARATOR = '\x06\x16'
+"""Separator used by the kombu redis transport in the name of the priority lists of a queue."""
+
+
+class Pool:
+    """Worker pool consuming one queue."""
+
+    def __init__(
+            self, name: str, queue: str, concurrency: int, drive: bool=False,
+            pool: str='eventlet', min_replicas: int=config.AUTOSCALE_MIN_REPLICAS,
+            max_replicas: int=config.AUTOSCALE_MAX_REPLICAS
+    ):
+        """Initialize pool.
+
+        :param name: process type name, as used in the Procfile
+        :param queue: celery queue name
+        :param concurrency: tasks executed at the same time by one replica
+        :param drive: if true the pool tasks call the google drive api
+        :param pool: celery pool type of the workers
+        :param min_replicas: min number of replicas
+        :param max_replicas: max number of replicas
+        """
+        self.name = name
+        self.queue = queue
+        self.concurrency = int(concurrency)
+        self.drive = drive
+        self.pool = pool
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+
+
+def default_pools() -> list:
+    """Return the pools defined in the Procfile."""
+    return [
+        Pool(
+            'tasks', config.CELERY_DEFAULT_QUEUE, config.CELERY_CONCURRENCY_DEFAULT,
+            pool=config.CELERY_POOL_DEFAULT
+        ),
+        Pool(
+            'gdrive', config.CELERY_DEFAULT_QUEUE_DRIVE, config.CELERY_CONCURRENCY_GDRIVE,
+            drive=True, pool=config.CELERY_POOL_GDRIVE
+        ),
+        Pool(
+            's3', config.CELERY_DEFAULT_QUEUE_S3, config.CELERY_CONCURRENCY_S3, drive=True,
+            pool=config.CELERY_POOL_S3
+        ),
+    ]
+
+
+def rate_per_second(rate: str) -> float:
+    """Convert a celery rate limit string (10/s, 100/m, 1000/h) to requests per second."""
+    if not rate:
+        return 0.0
+    value, _, unit = str(rate).partition('/')
+    return float(value) / {'': 1, 's': 1, 'm': 60, 'h': 3600}[unit]
+
+
+class Scaler(ABC):
+    """Base class for scaler backends."""
+
+    def refresh(self):
+        """Start a new autoscaling cycle, forgetting any state read in the previous one."""
+
+    @abstractmethod
+    def current(self, pool: Pool) -> int:
+        """Return the current number of replicas of a pool."""
+
+    @abstractmethod
+    def scale(self, pool: Pool, replicas: int):
+        """Change the number of replicas of a pool."""
+
+
+class DeisScaler(Scaler):
+    """Scale the process types of a deis application."""
+
+    def __init__(self, app: str=config.AUTOSCALE_DEIS_APP):
+        """Initialize scaler.
+
+        :param app: deis application name, empty to use the application of the current directory
+        """
+        self.app = app
+        self._replicas = {}
+
+    def _command(self, *args) -> list:
+        """Build one deis command line."""
+        command = ['deis', *args]
+        if self.app:
+            command.extend(['-a', self.app])
+        return command
+
+    def refresh(self):
+        """Forget the replicas counted in the previous cycle.
+
+        Replicas change outside the autoscaler (crashes, deploys or a manual ps:scale), so deis
+        ps is listed again in each cycle.
+        """
+        self._replicas = {}
+
+    def current(self, pool: Pool) -> int:
+        """Return the number of replicas of a pool, counting the lines of deis ps."""
+        if pool.name not in self._replicas:
+            output = subprocess.check_output(self._command('ps:list'), universal_newlines=True)
+            self._replicas[pool.name] = sum(
+                1 for line in output.splitlines() if f'-{pool.name}-' in line
+            )
+        return self._replicas[pool.name]
+
+    def scale(self, pool: Pool, replicas: int):
+        """Change the number of replicas of a pool."""
+        subprocess.check_call(self._command('ps:scale', f'{pool.name}={replicas}'))
+        self._replicas[pool.name] = replicas
+
+
+LOCAL_WORKER_COMMAND = (
+    'celery -A briefy.reflex.tasks worker -Q {queue} -c {concurrency} -P {pool}'
+)
+"""Command line of one local worker, formatted with the pool attributes."""
+
+
+class LocalScaler(Scaler):
+    """Spawn one local celery worker process per replica, used for testing."""
+
+    def __init__(self, command: str=LOCAL_WORKER_COMMAND):
+        """Initialize scaler.
+
+        :param command: worker command line template, formatted with the pool attributes
+        """
+        self.command = command
+        self._processes = defaultdict(list)
+
+    def current(self, pool: Pool) -> int:
+        """Return the number of live worker processes of a pool."""
+        processes = [process for process in self._processes[pool.name] if process.poll() is None]
+        self._processes[pool.name] = processes
+        return len(processes)
+
+    def scale(self, pool: Pool, replicas: int):
+        """Start or terminate worker processes."""
+        processes = self._processes[pool.name]
+        while len(processes) < replicas:
+            args = self.command.format(**vars(pool)).split()
+            processes.append(subprocess.Popen(args))
+        while len(processes) > replicas:
+            process = processes.pop()
+            process.terminate()
+            process.wait()
+
+    def shutdown(self):
+        """Terminate all worker processes."""
+        for processes in self._processes.values():
+            for process in processes:
+                process.terminate()
+        self._processes.clear()
+
+
+class Autoscaler:
+    """Compute and apply the number of replicas of each pool from its queue depth."""
+
+    def __init__(
+            self, scaler: Scaler, pools: list=None, broker_url: str=config.TASKS_BROKER,
+            drain_seconds: float=config.AUTOSCALE_DRAIN_SECONDS,
+            down_delay: float=config.AUTOSCALE_DOWN_DELAY,
+            drive_quota: float=config.AUTOSCALE_DRIVE_QUOTA,
+            drive_rate_limit: str=config.GDRIVE_RATE_LIMIT,
+            default_runtime: float=1.0
+    ):
+        """Initialize autoscaler.
+
+        :param scaler: scaler backend
+        :param pools: list of pools, default to the pools in the Procfile
+        :param broker_url: redis broker url
+        :param drain_seconds: target time to drain each queue
+        :param down_delay: seconds the demand must stay lower before scaling down
+        :param drive_quota: google drive requests per second shared by all drive pools
+        :param drive_rate_limit: celery rate limit of the drive tasks in each replica
+        :param default_runtime: task runtime used before any runtime is recorded
+        """
+        self.scaler = scaler
+        self.pools = pools or default_pools()
+        self.redis = redis.StrictRedis.from_url(broker_url, decode_responses=True)
+        self.drain_seconds = drain_seconds
+        self.down_delay = down_delay
+        self.drive_quota = drive_quota
+        self.drive_rate_limit = rate_per_second(drive_rate_limit)
+        self.runtimes = {pool.name: default_runtime for pool in self.pools}
+        self._totals = {}
+        self._lower_since = {}
+        self._lower_max = {}
+
+    def depth(self, pool: Pool) -> int:
+        """Return the number of messages waiting in the queue of a pool, in all priorities."""
+        names = [pool.queue] + [f'{pool.queue}{PRIORITY_SEPARATOR}{p}' for p in range(1, 10)]
+        pipeline = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipeline.llen(name)
+        return sum(pipeline.execute())
+
+    def update_runtimes(self):
+        """Update the mean task runtime of each pool with the executions since the last sample."""
+        totals = self.redis.hgetall(RUNTIME_KEY)
+        seconds = defaultdict(float)
+        count = defaultdict(int)
+        for field, value in totals.items():
+            name, _, metric = field.rpartition(':')
+            delta = float(value) - float(self._totals.get(field, 0))
+            queue = task_queue(name)
+            if metric == 'seconds':
+                seconds[queue] += delta
+            else:
+                count[queue] += int(delta)
+        self._totals = totals
+        for pool in self.pools:
+            if count[pool.queue] > 0:
+                self.runtimes[pool.name] = seconds[pool.queue] / count[pool.queue]
+
+    def desired(self, pool: Pool, depth: int) -> int:
+        """Replicas needed to drain the queue of a pool in drain_seconds."""
+        runtime = self.runtimes[pool.name]
+        per_replica = pool.concurrency / runtime
+        replicas = math.ceil(depth / (per_replica * self.drain_seconds)) if depth else 0
+        return max(pool.min_replicas, min(pool.max_replicas, replicas))
+
+    def drive_rate(self, pool: Pool) -> float:
+        """Drive requests per second of one replica of a pool."""
+        rate = pool.concurrency / self.runtimes[pool.name]
+        return min(rate, self.drive_rate_limit) if self.drive_rate_limit else rate
+
+    def apply_drive_ceiling(self, targets: dict) -> dict:
+        """Reduce the drive pools targets proportionally if they exceed the drive quota."""
+        if not self.drive_quota:
+            return targets
+        drive_pools = [pool for pool in self.pools if pool.drive]
+        demand = sum(targets[pool.name] * self.drive_rate(pool) for pool in drive_pools)
+        if demand <= self.drive_quota:
+            return targets
+        factor = self.drive_quota / demand
+        for pool in drive_pools:
+            targets[pool.name] = max(pool.min_replicas, int(targets[pool.name] * factor))
+        return targets
+
+    def hysteresis(self, pool: Pool, target: int, current: int, now: float) -> int:
+        """Scale up right away, scale down only after the demand stays lower for down_delay."""
+        if target >= current:
+            self._lower_since.pop(pool.name, None)
+            self._lower_max.pop(pool.name, None)
+            return target
+        since = self._lower_since.setdefault(pool.name, now)
+        # scale down to the highest demand seen while waiting
+        self._lower_max[pool.name] = max(self._lower_max.get(pool.name, target), target)
+        if now - since < self.down_delay:
+            return current
+        self._lower_since.pop(pool.name)
+        return self._lower_max.pop(pool.name)
+
+    def run_once(self) -> dict:
+        """Sample the queues and scale all the pools.
+
+        :return: dict with pool name as key and a dict with depth, runtime, current and target
+        """
+        now = time.monotonic()
+        self.scaler.refresh()
+        self.update_runtimes()
+        depths = {pool.name: self.depth(pool) for pool in self.pools}
+        targets = {pool.name: self.desired(pool, depths[pool.name]) for pool in self.pools}
+        targets = self.apply_drive_ceiling(targets)
+        report = {}
+        for pool in self.pools:
+            current = self.scaler.current(pool)
+            target = self.hysteresis(pool, targets[pool.name], current, now)
+            if target != current:
+                logger.info(
+                    f'Scaling {pool.name} from {current} to {target} replicas '
+                    f'(queue depth {depths[pool.name]}, runtime {self.runtimes[pool.name]:.2f}s).'
+                )
+                self.scaler.scale(pool, target)
+            report[pool.name] = {
+                'depth': depths[pool.name],
+                'runtime': self.runtimes[pool.name],
+                'current': current,
+                'target': target,
+            }
+        return report
+
+    def run(self, interval: float=config.AUTOSCALE_INTERVAL):
+        """Scale the pools forever."""
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Failure scaling the worker pools.')
+            time.sleep(interval)
+
+
+SCALERS = {
+    'deis': DeisScaler,
+    'local': LocalScaler,
+}
+"""Scaler backends by name."""
+
+
+def main():
+    """Run the autoscaler."""
+    parser = argparse.ArgumentParser(description='Queue depth driven autoscaling of workers.')
+    parser.add_argument('--backend', default=config.AUTOSCALE_BACKEND, choices=sorted(SCALERS))
+    parser.add_argument('--interval', type=float, default=config.AUTOSCALE_INTERVAL)
+    parser.add_argument('--once', action='store_true', help='sample and scale only once')
+    args = parser.parse_args()
+
+    scaler = SCALERS[args.backend]()
+    autoscaler = Autoscaler(scaler)
+    try:
+        if args.once:
+            for name, values in autoscaler.run_once().items():
+                print(f'{name}: {values}')
+        else:
+            autoscaler.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(scaler, LocalScaler):
+            scaler.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Circuit breakers shared by all workers for the Leica, Alexandria and google drive backends.
+
+The outcome and latency of each call to a backend (see briefy.reflex.metrics.timed) are counted
+in the worker and added to a sliding window in redis once per second. When the error rate or
+the slow call rate of the window goes over the threshold the circuit opens:
+
+- open: tasks using the backend are deferred before doing any work, without using their retries;
+- half-open: after BREAKER_OPEN_SECONDS one task per BREAKER_PROBE_INTERVAL runs as a probe;
+- closed: the probe call succeeded, tasks run again. If it failed the circuit opens again.
+
+Redis failures never block the tasks, the circuit is considered closed.
+"""
+from briefy.reflex import config
+from briefy.reflex import logger
+from briefy.reflex import metrics
+
+import random
+import redis
+import threading
+import time
+import typing as t
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """The circuit of a backend is open, the task should be deferred."""
+
+    def __init__(self, backend: str, retry_after: float):
+        """Initialize exception.
+
+        :param backend: backend name
+        :param retry_after: seconds to wait before trying again
+        """
+        super().__init__(f'Circuit of {backend} is open, retry after {retry_after:.0f}s.')
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker of one backend, with its state in redis."""
+
+    prefix = 'reflex:breaker'
+    """Prefix of the redis keys."""
+
+    def __init__(
+            self, name: str, client: redis.StrictRedis,
+            error_rate: float=config.BREAKER_ERROR_RATE,
+            slow_seconds: float=config.BREAKER_SLOW_SECONDS,
+            slow_rate: float=config.BREAKER_SLOW_RATE,
+            min_calls: int=config.BREAKER_MIN_CALLS,
+            window: int=config.BREAKER_WINDOW,
+            open_seconds: float=config.BREAKER_OPEN_SECONDS,
+            probe_interval: float=config.BREAKER_PROBE_INTERVAL,
+            refresh: float=1.0
+    ):
+        """Initialize circuit breaker.
+
+        :param name: backend name
+        :param client: redis client
+        :param error_rate: fraction of failed calls opening the circuit
+        :param slow_seconds: calls slower than this are counted as slow
+        :param slow_rate: fraction of slow calls opening the circuit
+        :param min_calls: min number of calls in the window to evaluate the rates
+        :param window: seconds of the sliding window, in buckets of 10 seconds
+        :param open_seconds: seconds the circuit stays open before the first probe
+        :param probe_interval: min seconds between two probes in half-open state
+        :param refresh: seconds between reads and writes of the shared state
+        """
+        self.name = name
+        self.redis = client
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.bucket_seconds = 10
+        self.buckets = max(1, window // self.bucket_seconds)
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._counts = {'calls': 0, 'errors': 0, 'slow': 0}
+        self._last_flush = time.monotonic()
+        self._state = CLOSED
+        self._state_at = 0.0
+
+    def _key(self, suffix: str) -> str:
+        """Redis key of the backend."""
+        return f'{self.prefix}:{self.name}:{suffix}'
+
+    def state(self) -> str:
+        """Return the state of the circuit, read from redis at most once per refresh."""
+        now = time.monotonic()
+        if now - self._state_at < self.refresh:
+            return self._state
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.exists(self._key('open'))
+            pipeline.exists(self._key('tripped'))
+            is_open, tripped = pipeline.execute()
+        except redis.RedisError as exc:
+            logger.debug(f'Failure reading circuit {self.name}: {exc!r}')
+            is_open = tripped = False
+        self._state = OPEN if is_open else HALF_OPEN if tripped else CLOSED
+        self._state_at = now
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds to defer a task, with jitter so deferred tasks do not come back together."""
+        try:
+            ttl = self.redis.ttl(self._key('open'))
+        except redis.RedisError:
+            ttl = None
+        wait = ttl if ttl and ttl > 0 else self.probe_interval
+        return wait + random.uniform(0, self.probe_interval)
+
+    def allow(self) -> bool:
+        """Check if a task using the backend can run now.
+
+        In half-open state only the task taking the probe lock runs.
+        """
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        try:
+            probe = self.redis.set(
+                self._key('probe'), '1', nx=True, ex=int(max(1, self.probe_interval))
+            )
+            return bool(probe)
+        except redis.RedisError:
+            return True
+
+    def check(self):
+        """Raise CircuitOpen if a task using the backend cannot run now."""
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_after())
+
+    def record(self, seconds: float, failed: bool):
+        """Count the outcome of one call to the backend.
+
+        :param seconds: call latency
+        :param failed: true if the call raised an exception
+        """
+        if self._state == HALF_OPEN:
+            self._probe_result(failed)
+        with self._lock:
+            self._counts['calls'] += 1
+            self._counts['errors'] += int(failed)
+            self._counts['slow'] += int(seconds >= self.slow_seconds)
+            if time.monotonic() - self._last_flush < self.refresh:
+                return
+            counts = self._counts
+            self._counts = {'calls': 0, 'errors': 0, 'slow': 0}
+            self._last_flush = time.monotonic()
+        self.flush(counts)
+
+    def _probe_result(self, failed: bool):
+        """Close or open again the circuit with the result of a call in half-open state."""
+        try:
+            if failed:
+                self.trip()
+            else:
+                self.redis.delete(self._key('tripped'), *self._window_keys())
+                self._state = CLOSED
+                logger.info(f'Circuit of {self.name} closed.')
+        except redis.RedisError as exc:
+            logger.debug(f'Failure updating circuit {self.name}: {exc!r}')
+
+    def _window_keys(self) -> t.List[str]:
+        """Redis keys of the buckets of the sliding window, the current one first."""
+        current = int(time.time() // self.bucket_seconds)
+        return [self._key(f'window:{current - index}') for index in range(self.buckets)]
+
+    def flush(self, counts: dict):
+        """Add the local counts to the current bucket and evaluate the window."""
+        try:
+            keys = self._window_keys()
+            pipeline = self.redis.pipeline(transaction=False)
+            for field, value in counts.items():
+                if value:
+                    pipeline.hincrby(keys[0], field, value)
+            pipeline.expire(keys[0], self.bucket_seconds * (self.buckets + 1))
+            for key in keys:
+                pipeline.hgetall(key)
+            window = pipeline.execute()[-len(keys):]
+        except redis.RedisError as exc:
+            logger.debug(f'Failure recording calls of {self.name}: {exc!r}')
+            return
+        totals = {'calls': 0, 'errors': 0, 'slow': 0}
+        for bucket in window:
+            for field, value in bucket.items():
+                field = field.decode() if isinstance(field, bytes) else field
+                totals[field] = totals.get(field, 0) + int(value)
+        if self.should_trip(totals) and self.state() == CLOSED:
+            try:
+                self.trip()
+            except redis.RedisError as exc:
+                logger.debug(f'Failure opening circuit {self.name}: {exc!r}')
+
+    def should_trip(self, totals: dict) -> bool:
+        """Check if the error rate or the slow call rate of the window is over the threshold."""
+        calls = totals['calls']
+        if calls < self.min_calls:
+            return False
+        return (
+            totals['errors'] / calls >= self.error_rate or
+            totals['slow'] / calls >= self.slow_rate
+        )
+
+    def trip(self):
+        """Open the circuit."""
+        pipeline = self.redis.pipeline()
+        pipeline.set(self._key('open'), '1', ex=int(self.open_seconds))
+        pipeline.set(self._key('tripped'), '1')
+        pipeline.execute()
+        self._state = OPEN
+        self._state_at = time.monotonic()
+        logger.warning(f'Circuit of {self.name} open for {self.open_seconds:.0f}s.')
+
+
+BACKENDS = ('leica', 'alexandria', 'gdrive')
+"""Backends protected by a circuit breaker, named as the service label of the metrics."""
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the circuit breaker of a backend shared by the process."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                client = redis.StrictRedis.from_url(config.BREAKER_DB)
+                breaker = _breakers[name] = CircuitBreaker(name, client)
+    return breaker
+
+
+def check(backends: t.Iterable[str]):
+    """Raise CircuitOpen if the circuit of one of the backends is open.
+
+    :param backends: backend names
+    """
+    if not config.BREAKER_ENABLED:
+        return
+    for name in backends:
+        get_breaker(name).check()
+
+
+def is_failure(error: Exception) -> bool:
+    """Check if an exception raised by a call means the backend is failing.
+
+    Client errors (4xx http status, except 429 too many requests) are answers of a healthy
+    backend, as a not found folder or a missing permission.
+    """
+    if error is None:
+        return False
+    response = getattr(error, 'resp', None) or getattr(error, 'response', None)
+    status = getattr(response, 'status', None) or getattr(response, 'status_code', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return True
+    return not (400 <= status < 500 and status != 429)
+
+
+def record_call(service: str, seconds: float, error: Exception=None):
+    """Count one call of a protected backend, called by briefy.reflex.metrics.timed."""
+    if config.BREAKER_ENABLED and service in BACKENDS:
+        get_breaker(service).record(seconds, is_failure(error))
+
+
+metrics.CALL_LISTENERS.append(record_call)
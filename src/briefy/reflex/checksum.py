@@ -0,0 +1,72 @@
+"""Checksums computed while the files downloaded from google drive are written to disk.
+
+The digests are computed in the same pass that writes the bytes, compared with the
+md5Checksum reported by google drive and sent to S3 with the upload (Content-MD5 and optionally
+x-amz-checksum-sha256), so S3 verifies the bytes it received without reading them back.
+"""
+from briefy.reflex.config import CHECKSUM_SHA256
+
+import base64
+import hashlib
+import typing as t
+
+
+CHUNK_SIZE = 1024 * 1024
+"""Bytes hashed and written at a time."""
+
+
+class ChecksumMismatch(OSError):
+    """The bytes received do not match the checksum of the source."""
+
+
+class HashingWriter:
+    """File wrapper computing the MD5, and optionally the SHA-256, of the written bytes."""
+
+    def __init__(self, fileobj: t.BinaryIO, sha256: bool=CHECKSUM_SHA256):
+        """Initialize writer.
+
+        :param fileobj: binary file opened for writing
+        :param sha256: if true also compute the SHA-256 digest
+        """
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256() if sha256 else None
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """Hash and write the data in chunks."""
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            chunk = view[start:start + CHUNK_SIZE]
+            self.md5.update(chunk)
+            if self.sha256 is not None:
+                self.sha256.update(chunk)
+            self.fileobj.write(chunk)
+        self.size += len(view)
+        return len(view)
+
+    def __enter__(self) -> 'HashingWriter':
+        """Use the writer as a context manager, closing the wrapped file."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the wrapped file."""
+        self.fileobj.close()
+
+    def verify(self, md5: str='', name: str=''):
+        """Compare the MD5 of the written bytes with the expected one.
+
+        :param md5: expected MD5 hex digest, nothing is checked if empty
+        :param name: file name used in the error message
+        :raises ChecksumMismatch: if the digests are different
+        """
+        digest = self.md5.hexdigest()
+        if md5 and md5.lower() != digest:
+            raise ChecksumMismatch(f'MD5 of {name} is {digest}, expected {md5}.')
+
+    def checksums(self) -> dict:
+        """Return the digests to be sent with the upload, base64 encoded as S3 expects them."""
+        checksums = {'md5': base64.b64encode(self.md5.digest()).decode('ascii')}
+        if self.sha256 is not None:
+            checksums['sha256'] = base64.b64encode(self.sha256.digest()).decode('ascii')
+        return checksums
@@ -0,0 +1,241 @@
+"""Claim-check of large task arguments and results.
+
+Payloads bigger than a threshold are stored once in a content addressed blob store and the
+task message carries only a reference to it. The worker resolves the reference before running
+the task, keeping the last payloads in a per-process LRU cache, so the same collection or folder
+listing sent to thousands of tasks is read from the store only once per process.
+"""
+from abc import ABC
+from abc import abstractmethod
+from briefy.reflex import logger
+from briefy.reflex.config import CLAIM_CHECK_CACHE_SIZE
+from briefy.reflex.config import CLAIM_CHECK_STORE
+from briefy.reflex.config import CLAIM_CHECK_THRESHOLD
+from briefy.reflex.config import CLAIM_CHECK_TTL
+from collections import OrderedDict
+
+import hashlib
+import json
+import os
+import redis
+import tempfile
+import threading
+
+
+REFERENCE_KEY = '__claim_check__'
+"""Key of the dict used as reference to a stored payload."""
+
+
+class ClaimCheckMissing(LookupError):
+    """The payload of a reference is not available in the blob store anymore."""
+
+
+class BlobStore(ABC):
+    """Base class for blob stores."""
+
+    @abstractmethod
+    def get(self, digest: str) -> bytes:
+        """Get one blob.
+
+        :param digest: sha256 hex digest of the blob
+        :return: blob contents or None if not found
+        """
+
+    @abstractmethod
+    def put(self, digest: str, data: bytes):
+        """Store one blob, if it is not already stored.
+
+        :param digest: sha256 hex digest of the blob
+        :param data: blob contents
+        """
+
+
+class RedisBlobStore(BlobStore):
+    """Store blobs in redis with an expiration time."""
+
+    prefix = 'reflex:claimcheck'
+    """Prefix of the redis keys."""
+
+    def __init__(self, url: str, ttl: int=CLAIM_CHECK_TTL):
+        """Initialize store.
+
+        :param url: redis database url
+        :param ttl: seconds to keep each blob, should be longer than the tasks can wait in queue
+        """
+        self.redis = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, digest: str) -> bytes:
+        """Get one blob."""
+        return self.redis.get(f'{self.prefix}:{digest}')
+
+    def put(self, digest: str, data: bytes):
+        """Store one blob, only refreshing its expiration if it is already stored."""
+        key = f'{self.prefix}:{digest}'
+        if not self.redis.expire(key, self.ttl):
+            self.redis.set(key, data, ex=self.ttl)
+
+
+class DiskBlobStore(BlobStore):
+    """Store blobs in a local directory, shared by the workers running in the same host."""
+
+    def __init__(self, path: str):
+        """Initialize store.
+
+        :param path: directory path
+        """
+        self.path = path
+
+    def _path(self, digest: str) -> str:
+        """Return the file path of one blob."""
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, digest: str) -> bytes:
+        """Get one blob."""
+        try:
+            with open(self._path(digest), 'rb') as fin:
+                return fin.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, digest: str, data: bytes):
+        """Store one blob, writing to a temporary file first so readers never see partial data."""
+        path = self._path(digest)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(data)
+        os.replace(tmp_path, path)
+
+
+def get_store(uri: str=CLAIM_CHECK_STORE) -> BlobStore:
+    """Create a blob store from an uri.
+
+    :param uri: redis://host:port/db or file:///path/to/directory, empty to disable
+    :return: blob store instance or None
+    """
+    if not uri:
+        return None
+    elif uri.startswith('file://'):
+        return DiskBlobStore(uri[len('file://'):])
+    elif uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBlobStore(uri)
+    raise ValueError(f'Unknown claim check store: {uri}')
+
+
+class ClaimCheck:
+    """Replace large payloads by references and resolve them back."""
+
+    def __init__(
+            self, store: BlobStore, threshold: int=CLAIM_CHECK_THRESHOLD,
+            cache_size: int=CLAIM_CHECK_CACHE_SIZE
+    ):
+        """Initialize claim check.
+
+        :param store: blob store, if None payloads are always sent by value
+        :param threshold: min size in bytes of the serialized payload to be stored
+        :param cache_size: number of resolved payloads kept in memory
+        """
+        self.store = store
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_get(self, digest: str):
+        """Return a payload from the LRU cache or None."""
+        with self._lock:
+            value = self._cache.get(digest)
+            if value is not None:
+                self._cache.move_to_end(digest)
+            return value
+
+    def _cache_set(self, digest: str, value):
+        """Add a payload to the LRU cache."""
+        with self._lock:
+            self._cache[digest] = value
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def check(self, value):
+        """Store a payload if it is bigger than the threshold.
+
+        :param value: json serializable payload
+        :return: reference to the stored payload or the payload itself
+        """
+        if not self.store or not isinstance(value, (dict, list)) or is_reference(value):
+            return value
+        data = json.dumps(value, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        if len(data) < self.threshold:
+            return value
+        digest = hashlib.sha256(data).hexdigest()
+        # put even if cached, refreshing the expiration of a blob stored by an older message
+        self.store.put(digest, data)
+        self._cache_set(digest, value)
+        return {REFERENCE_KEY: digest, 'size': len(data)}
+
+    def resolve(self, value):
+        """Return the payload of a reference.
+
+        Resolved payloads are shared by all the tasks of the process and must not be changed.
+
+        :param value: reference or any other value, returned as is
+        :return: payload
+        """
+        if not is_reference(value):
+            return value
+        digest = value[REFERENCE_KEY]
+        payload = self._cache_get(digest)
+        if payload is None:
+            data = self.store.get(digest) if self.store else None
+            if data is None:
+                raise ClaimCheckMissing(f'Payload {digest} not found in the claim check store.')
+            payload = json.loads(data.decode('utf-8'))
+            self._cache_set(digest, payload)
+        return payload
+
+    def resolve_args(self, args: tuple, kwargs: dict) -> tuple:
+        """Resolve all references in the arguments of a task.
+
+        :param args: positional arguments
+        :param kwargs: keyword arguments
+        :return: tuple composed of (args, kwargs)
+        """
+        if not any(is_reference(value) for value in args) and \
+                not any(is_reference(value) for value in kwargs.values()):
+            return args, kwargs
+        args = tuple(self.resolve(value) for value in args)
+        kwargs = {key: self.resolve(value) for key, value in kwargs.items()}
+        return args, kwargs
+
+
+def is_reference(value) -> bool:
+    """Check if the value is a claim check reference."""
+    return isinstance(value, dict) and REFERENCE_KEY in value
+
+
+_claim_check = None
+
+
+def get_claim_check() -> ClaimCheck:
+    """Return the claim check shared by the process."""
+    global _claim_check
+    if _claim_check is None:
+        _claim_check = ClaimCheck(get_store())
+        if _claim_check.store:
+            logger.info(f'Claim check enabled for payloads over {_claim_check.threshold} bytes.')
+    return _claim_check
+
+
+def check(value):
+    """Store a payload if it is bigger than the threshold, see :meth:`ClaimCheck.check`."""
+    return get_claim_check().check(value)
+
+
+def resolve(value):
+    """Return the payload of a reference, see :meth:`ClaimCheck.resolve`."""
+    return get_claim_check().resolve(value)
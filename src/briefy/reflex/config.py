@@ -5,12 +5,33 @@ from prettyconf import config
 # Reflex
 REFLEX_QUEUE = config('REFLEX_QUEUE', default='reflex-{0}'.format(_queue_suffix))
 
+REFLEX_WORKER_CONCURRENCY = config('REFLEX_WORKER_CONCURRENCY', cast=int, default='1')
+REFLEX_WORKER_BATCH_SIZE = config('REFLEX_WORKER_BATCH_SIZE', cast=int, default='10')
+REFLEX_VISIBILITY_TIMEOUT = config('REFLEX_VISIBILITY_TIMEOUT', cast=int, default='120')
+REFLEX_VISIBILITY_CEILING = config('REFLEX_VISIBILITY_CEILING', cast=int, default='7200')
+REFLEX_RELEASE_BACKOFF = config('REFLEX_RELEASE_BACKOFF', cast=int, default='10')
+
+# idempotency
+IDEMPOTENCY_DB = config('IDEMPOTENCY_DB', default='redis://localhost:6379/5')
+IDEMPOTENCY_TTL = config('IDEMPOTENCY_TTL', cast=int, default='86400')
+IDEMPOTENCY_IN_PROGRESS_TTL = config('IDEMPOTENCY_IN_PROGRESS_TTL', cast=int, default='21600')
+
 # NewRelic
 NEW_RELIC_LICENSE_KEY = config('NEW_RELIC_LICENSE_KEY', default='')
 
 # CELERY
 TASKS_BROKER = config('TASKS_BROKER', default='redis://localhost:6379/1')
 TASKS_RESULT_DB = config('TASKS_RESULT_DB', default='redis://localhost:6379/2')
+TASKS_RESULT_SERIALIZER = config('TASKS_RESULT_SERIALIZER', default='msgpack')
+TASKS_RESULT_EXPIRES = config('TASKS_RESULT_EXPIRES', cast=int, default='86400')
+TASKS_LEAN_RESULTS = config('TASKS_LEAN_RESULTS', cast=config.boolean, default='true')
+TASKS_TRACK_STARTED = config('TASKS_TRACK_STARTED', cast=config.boolean, default='false')
+
+# claim check of large task payloads: redis://host:port/db or file:///path, empty to disable
+CLAIM_CHECK_STORE = config('CLAIM_CHECK_STORE', default='')
+CLAIM_CHECK_THRESHOLD = config('CLAIM_CHECK_THRESHOLD', cast=int, default='16384')
+CLAIM_CHECK_TTL = config('CLAIM_CHECK_TTL', cast=int, default='172800')
+CLAIM_CHECK_CACHE_SIZE = config('CLAIM_CHECK_CACHE_SIZE', cast=int, default='256')
 
 # leica
 LEICA_BASE = config('LEICA_BASE', default='http://briefy-leica.briefy-leica')
@@ -19,6 +40,9 @@ LEICA_BASE = config('LEICA_BASE', default='http://briefy-leica.briefy-leica')
 ALEXANDRIA_BASE = config('ALEXANDRIA_BASE', default='http://briefy-alexandria.briefy-alexandria')
 ALEXANDRIA_LEICA_ROOT = '48f47fdc-922b-4aae-8388-0fb23a123fcc'
 ALEXANDRIA_CITYPACKAGES_ROOT = '27f0cdff-14da-42c4-880a-51c3d6f0b841'
+# lock serializing the read, change and write back of one asset
+ASSETS_LOCK_DB = config('ASSETS_LOCK_DB', default=TASKS_BROKER)
+ASSETS_LOCK_TIMEOUT = config('ASSETS_LOCK_TIMEOUT', cast=float, default='30')
 
 # tmp folder
 TMP_PATH = config('TMP_PATH', default='/tmp/assets')
@@ -34,11 +58,86 @@ CELERY_LOG_LEVEL = config('CELERY_LOG_LEVEL', default='INFO')
 CELERY_DEFAULT_QUEUE = config('CELERY_DEFAULT_QUEUE', default='briefy_reflex')
 CELERY_DEFAULT_QUEUE_DRIVE = config('CELERY_DEFAULT_QUEUE_DRIVE', default='briefy_reflex_gdrive')
 CELERY_DEFAULT_QUEUE_S3 = config('CELERY_DEFAULT_QUEUE_S3', default='briefy_reflex_s3')
+CELERY_POOL_DEFAULT = config('CELERY_POOL_DEFAULT', default='eventlet')
+CELERY_POOL_GDRIVE = config('CELERY_POOL_GDRIVE', default='eventlet')
+CELERY_POOL_S3 = config('CELERY_POOL_S3', default='eventlet')
+CELERY_PREFETCH_DEFAULT = config('CELERY_PREFETCH_DEFAULT', cast=int, default='1')
+CELERY_PREFETCH_GDRIVE = config('CELERY_PREFETCH_GDRIVE', cast=int, default='4')
+CELERY_PREFETCH_S3 = config('CELERY_PREFETCH_S3', cast=int, default='1')
+CELERY_MAX_TASKS_PER_CHILD = config('CELERY_MAX_TASKS_PER_CHILD', cast=int, default='1000')
+CELERY_MAX_MEMORY_PER_CHILD = config('CELERY_MAX_MEMORY_PER_CHILD', cast=int, default='512000')
 TASK_MAX_RETRY = config('TASK_MAX_RETRY', cast=int, default='10')
 GDRIVE_RATE_LIMIT = config('GDRIVE_RATE_LIMIT', default='10/s')
 
+# autoscaling
+AUTOSCALE_BACKEND = config('AUTOSCALE_BACKEND', default='deis')
+AUTOSCALE_DEIS_APP = config('AUTOSCALE_DEIS_APP', default='')
+AUTOSCALE_INTERVAL = config('AUTOSCALE_INTERVAL', cast=float, default='30')
+AUTOSCALE_DRAIN_SECONDS = config('AUTOSCALE_DRAIN_SECONDS', cast=float, default='300')
+AUTOSCALE_DOWN_DELAY = config('AUTOSCALE_DOWN_DELAY', cast=float, default='300')
+AUTOSCALE_MIN_REPLICAS = config('AUTOSCALE_MIN_REPLICAS', cast=int, default='1')
+AUTOSCALE_MAX_REPLICAS = config('AUTOSCALE_MAX_REPLICAS', cast=int, default='10')
+AUTOSCALE_DRIVE_QUOTA = config('AUTOSCALE_DRIVE_QUOTA', cast=float, default='100')
+
+# fair scheduling
+SCHEDULING_DB = config('SCHEDULING_DB', default=TASKS_BROKER)
+SCHEDULING_ORDER_INFLIGHT = config('SCHEDULING_ORDER_INFLIGHT', cast=int, default='20')
+SCHEDULING_DEFER_SECONDS = config('SCHEDULING_DEFER_SECONDS', cast=float, default='5')
+SCHEDULING_MAX_DEFERRALS = config('SCHEDULING_MAX_DEFERRALS', cast=int, default='360')
+
+# checksums of the transferred files
+CHECKSUM_SHA256 = config('CHECKSUM_SHA256', cast=config.boolean, default='false')
+CHECKSUM_PUT_MAX_BYTES = config('CHECKSUM_PUT_MAX_BYTES', cast=int, default='104857600')
+
+# renditions and metadata computed during the transfer, requires Pillow
+RENDITIONS_ENABLED = config('RENDITIONS_ENABLED', cast=config.boolean, default='false')
+RENDITIONS_SIZES = config('RENDITIONS_SIZES', default='thumbnail:320x320,web:1920x1920')
+RENDITIONS_QUALITY = config('RENDITIONS_QUALITY', cast=int, default='85')
+
+# hot path metrics
+METRICS_PORT = config('METRICS_PORT', cast=int, default='0')
+METRICS_STATSD = config('METRICS_STATSD', default='')
+METRICS_ORDER_LABEL = config('METRICS_ORDER_LABEL', cast=config.boolean, default='false')
+
+# circuit breakers
+BREAKER_ENABLED = config('BREAKER_ENABLED', cast=config.boolean, default='true')
+BREAKER_DB = config('BREAKER_DB', default=TASKS_BROKER)
+BREAKER_ERROR_RATE = config('BREAKER_ERROR_RATE', cast=float, default='0.5')
+BREAKER_SLOW_SECONDS = config('BREAKER_SLOW_SECONDS', cast=float, default='30')
+BREAKER_SLOW_RATE = config('BREAKER_SLOW_RATE', cast=float, default='0.8')
+BREAKER_MIN_CALLS = config('BREAKER_MIN_CALLS', cast=int, default='20')
+BREAKER_WINDOW = config('BREAKER_WINDOW', cast=int, default='60')
+BREAKER_OPEN_SECONDS = config('BREAKER_OPEN_SECONDS', cast=float, default='30')
+BREAKER_PROBE_INTERVAL = config('BREAKER_PROBE_INTERVAL', cast=float, default='10')
+
+# sampled profiling
+PROFILING_TASKS = config('PROFILING_TASKS', default='')
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', cast=float, default='0.01')
+PROFILING_PATH = config('PROFILING_PATH', default='/tmp/reflex-profiles')
+PROFILING_FLUSH_EVERY = config('PROFILING_FLUSH_EVERY', cast=int, default='10')
+
+# import planner
+PLANNER_CONCURRENCY = config('PLANNER_CONCURRENCY', cast=int, default='10')
+PLANNER_THROUGHPUT_BYTES = config('PLANNER_THROUGHPUT_BYTES', cast=int, default='10485760')
+PLANNER_THROUGHPUT_ASSETS = config('PLANNER_THROUGHPUT_ASSETS', cast=float, default='5')
+PLANNER_PATH = config('PLANNER_PATH', default='/tmp/plans')
+
 # kinesis
 GDRIVE_DELIVERY_STREAM = config('GDRIVE_DELIVERY_STREAM', default='gdrive_delivery_contents')
+KINESIS_LOCAL_PATH = config('KINESIS_LOCAL_PATH', default='')
+KINESIS_LOCAL_SHARDS = config('KINESIS_LOCAL_SHARDS', cast=int, default='2')
+KINESIS_PRODUCER_LINGER = config('KINESIS_PRODUCER_LINGER', cast=float, default='0.5')
+KINESIS_PRODUCER_MAX_RETRIES = config('KINESIS_PRODUCER_MAX_RETRIES', cast=int, default='8')
+KINESIS_PRODUCER_BACKOFF = config('KINESIS_PRODUCER_BACKOFF', cast=float, default='0.1')
+KINESIS_RECORD_CODEC = config('KINESIS_RECORD_CODEC', default='zlib')
+KINESIS_CONSUMER_QUEUE_SIZE = config('KINESIS_CONSUMER_QUEUE_SIZE', cast=int, default='1000')
+KINESIS_POLL_IDLE_INTERVAL = config('KINESIS_POLL_IDLE_INTERVAL', cast=float, default='1')
+KINESIS_POLL_MAX_INTERVAL = config('KINESIS_POLL_MAX_INTERVAL', cast=float, default='10')
+KINESIS_CHECKPOINT_STORE = config(
+    'KINESIS_CHECKPOINT_STORE', default='sqlite:///tmp/kinesis-checkpoints.sqlite'
+)
+KINESIS_CHECKPOINT_RECORDS = config('KINESIS_CHECKPOINT_RECORDS', cast=int, default='100')
+KINESIS_CHECKPOINT_SECONDS = config('KINESIS_CHECKPOINT_SECONDS', cast=float, default='5')
 
 # flower monitor config
 FLOWER_COOKIE_SECRET = config('COOKIE_SECRET', default='304f805a-532f-41f0-9fd1-e38fa340e77c')
@@ -1,10 +1,30 @@
 """briefy.reflex base events."""
 from briefy.common.event import BaseEvent
 from briefy.common.event import IDataEvent
+from briefy.common.utils.data import Objectify
 from briefy.reflex import logger
 from zope.interface import implementer
 
 
+class ResponseWrapper:
+    """Wrap payload in object with neeed attributes."""
+
+    def __init__(self, obj, payload):
+        """Initialize attributes, obj can be a payload dict or an object with attributes."""
+        self.data = payload
+        if isinstance(obj, dict):
+            self.created_at = obj.get('created_at')
+            self.id = obj.get('id')
+        else:
+            self.created_at = obj.created_at
+            self.id = obj.id
+
+    def to_dict(self, *args, **kwargs):
+        """Unwrap wrapped data."""
+        data = self.data
+        return data._dct if isinstance(data, Objectify) else data
+
+
 class IReflexEvent(IDataEvent):
     """Inferface for Reflex events."""
 
@@ -28,5 +48,13 @@ class ImportAssetsSuccess(ReflexEvent):
 class ImportAssetsFailure(ReflexEvent):
     """Import assets from gdrive to s3 and add data in briefy.alexandria failure."""
 
-    event_name = 'reflex.import.assets.success'
+    event_name = 'reflex.import.assets.failure'
+    """Event name."""
+
+
+@implementer(IReflexEvent)
+class ImportAssetsSubmitted(ReflexEvent):
+    """Import assets from gdrive to s3 and add data in briefy.alexandria submitted."""
+
+    event_name = 'reflex.import.assets.submitted'
     """Event name."""
@@ -0,0 +1,45 @@
+"""Lazy import of heavy dependencies."""
+import importlib
+
+
+class LazyModule:
+    """Proxy importing a module on the first attribute access."""
+
+    def __init__(self, name: str, on_load: callable=None):
+        """Initialize proxy.
+
+        :param name: full module name
+        :param on_load: callable executed before the module is imported
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_on_load'] = on_load
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        """Import the module, only once."""
+        module = self.__dict__['_module']
+        if module is None:
+            on_load = self.__dict__['_on_load']
+            if on_load:
+                on_load()
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, name: str):
+        """Return an attribute of the module, importing it if needed."""
+        return getattr(self._load(), name)
+
+    def __repr__(self) -> str:
+        """Representation of the proxy."""
+        return f'<LazyModule {self.__dict__["_name"]}>'
+
+
+def lazy_import(name: str, on_load: callable=None) -> LazyModule:
+    """Return a proxy to a module, imported on the first attribute access.
+
+    :param name: full module name
+    :param on_load: callable executed before the module is imported
+    :return: module proxy
+    """
+    return LazyModule(name, on_load)
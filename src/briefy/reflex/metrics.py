@@ -0,0 +1,458 @@
+"""Hot path metrics of the reflex tasks and of the google drive, S3 and REST clients.
+
+Histograms and counters are aggregated in memory, one lock and one dict update per observation,
+and exposed in the Prometheus text format by a small http server started with the celery
+worker (METRICS_PORT). Each child process of a prefork pool has its own registry and its own
+server, on METRICS_PORT plus one plus the child index. Observations can also be sent to a StatsD
+(DogStatsD tags) agent (METRICS_STATSD), aggregating all processes.
+
+Queue wait is measured from the sent_at header added to each task message when it is published.
+"""
+from abc import ABC
+from abc import abstractmethod
+from bisect import bisect_left
+from briefy.reflex import logger
+from billiard.process import current_process
+from briefy.reflex.config import METRICS_ORDER_LABEL
+from briefy.reflex.config import METRICS_PORT
+from briefy.reflex.config import METRICS_STATSD
+from briefy.reflex.tasks.config import task_queue
+from celery import signals
+from celery._state import get_current_worker_task
+from celery.utils.iso8601 import parse_iso8601
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import socket
+import threading
+import time
+import typing as t
+
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0
+)
+"""Buckets of the duration histograms, in seconds."""
+
+BYTES_BUCKETS = tuple(2 ** exponent for exponent in range(10, 31, 2))
+"""Buckets of the transferred bytes histograms, from 1KiB to 1GiB."""
+
+
+class StatsdClient:
+    """Send metrics to a StatsD agent over UDP, fire and forget."""
+
+    def __init__(self, address: str, prefix: str='reflex'):
+        """Initialize client.
+
+        :param address: agent address as host:port
+        :param prefix: prefix of the metric names
+        """
+        host, _, port = address.partition(':')
+        self.address = (host, int(port or 8125))
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def send(self, name: str, value: float, kind: str, labels: dict):
+        """Send one observation.
+
+        :param name: metric name
+        :param value: observed value
+        :param kind: StatsD type, c for counters and h for histograms
+        :param labels: dict of labels, sent as tags
+        """
+        tags = ','.join(f'{key}:{tag}' for key, tag in labels.items())
+        line = f'{self.prefix}.{name}:{value:g}|{kind}'
+        if tags:
+            line = f'{line}|#{tags}'
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+class Metric(ABC):
+    """Base class for metrics with a fixed set of labels."""
+
+    kind = ''
+    """Prometheus metric type."""
+
+    statsd_kind = ''
+    """StatsD metric type."""
+
+    def __init__(self, name: str, description: str, labels: t.Sequence[str], registry):
+        """Initialize metric.
+
+        :param name: metric name
+        :param description: help text
+        :param labels: label names
+        :param registry: registry collecting the metric
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.registry = registry
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        """Label values in the order of the label names."""
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def _format_labels(self, key: tuple, extra: str='') -> str:
+        """Format label values in the Prometheus text format."""
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    @abstractmethod
+    def render(self) -> t.List[str]:
+        """Return the lines of the metric in the Prometheus text format."""
+
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    kind = 'counter'
+    statsd_kind = 'c'
+
+    def inc(self, labels: dict, value: float=1):
+        """Increment the counter of one label set."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        self.registry.forward(self, value, labels)
+
+    def render(self) -> t.List[str]:
+        """Return the lines of the metric in the Prometheus text format."""
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}_total{self._format_labels(key)} {value:g}' for key, value in values]
+
+
+class Histogram(Metric):
+    """Histogram with fixed buckets."""
+
+    kind = 'histogram'
+    statsd_kind = 'h'
+
+    def __init__(
+            self, name: str, description: str, labels: t.Sequence[str], registry,
+            buckets: t.Sequence[float]=SECONDS_BUCKETS
+    ):
+        """Initialize histogram.
+
+        :param name: metric name
+        :param description: help text
+        :param labels: label names
+        :param registry: registry collecting the metric
+        :param buckets: upper bounds of the buckets, sorted
+        """
+        super().__init__(name, description, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: dict, value: float):
+        """Add one observation to the histogram of one label set."""
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket, +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+        self.registry.forward(self, value, labels)
+
+    def render(self) -> t.List[str]:
+        """Return the lines of the metric in the Prometheus text format."""
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                labels = self._format_labels(key, 'le="' + le + '"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {counts[-1]:g}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics of the process."""
+
+    def __init__(self, statsd: StatsdClient=None):
+        """Initialize registry.
+
+        :param statsd: client to forward each observation to, optional
+        """
+        self.metrics = []
+        self.statsd = statsd
+
+    def counter(self, name: str, description: str, labels: t.Sequence[str]) -> Counter:
+        """Create and register one counter."""
+        metric = Counter(name, description, labels, self)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+            self, name: str, description: str, labels: t.Sequence[str],
+            buckets: t.Sequence[float]=SECONDS_BUCKETS
+    ) -> Histogram:
+        """Create and register one histogram."""
+        metric = Histogram(name, description, labels, self, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def forward(self, metric: Metric, value: float, labels: dict):
+        """Send one observation to StatsD, if configured."""
+        if self.statsd is not None:
+            self.statsd.send(metric.name, value, metric.statsd_kind, labels)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry(StatsdClient(METRICS_STATSD) if METRICS_STATSD else None)
+"""Registry of the process."""
+
+TASK_LABELS = ('task', 'queue', 'order') if METRICS_ORDER_LABEL else ('task', 'queue')
+"""Labels of the task metrics, the order label has one series per order."""
+
+QUEUE_WAIT = REGISTRY.histogram(
+    'reflex_queue_wait_seconds', 'Time between publishing and starting a task.', TASK_LABELS
+)
+TASK_SECONDS = REGISTRY.histogram(
+    'reflex_task_seconds', 'Execution time of a task.', TASK_LABELS
+)
+TASK_RETRIES = REGISTRY.counter(
+    'reflex_task_retries', 'Retries of a task.', TASK_LABELS
+)
+TASK_FAILURES = REGISTRY.counter(
+    'reflex_task_failures', 'Failures of a task after all retries.', TASK_LABELS
+)
+CALL_SECONDS = REGISTRY.histogram(
+    'reflex_call_seconds', 'Latency of a call to an external service.',
+    ('service', 'operation') + TASK_LABELS
+)
+CALL_ERRORS = REGISTRY.counter(
+    'reflex_call_errors', 'Calls to an external service raising an exception.',
+    ('service', 'operation') + TASK_LABELS
+)
+TRANSFER_BYTES = REGISTRY.histogram(
+    'reflex_transfer_bytes', 'Bytes transferred by one call to an external service.',
+    ('service', 'direction') + TASK_LABELS, buckets=BYTES_BUCKETS
+)
+
+
+CALL_LISTENERS = []
+"""Callables notified of each call to an external service with (service, seconds, error)."""
+
+
+@lru_cache(maxsize=None)
+def _queue(name: str) -> str:
+    """Queue of a task name, cached."""
+    return task_queue(name)
+
+
+def task_labels(task=None) -> dict:
+    """Labels of a task, default to the task executed by the worker.
+
+    Tasks called directly inside another task are labelled with the outer task.
+
+    :param task: task instance, optional
+    :return: dict of labels, empty values outside of a task
+    """
+    task = task or get_current_worker_task()
+    if task is None or task.request.called_directly:
+        return {}
+    labels = {'task': task.name, 'queue': _queue(task.name)}
+    if METRICS_ORDER_LABEL:
+        labels['order'] = getattr(task.request, 'order_id', None) or ''
+    return labels
+
+
+def observe_queue_wait(task):
+    """Record the time a task waited in the queue, using the sent_at message header."""
+    sent_at = getattr(task.request, 'sent_at', None)
+    if sent_at:
+        QUEUE_WAIT.observe(task_labels(task), max(0.0, time.time() - sent_at))
+
+
+def observe_task(task, seconds: float):
+    """Record the execution time of a task."""
+    TASK_SECONDS.observe(task_labels(task), seconds)
+
+
+@contextmanager
+def timed(service: str, operation: str, ignore: tuple=()):
+    """Record the latency of one call to an external service, and its errors.
+
+    :param service: service name, as gdrive, s3, leica or alexandria
+    :param operation: called operation
+    :param ignore: exceptions not counted as errors, as a not found answer
+    """
+    labels = task_labels()
+    labels['service'] = service
+    labels['operation'] = operation
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except ignore:
+        raise
+    except Exception as exc:
+        error = exc
+        CALL_ERRORS.inc(labels)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        CALL_SECONDS.observe(labels, seconds)
+        for listener in CALL_LISTENERS:
+            listener(service, seconds, error)
+
+
+def record_bytes(service: str, direction: str, size: int):
+    """Record the bytes transferred by one call to an external service.
+
+    :param service: service name
+    :param direction: download or upload
+    :param size: number of bytes
+    """
+    labels = task_labels()
+    labels['service'] = service
+    labels['direction'] = direction
+    TRANSFER_BYTES.observe(labels, size)
+
+
+class Instrumented:
+    """Proxy timing the method calls of a client, as a REST endpoint or the drive api module."""
+
+    def __init__(self, client, service: str):
+        """Initialize proxy.
+
+        :param client: wrapped client
+        :param service: service name used as label
+        """
+        self.__dict__['_client'] = client
+        self.__dict__['_service'] = service
+
+    def __getattr__(self, name: str):
+        """Return an attribute of the client, methods are timed."""
+        value = getattr(self.__dict__['_client'], name)
+        if not callable(value) or name.startswith('_'):
+            return value
+        service = self.__dict__['_service']
+
+        def call(*args, **kwargs):
+            with timed(service, name):
+                return value(*args, **kwargs)
+        return call
+
+    def __repr__(self) -> str:
+        """Representation of the proxy."""
+        return f'<Instrumented {self.__dict__["_service"]} {self.__dict__["_client"]!r}>'
+
+
+def instrument(client, service: str) -> Instrumented:
+    """Time all method calls of a client.
+
+    :param client: REST endpoint, module or any object with methods
+    :param service: service name used as label
+    :return: client proxy
+    """
+    return Instrumented(client, service)
+
+
+@signals.before_task_publish.connect
+def add_sent_at(headers: dict=None, **kwargs):
+    """Add the publishing time to the task message headers, or its eta if it is delayed."""
+    if headers is None:
+        return
+    sent_at = time.time()
+    eta = headers.get('eta')
+    if eta:
+        try:
+            sent_at = max(sent_at, parse_iso8601(eta).timestamp())
+        except ValueError:
+            pass
+    headers['sent_at'] = sent_at
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the registry in the Prometheus text format."""
+
+    def do_GET(self):  # noQA
+        """Return all metrics."""
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        """Do not log each scrape."""
+
+
+def start_http_server(port: int=METRICS_PORT) -> HTTPServer:
+    """Serve the metrics in a daemon thread.
+
+    :param port: tcp port
+    :return: http server
+    """
+    server = HTTPServer(('', port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='reflex-metrics', daemon=True)
+    thread.start()
+    logger.info(f'Metrics available at http://0.0.0.0:{port}/metrics')
+    return server
+
+
+_server = None
+"""Metrics server of the process."""
+
+
+def _start_server(port: int):
+    """Start the metrics server of the process, a failure to bind the port is only logged."""
+    global _server
+    try:
+        _server = start_http_server(port)
+    except OSError as exc:
+        logger.warning(f'Metrics endpoint not started on port {port}: {exc!r}')
+
+
+@signals.worker_init.connect
+def start_worker_metrics(**kwargs):
+    """Start the metrics endpoint with the celery worker."""
+    if METRICS_PORT:
+        _start_server(METRICS_PORT)
+
+
+@signals.worker_process_init.connect
+def start_child_metrics(**kwargs):
+    """Start the metrics endpoint of a prefork child, where its tasks are executed.
+
+    Children use METRICS_PORT plus one plus their index, a child replacing another one (as
+    after max tasks per child) reuses its index and port.
+    """
+    global _server
+    if not METRICS_PORT:
+        return
+    if _server is not None:
+        # socket of the parent server inherited by the fork, served by the parent only
+        _server.socket.close()
+        _server = None
+    index = getattr(current_process(), 'index', None) or 0
+    _start_server(METRICS_PORT + 1 + index)
@@ -0,0 +1,144 @@
+"""Compact payload models used in the hot paths of the tasks and of the queue worker."""
+import typing as t
+
+
+class Model:
+    """Base class of the slotted payload models.
+
+    As in briefy.common Objectify, fields missing in the payload are None, but the instance is
+    built once from the payload dict and each attribute access is a plain slot lookup.
+    """
+
+    __slots__ = ()
+
+    _nested = {}
+    """Field name as key and the model class of the nested payload as value."""
+
+    _nested_lists = {}
+    """Field name as key and the model class of each item of the nested list as value."""
+
+    def __init__(self, **kwargs):
+        """Initialize model from keyword arguments."""
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def from_dict(cls, data: dict, fields: t.Sequence[str]=None) -> 'Model':
+        """Create a model instance from a payload dict.
+
+        :param data: payload dict
+        :param fields: projection, only these fields are read from the payload
+        :return: model instance
+        """
+        instance = cls.__new__(cls)
+        get = data.get
+        nested = cls._nested
+        nested_lists = cls._nested_lists
+        for name in cls.__slots__:
+            value = get(name) if fields is None or name in fields else None
+            if value is not None:
+                if name in nested:
+                    value = nested[name].from_dict(value)
+                elif name in nested_lists:
+                    model = nested_lists[name]
+                    value = [model.from_dict(item) for item in value]
+            setattr(instance, name, value)
+        return instance
+
+    def _get(self, name: str, default=None):
+        """Return the field value or default if the field is missing."""
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def to_dict(self) -> dict:
+        """Serialize the model, skipping missing fields."""
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            elif isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Model) else item for item in value]
+            data[name] = value
+        return data
+
+    def __repr__(self) -> str:
+        """Representation of the model with its id."""
+        return f'<{self.__class__.__name__} {getattr(self, "id", None)}>'
+
+
+class DriveFile(Model):
+    """Google drive file payload from briefy.gdrive."""
+
+    __slots__ = (
+        'id', 'name', 'mimeType', 'size', 'md5Checksum', 'imageMediaMetadata', 'webViewLink',
+        'webContentLink'
+    )
+
+
+class Collection(Model):
+    """Collection payload from briefy.alexandria."""
+
+    __slots__ = ('id', 'slug', 'title', 'description', 'content_type', 'parent_id', 'tags')
+
+
+class Reference(Model):
+    """Customer or project payload embedded in a Leica order."""
+
+    __slots__ = ('id', 'slug', 'title', 'description')
+
+
+class Delivery(Model):
+    """Delivery links of a Leica order."""
+
+    __slots__ = ('gdrive', 'archive')
+
+
+class RequirementItem(Model):
+    """Requirement item of a Leica order, imported as a collection."""
+
+    __slots__ = (
+        'id', 'name', 'category', 'description', 'tags', 'folder_id', 'parent_folder_id'
+    )
+
+
+class Order(Model):
+    """Order payload from Leica."""
+
+    __slots__ = (
+        'id', 'slug', 'title', 'description', 'created_at', 'customer', 'project', 'delivery',
+        'requirement_items'
+    )
+
+    _nested = {'customer': Reference, 'project': Reference, 'delivery': Delivery}
+    _nested_lists = {'requirement_items': RequirementItem}
+
+
+class QueueMessage(Model):
+    """Body of an event message received from the queue, data is kept as a dict."""
+
+    __slots__ = ('id', 'event_name', 'data', 'created_at')
+
+
+class NotificationAction(Model):
+    """Event fired after a message is processed with one of the dispatch status."""
+
+    __slots__ = ('action', 'success', 'message')
+
+
+class Dispatch(Model):
+    """Configuration to process messages of one event name."""
+
+    __slots__ = ('name', 'action', 'notification_actions', 'on_failure_retry', 'idempotent')
+
+    @classmethod
+    def from_dict(cls, data: dict, fields: t.Sequence[str]=None) -> 'Dispatch':
+        """Create a dispatch from a dispatch map entry, including its notification actions."""
+        instance = super().from_dict(data, fields)
+        instance.notification_actions = {
+            status: NotificationAction.from_dict(action)
+            for status, action in (instance.notification_actions or {}).items()
+        }
+        return instance
@@ -0,0 +1,239 @@
+"""On demand sampled profiling of the reflex tasks.
+
+A fraction of the executions of chosen tasks runs under cProfile. The profiles are aggregated
+per task name in the worker process and written as pstats files to PROFILING_PATH, one file
+per task, host and process, every PROFILING_FLUSH_EVERY samples.
+
+Profiling is configured with PROFILING_TASKS and PROFILING_SAMPLE_RATE or changed at runtime,
+without restarting the workers, by the reflex_profile command line::
+
+    reflex_profile enable add_or_update_asset download_and_upload_file --rate 0.05
+    reflex_profile dump
+    reflex_profile disable
+    reflex_profile merge before.pstats /tmp/reflex-profiles/add_or_update_asset.*.pstats
+
+Only one execution is profiled at a time in each process: cProfile follows the OS thread, so
+with the eventlet pool a profile also includes the code of the green threads running
+concurrently with the sampled task.
+"""
+from briefy.reflex import logger
+from briefy.reflex.celery import app
+from briefy.reflex.config import PROFILING_FLUSH_EVERY
+from briefy.reflex.config import PROFILING_PATH
+from briefy.reflex.config import PROFILING_SAMPLE_RATE
+from briefy.reflex.config import PROFILING_TASKS
+from celery.worker.control import control_command
+from contextlib import contextmanager
+
+import argparse
+import cProfile
+import os
+import pstats
+import random
+import socket
+import sys
+import threading
+import typing as t
+
+
+def parse_tasks(value: str) -> t.FrozenSet[str]:
+    """Parse a comma or space separated list of task names."""
+    return frozenset(name for name in value.replace(',', ' ').split() if name)
+
+
+class Profiler:
+    """Sample and aggregate task profiles in one process."""
+
+    def __init__(
+            self, tasks: t.Iterable[str]=(), rate: float=PROFILING_SAMPLE_RATE,
+            path: str=PROFILING_PATH, flush_every: int=PROFILING_FLUSH_EVERY
+    ):
+        """Initialize profiler.
+
+        :param tasks: task names, full or without the module, * for all tasks
+        :param rate: fraction of the executions profiled
+        :param path: directory of the pstats files
+        :param flush_every: samples of one task between writes of its file
+        """
+        self.tasks = frozenset(tasks)
+        self.rate = rate
+        self.path = path
+        self.flush_every = flush_every
+        self._stats = {}
+        self._samples = {}
+        self._active = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """True if at least one task is profiled."""
+        return bool(self.tasks) and self.rate > 0
+
+    def configure(self, tasks: t.Iterable[str], rate: float=None):
+        """Change the profiled tasks and the sample rate.
+
+        :param tasks: task names, empty to disable profiling
+        :param rate: fraction of the executions profiled, keep the current one if None
+        """
+        self.tasks = frozenset(tasks)
+        if rate is not None:
+            self.rate = rate
+
+    def matches(self, name: str) -> bool:
+        """Check if a task is profiled."""
+        tasks = self.tasks
+        return '*' in tasks or name in tasks or name.rsplit('.', 1)[-1] in tasks
+
+    def _start(self, name: str) -> bool:
+        """Decide if this execution is profiled, at most one at a time."""
+        if not self.enabled or not self.matches(name) or random.random() >= self.rate:
+            return False
+        with self._lock:
+            if self._active:
+                return False
+            self._active = True
+        return True
+
+    @contextmanager
+    def sample(self, name: str):
+        """Profile one execution of a task, if it is sampled.
+
+        :param name: task name
+        """
+        if not self._start(name):
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._active = False
+            self.add(name, profile)
+
+    def add(self, name: str, profile: cProfile.Profile):
+        """Aggregate one profile, writing the task file every flush_every samples."""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                self._stats[name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._samples[name] = samples = self._samples.get(name, 0) + 1
+        if samples % self.flush_every == 0:
+            self.flush(name)
+
+    def filename(self, name: str) -> str:
+        """Path of the pstats file of one task in this process."""
+        short_name = name.rsplit('.', 1)[-1]
+        return os.path.join(self.path, f'{short_name}.{socket.gethostname()}.{os.getpid()}.pstats')
+
+    def flush(self, name: str=None) -> t.List[str]:
+        """Write the aggregated profiles.
+
+        :param name: task name, all tasks if None
+        :return: list of written files
+        """
+        os.makedirs(self.path, exist_ok=True)
+        written = []
+        with self._lock:
+            names = [name] if name else list(self._stats)
+            for item in names:
+                filename = self.filename(item)
+                self._stats[item].dump_stats(filename)
+                written.append(filename)
+        for filename in written:
+            logger.debug(f'Profile written to {filename}.')
+        return written
+
+    def reset(self):
+        """Discard the aggregated profiles."""
+        with self._lock:
+            self._stats.clear()
+            self._samples.clear()
+
+    def summary(self) -> dict:
+        """Return the number of samples of each task."""
+        with self._lock:
+            return dict(self._samples)
+
+
+profiler = Profiler(parse_tasks(PROFILING_TASKS))
+"""Profiler of the process."""
+
+
+@control_command(
+    args=[('tasks', str), ('rate', float)],
+    signature='[tasks] [rate]',
+)
+def reflex_profile(state, tasks: str='', rate: float=None) -> dict:
+    """Change the profiled tasks of the worker, empty tasks disables profiling."""
+    profiler.configure(parse_tasks(tasks), rate)
+    logger.info(f'Profiling {sorted(profiler.tasks)} with sample rate {profiler.rate}.')
+    return {'ok': {'tasks': sorted(profiler.tasks), 'rate': profiler.rate}}
+
+
+@control_command(
+    args=[('reset', int)],
+    signature='[reset]',
+)
+def reflex_profile_dump(state, reset: int=0) -> dict:
+    """Write the aggregated profiles of the worker, optionally discarding them after."""
+    written = profiler.flush()
+    samples = profiler.summary()
+    if reset:
+        profiler.reset()
+    return {'ok': {'files': written, 'samples': samples}}
+
+
+def merge(paths: t.Sequence[str], output: str) -> pstats.Stats:
+    """Merge the pstats files of many workers in one file.
+
+    :param paths: pstats files
+    :param output: merged file path
+    :return: merged stats
+    """
+    stats = pstats.Stats(*paths)
+    stats.dump_stats(output)
+    return stats
+
+
+def main():
+    """Control the profiling of the running workers."""
+    parser = argparse.ArgumentParser(description='Sampled profiling of the reflex tasks.')
+    commands = parser.add_subparsers(dest='command')
+    enable = commands.add_parser('enable', help='profile tasks in all workers')
+    enable.add_argument('tasks', nargs='+', help='task names, full or without the module')
+    enable.add_argument('--rate', type=float, default=PROFILING_SAMPLE_RATE)
+    commands.add_parser('disable', help='stop profiling in all workers')
+    dump = commands.add_parser('dump', help='write the profiles of all workers')
+    dump.add_argument('--reset', action='store_true', help='discard the profiles after')
+    merge_parser = commands.add_parser('merge', help='merge pstats files')
+    merge_parser.add_argument('output')
+    merge_parser.add_argument('paths', nargs='+')
+    merge_parser.add_argument('--top', type=int, default=30, help='functions to print')
+    args = parser.parse_args()
+
+    if args.command == 'merge':
+        merge(args.paths, args.output).sort_stats('cumulative').print_stats(args.top)
+        return 0
+    if args.command == 'enable':
+        arguments = {'tasks': ','.join(args.tasks), 'rate': args.rate}
+        replies = app.control.broadcast('reflex_profile', arguments=arguments, reply=True)
+    elif args.command == 'disable':
+        replies = app.control.broadcast('reflex_profile', arguments={'tasks': ''}, reply=True)
+    elif args.command == 'dump':
+        arguments = {'reset': int(args.reset)}
+        replies = app.control.broadcast('reflex_profile_dump', arguments=arguments, reply=True)
+    else:
+        parser.print_help()
+        return 1
+    for reply in replies:
+        for worker, result in reply.items():
+            print(f'{worker}: {result}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
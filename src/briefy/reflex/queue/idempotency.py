@@ -0,0 +1,149 @@
+"""Deduplication of queue messages and order imports."""
+from briefy.reflex import logger
+from briefy.reflex.config import IDEMPOTENCY_DB
+from briefy.reflex.config import IDEMPOTENCY_IN_PROGRESS_TTL
+from briefy.reflex.config import IDEMPOTENCY_TTL
+
+import redis
+
+
+IN_PROGRESS = 'in_progress'
+"""State of a message or order being processed."""
+
+DONE = 'done'
+"""State of a message or order already processed."""
+
+CLAIMED = 'claimed'
+"""Result of a successful claim."""
+
+
+class IdempotencyStore:
+    """Track messages and orders in redis to drop duplicated deliveries before dispatch.
+
+    SQS delivers messages at least once and the choreographer can send the same order more
+    than once, so each message id and each order id can only be claimed once while it is in
+    progress or after it is done, until its TTL expires.
+
+    Only done messages and orders are dropped. A message whose message or order claim is still
+    in progress is retried later: the claim can belong to a worker that crashed, and expires
+    after in_progress_ttl.
+    """
+
+    prefix = 'reflex:idempotency'
+    """Prefix of the redis keys."""
+
+    def __init__(
+            self, url: str=IDEMPOTENCY_DB, ttl: int=IDEMPOTENCY_TTL,
+            in_progress_ttl: int=IDEMPOTENCY_IN_PROGRESS_TTL
+    ):
+        """Initialize store.
+
+        :param url: redis database url
+        :param ttl: seconds to keep the done state
+        :param in_progress_ttl: seconds to keep the in progress state if it is never finished
+        """
+        self.redis = redis.StrictRedis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.in_progress_ttl = in_progress_ttl
+
+    def _key(self, kind: str, value: str) -> str:
+        """Redis key of one message or order."""
+        return f'{self.prefix}:{kind}:{value}'
+
+    def _count(self, counter: str):
+        """Increment one of the dedup counters."""
+        self.redis.hincrby(f'{self.prefix}:stats', counter, 1)
+
+    def state(self, kind: str, value: str) -> str:
+        """Return the state of one message or order.
+
+        :param kind: message or order
+        :param value: message id or order id
+        :return: in_progress, done or None
+        """
+        return self.redis.get(self._key(kind, value))
+
+    def claim(self, message_id: str, order_id: str='') -> str:
+        """Claim a message and its order before dispatch.
+
+        :param message_id: SQS message id
+        :param order_id: order id, if the message is related to an order import
+        :return: CLAIMED, DONE if the message or the order was already processed and the message
+                 should be dropped, or IN_PROGRESS if it is being processed and the message
+                 should be retried later
+        """
+        message_key = self._key('message', message_id)
+        if message_id:
+            claimed = self.redis.set(message_key, IN_PROGRESS, nx=True, ex=self.in_progress_ttl)
+            if not claimed:
+                state = self.redis.get(message_key) or IN_PROGRESS
+                self._count(f'duplicate_messages_{state}')
+                logger.info(f'Message {message_id} is {state}: {self._action(state)}.')
+                return state
+
+        order_key = self._key('order', order_id)
+        if order_id:
+            claimed = self.redis.set(order_key, IN_PROGRESS, nx=True, ex=self.in_progress_ttl)
+            if not claimed:
+                state = self.redis.get(order_key) or IN_PROGRESS
+                self._count(f'duplicate_orders_{state}')
+                if message_id and state == DONE:
+                    # the message is merged into the import already done for the order
+                    self.redis.set(message_key, DONE, ex=self.ttl)
+                elif message_id:
+                    self.redis.delete(message_key)
+                logger.info(
+                    f'Order {order_id} is {state}: message {message_id} {self._action(state)}.'
+                )
+                return state
+
+        self._count('claimed')
+        return CLAIMED
+
+    @staticmethod
+    def _action(state: str) -> str:
+        """Describe what happens to a message not claimed, for logging."""
+        return 'dropped' if state == DONE else 'retried later'
+
+    def done(self, order_id: str='', message_id: str=''):
+        """Mark a message and its order as done.
+
+        :param order_id: order id
+        :param message_id: SQS message id
+        """
+        if order_id:
+            self.redis.set(self._key('order', order_id), DONE, ex=self.ttl)
+        if message_id:
+            self.redis.set(self._key('message', message_id), DONE, ex=self.ttl)
+        self._count('done')
+
+    def release(self, order_id: str='', message_id: str=''):
+        """Remove the claims of a failed message and its order so they can be retried.
+
+        :param order_id: order id
+        :param message_id: SQS message id
+        """
+        keys = []
+        if order_id:
+            keys.append(self._key('order', order_id))
+        if message_id:
+            keys.append(self._key('message', message_id))
+        if keys:
+            self.redis.delete(*keys)
+        self._count('released')
+
+    def stats(self) -> dict:
+        """Return the dedup counters."""
+        counters = self.redis.hgetall(f'{self.prefix}:stats')
+        return {key: int(value) for key, value in counters.items()}
+
+
+_store = None
+
+
+def get_store() -> IdempotencyStore:
+    """Return the idempotency store shared by the process."""
+    global _store
+    if _store is None:
+        _store = IdempotencyStore()
+    return _store
@@ -0,0 +1,136 @@
+"""Visibility timeout management of queue messages."""
+from briefy.common.queue.message import SQSMessage
+from briefy.reflex import logger
+from briefy.reflex.config import REFLEX_RELEASE_BACKOFF
+from briefy.reflex.config import REFLEX_VISIBILITY_CEILING
+from briefy.reflex.config import REFLEX_VISIBILITY_TIMEOUT
+
+import threading
+import time
+
+
+MAX_VISIBILITY_TIMEOUT = 43200
+"""SQS limit of the visibility timeout of one message, counted from its receipt."""
+
+
+def change_visibility(message: SQSMessage, timeout: int):
+    """Change the visibility timeout of a message.
+
+    :param message: A message from the queue
+    :param timeout: seconds from now until the message is visible again
+    """
+    boto_message = getattr(message, '_message', message)
+    boto_message.change_visibility(VisibilityTimeout=timeout)
+
+
+def receive_count(message: SQSMessage) -> int:
+    """Return the number of times a message was received, 1 if SQS did not inform it.
+
+    :param message: A message from the queue
+    """
+    boto_message = getattr(message, '_message', message)
+    attributes = getattr(boto_message, 'attributes', None)
+    if not isinstance(attributes, dict):
+        return 1
+    return max(int(attributes.get('ApproximateReceiveCount', 1)), 1)
+
+
+def release_message(
+        message: SQSMessage, backoff: int=REFLEX_RELEASE_BACKOFF,
+        max_timeout: int=REFLEX_VISIBILITY_TIMEOUT
+):
+    """Make a message visible again in the queue after a backoff.
+
+    The backoff doubles on each receive of the message, up to the visibility timeout, so a
+    message failing on every attempt is not retried in a tight loop.
+
+    :param message: A message from the queue
+    :param backoff: seconds until the message is visible again after its first receive
+    :param max_timeout: max seconds until the message is visible again
+    """
+    attempt = min(receive_count(message), 32)
+    change_visibility(message, int(min(backoff * 2 ** (attempt - 1), max_timeout)))
+
+
+class VisibilityHeartbeat:
+    """Keep a message invisible in the queue while it is being processed.
+
+    A background thread extends the visibility timeout every half timeout, until the ceiling
+    is reached. When processing fails the message is released, so it is retried after a
+    backoff growing with its receive count instead of after the visibility timeout.
+    """
+
+    def __init__(
+            self, message: SQSMessage, timeout: int=REFLEX_VISIBILITY_TIMEOUT,
+            ceiling: int=REFLEX_VISIBILITY_CEILING
+    ):
+        """Initialize heartbeat.
+
+        :param message: A message from the queue
+        :param timeout: seconds added to the visibility timeout on each beat
+        :param ceiling: max seconds the message can be kept invisible since the heartbeat start
+        """
+        self.message = message
+        self.timeout = timeout
+        self.ceiling = min(ceiling, MAX_VISIBILITY_TIMEOUT)
+        self.interval = max(timeout / 2, 1)
+        self.beats = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+
+    def __enter__(self):
+        """Start the heartbeat."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop the heartbeat, releasing the message if processing raised an exception."""
+        self.stop(release=exc_type is not None)
+
+    def start(self):
+        """Start extending the visibility timeout in a background thread."""
+        if self.timeout <= 0:
+            return
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='visibility-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Extend the visibility timeout until stopped or until the ceiling is reached."""
+        while not self._stop.wait(self.interval):
+            elapsed = time.monotonic() - self._started_at
+            timeout = int(min(self.timeout, self.ceiling - elapsed))
+            if timeout <= 0:
+                logger.warning(
+                    f'Message {self.message_id} reached the visibility ceiling of '
+                    f'{self.ceiling}s and will be visible in the queue again.'
+                )
+                return
+            try:
+                change_visibility(self.message, timeout)
+                self.beats += 1
+            except Exception:
+                logger.exception(f'Failure extending visibility of message {self.message_id}.')
+
+    @property
+    def message_id(self) -> str:
+        """Id of the message, for logging."""
+        body = getattr(self.message, 'body', None) or {}
+        return body.get('id', '') if isinstance(body, dict) else ''
+
+    def stop(self, release: bool=False):
+        """Stop the heartbeat.
+
+        :param release: make the message visible in the queue after a backoff
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if release:
+            try:
+                release_message(self.message)
+            except Exception:
+                logger.exception(f'Failure releasing message {self.message_id}.')
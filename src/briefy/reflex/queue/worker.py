@@ -1,34 +1,30 @@
 """Reflex worker."""
 from briefy.common.queue import IQueue
 from briefy.common.queue.message import SQSMessage
-from briefy.common.utils.data import Objectify
 from briefy.common.worker.queue import QueueWorker
 from briefy.reflex import events
+from briefy.reflex import get_utility
 from briefy.reflex import logger
 from briefy.reflex.config import NEW_RELIC_LICENSE_KEY
+from briefy.reflex.config import REFLEX_WORKER_BATCH_SIZE
+from briefy.reflex.config import REFLEX_WORKER_CONCURRENCY
+from briefy.reflex.events import ResponseWrapper
+from briefy.reflex.models import Dispatch
+from briefy.reflex.models import QueueMessage
+from briefy.reflex.queue import idempotency
+from briefy.reflex.queue.visibility import VisibilityHeartbeat
 from briefy.reflex.tasks import alexandria
-from zope.component import getUtility
+from concurrent.futures import ThreadPoolExecutor
 
 import newrelic.agent
+import threading
 
 
-# This could be a namedtuple, but they don't work with the current version of 'Objectify'
-NA = lambda action, success, message: dict(action=action, success=success, message=message)  # noQA
-
-
-class ResponseWrapper:
-    """Wrap payload in object with neeed attributes."""
-
-    def __init__(self, obj, payload):
-        """Initialize attributes."""
-        self.data = payload
-        self.created_at = obj.created_at
-        self.id = obj.id
+MAX_BATCH_SIZE = 10
+"""Max number of messages SQS returns in one receive call."""
 
-    def to_dict(self, *args, **kwargs):
-        """Unwrap wrapped data."""
-        data = self.data
-        return data._dct if isinstance(data, Objectify) else data
+# Dispatch map entries are dicts, converted to models.Dispatch when the worker starts
+NA = lambda action, success, message: dict(action=action, success=success, message=message)  # noQA
 
 
 class Worker(QueueWorker):
@@ -49,41 +45,151 @@ class Worker(QueueWorker):
     dispatch_map = None
     """Dict with configuration to choose the dispatcher."""
 
-    def __init__(self, *args, name: str, dispatch_map: dict, **kwargs):
+    concurrency = 1
+    """Number of messages processed at the same time, 1 to process one message per run."""
+
+    batch_size = REFLEX_WORKER_BATCH_SIZE
+    """Max number of messages received in one long poll, limited to MAX_BATCH_SIZE."""
+
+    def __init__(
+            self, *args, name: str, dispatch_map: dict,
+            concurrency: int=REFLEX_WORKER_CONCURRENCY, **kwargs
+    ):
         """Added new parameter to the worker init class."""
         self.name = name
         self.dispatch_map = dispatch_map
+        self._dispatch = {
+            event: Dispatch.from_dict(entry) for event, entry in dispatch_map.items()
+        }
+        self.concurrency = concurrency
+        self.batch_size = max(1, min(self.batch_size, MAX_BATCH_SIZE, concurrency))
+        self._executor = None
+        self._slots = None
+        if concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=concurrency)
+            self._slots = threading.BoundedSemaphore(concurrency)
         super().__init__(*args, **kwargs)
 
+    def run(self):
+        """Receive messages from the input queue.
+
+        In concurrent mode up to batch_size messages are received in one long poll, limited by
+        the number of idle workers, and each message is processed in the pool, being
+        acknowledged (deleted) or released on its own as soon as it is processed. Receiving
+        continues without waiting for run_interval while the queue returns full batches.
+        """
+        if not self._executor:
+            return super().run()
+
+        while True:
+            # wait for at least one idle worker and reserve all the others
+            self._slots.acquire()
+            reserved = 1
+            while reserved < self.batch_size and self._slots.acquire(blocking=False):
+                reserved += 1
+
+            try:
+                messages = self.input_queue.get_messages(num_messages=reserved)
+            except Exception:
+                messages = []
+                logger.exception('Failure receiving messages from the queue.')
+
+            for _ in range(reserved - len(messages)):
+                self._slots.release()
+            for message in messages:
+                self._executor.submit(self._process_and_ack, message)
+
+            if len(messages) < reserved:
+                # queue drained, wait for the next run
+                return
+
+    def _process_and_ack(self, message: SQSMessage):
+        """Process one message in the pool, then delete it if it was processed.
+
+        Messages not processed were already released back to the queue by process_message.
+
+        :param message: A message from the queue
+        """
+        try:
+            try:
+                success = self.process_message(message)
+            except Exception:
+                logger.exception('Failure processing message.')
+                success = False
+
+            if success:
+                message.delete()
+        except Exception:
+            logger.exception('Failure acknowledging message.')
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        """Wait for the messages being processed."""
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
     @newrelic.agent.background_task(name='process_message', group='Task')
     def process_message(self, message: SQSMessage) -> bool:
         """Process a message retrieved from the input_queue.
 
+        The visibility timeout of the message is extended while it is processed, and the
+        message is released back to the queue after a backoff if processing fails. Messages whose
+        message or order is still being processed are kept in the queue and retried after the
+        visibility timeout.
+
         :param message: A message from the queue
         :returns: Status from the process
         """
-        body = message.body
-        data = Objectify(body.get('data', {}))
-        event = body.get('event_name', '')
-        message_id = body.get('id', '')
-        data.sqs_message_id = message_id
-        dispatch = Objectify(self.dispatch_map.get(event, {}))
+        with VisibilityHeartbeat(message) as heartbeat:
+            success = self._process_message(message)
+            if success is None:
+                # retry later: visible again in the queue after the visibility timeout
+                return False
+            if not success:
+                heartbeat.stop(release=True)
+        return success
+
+    def _process_message(self, message: SQSMessage) -> bool:
+        """Dispatch a message retrieved from the input_queue.
+
+        :param message: A message from the queue
+        :returns: Status from the process, None if the message should be retried later
+        """
+        body = QueueMessage.from_dict(message.body)
+        data = dict(body.data or {})
+        event = body.event_name or ''
+        message_id = body.id or ''
+        data['sqs_message_id'] = message_id
+        order_id = data.get('id')
+        dispatch = self._dispatch.get(event)
         if not dispatch:
-            logger.info('Unknown event type - message {0} ignored'.format(body['id']))
+            logger.info('Unknown event type - message {0} ignored'.format(message_id))
             return True
 
+        store = idempotency.get_store() if dispatch.idempotent else None
+        claim = store.claim(message_id, order_id) if store else idempotency.CLAIMED
+        if claim == idempotency.DONE:
+            # duplicated delivery of a message or order already processed: drop it
+            return True
+        elif claim == idempotency.IN_PROGRESS:
+            # being processed, or claimed by a worker that crashed: retry later
+            return None
+
         logger.info('Processing event {event}'.format(event=event))
         try:
             status, payload = dispatch.action(data)
         except Exception as error:
+            if store:
+                store.release(order_id, message_id)
             msg = 'Unknown exception raised on \'{0}\' assignment {1}. \n' \
                   'Error: {2} \n Payload: {3}'
             logger.error(
                 msg.format(
                     dispatch.name,
-                    data.id,
+                    order_id,
                     error,
-                    data._dct
+                    data
                 )
             )
             raise  # Let newrelic deal with it.
@@ -94,8 +200,13 @@ class Worker(QueueWorker):
         logger.info(message.format(event=event))
         event()
         if not notification_action.success:  # processing failed
+            if store and dispatch.on_failure_retry:
+                store.release(order_id, message_id)
             # Return False if the message is to be retried
             return not dispatch.on_failure_retry
+        if store and status != alexandria.AssetsImportResult.submitted:
+            # submitted imports are marked as done when the import is completed
+            store.done(order_id, message_id)
         return True
 
 
@@ -107,7 +218,7 @@ def run_worker(queue_name: str, worker_name: str, dispatch_map: dict):
     :param dispatch_map: dict with configuration to be dispatched for each event name.
     :return:
     """
-    queue = getUtility(IQueue, queue_name)
+    queue = get_utility(IQueue, queue_name)
     worker = Worker(
         logger_=logger,
         input_queue=queue,
@@ -121,9 +232,16 @@ def run_worker(queue_name: str, worker_name: str, dispatch_map: dict):
     except Exception as exc:
         name = Worker.name
         logger.exception(f'{name} exiting due to an exception.', exc_info=exc)
+    finally:
+        worker.shutdown()
 
 
 NOTIFICATION_ACTIONS = {
+    alexandria.AssetsImportResult.submitted: NA(
+        events.ImportAssetsSubmitted,
+        True,
+        'Task for {event} was submitted'
+    ),
     alexandria.AssetsImportResult.success: NA(
         events.ImportAssetsSuccess,
         True,
@@ -139,10 +257,11 @@ NOTIFICATION_ACTIONS = {
 
 MESSAGE_DISPATCH = {
     'order.workflow.accept': dict(
-        name='alexandria.run',
-        action=alexandria.run,
+        name='alexandria.submit',
+        action=alexandria.submit,
         notification_actions=NOTIFICATION_ACTIONS,
-        on_failure_retry=True
+        on_failure_retry=True,
+        idempotent=True
     )
 }
 
@@ -0,0 +1,147 @@
+"""Renditions and metadata of the images computed while they are transferred to S3.
+
+download_and_upload_file has all the bytes of each image in memory, so the thumbnail and web
+renditions, the dimensions and the EXIF tags are computed there instead of reading the source
+from S3 again. Rendering is CPU bound: in the eventlet pool it runs in a native thread of
+eventlet.tpool, so it does not block the green threads transferring other files.
+
+Requires Pillow (extra "renditions") and RENDITIONS_ENABLED.
+"""
+from briefy.reflex import logger
+from briefy.reflex.config import RENDITIONS_ENABLED
+from briefy.reflex.config import RENDITIONS_QUALITY
+from briefy.reflex.config import RENDITIONS_SIZES
+from io import BytesIO
+
+import os
+import sys
+import typing as t
+
+
+try:
+    from PIL import ExifTags
+    from PIL import Image
+    from PIL import ImageOps
+except ImportError:
+    Image = None
+
+
+MAX_EXIF_VALUE = 256
+"""Max length of the EXIF values attached to the asset, longer ones (as maker notes) are dropped."""
+
+
+def parse_sizes(value: str) -> t.Dict[str, t.Tuple[int, int]]:
+    """Parse rendition sizes from a string as thumbnail:320x320,web:1920x1920."""
+    sizes = {}
+    for item in value.split(','):
+        name, _, size = item.strip().partition(':')
+        if name:
+            width, _, height = size.partition('x')
+            sizes[name] = (int(width), int(height or width))
+    return sizes
+
+
+def exif_tags(image) -> dict:
+    """Return the EXIF tags of an image with names as keys and json compatible values."""
+    getexif = getattr(image, 'getexif', None) or getattr(image, '_getexif', None)
+    raw = (getexif() if getexif else None) or {}
+    tags = {}
+    for tag, value in raw.items():
+        if isinstance(value, bytes):
+            continue
+        if not isinstance(value, (int, float, str)):
+            value = str(value)
+        if isinstance(value, str):
+            value = value.strip('\x00 ')
+            if len(value) > MAX_EXIF_VALUE:
+                continue
+        tags[ExifTags.TAGS.get(tag, str(tag))] = value
+    return tags
+
+
+def render(content: bytes, sizes: dict, quality: int=RENDITIONS_QUALITY) -> tuple:
+    """Compute the metadata and the renditions of one image.
+
+    :param content: image file contents
+    :param sizes: dict with rendition name as key and max (width, height) as value
+    :param quality: jpeg quality of the renditions
+    :return: tuple composed of (metadata dict, dict with rendition name as key and jpeg bytes)
+    """
+    image = Image.open(BytesIO(content))
+    metadata = {
+        'width': image.width,
+        'height': image.height,
+        'format': image.format,
+        'mode': image.mode,
+        'exif': exif_tags(image),
+    }
+    transpose = getattr(ImageOps, 'exif_transpose', None)
+    if transpose:
+        image = transpose(image)
+    image = image.convert('RGB')
+    renditions = {}
+    for name, size in sizes.items():
+        rendition = image.copy()
+        rendition.thumbnail(size, Image.LANCZOS)
+        output = BytesIO()
+        rendition.save(output, 'JPEG', quality=quality, optimize=True)
+        renditions[name] = output.getvalue()
+    return metadata, renditions
+
+
+def rendition_key(source_key: str, name: str) -> str:
+    """S3 key of a rendition, next to the source key.
+
+    :param source_key: S3 key of the source file, as source/assets/<asset_id>.jpg
+    :param name: rendition name
+    :return: key as source/assets/<asset_id>.<name>.jpg
+    """
+    base, _ = os.path.splitext(source_key)
+    return f'{base}.{name}.jpg'
+
+
+SIZES = parse_sizes(RENDITIONS_SIZES)
+"""Max (width, height) of each rendition."""
+
+RENDER_ERRORS = (OSError, SyntaxError, ValueError)
+"""Errors raised by Pillow for files it cannot read, as unknown formats or truncated images."""
+
+if Image is not None:
+    RENDER_ERRORS += (Image.DecompressionBombError, )
+
+if RENDITIONS_ENABLED and Image is None:
+    logger.warning('Renditions are enabled but Pillow is not installed, stage disabled.')
+
+
+def enabled() -> bool:
+    """Check if the renditions stage is enabled and Pillow is installed."""
+    return RENDITIONS_ENABLED and Image is not None
+
+
+def eventlet_patched() -> bool:
+    """Check if the process is monkey patched by the eventlet pool."""
+    patcher = sys.modules.get('eventlet.patcher')
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+def render_image(content: bytes) -> tuple:
+    """Compute the metadata and the renditions of one image without blocking the eventlet hub.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so with eventlet the render
+    runs in eventlet.tpool and the green threads keep transferring files meanwhile.
+
+    :param content: image file contents
+    :return: tuple composed of (metadata dict, dict of renditions), None if the stage is
+             disabled or the file cannot be rendered
+    """
+    if not enabled():
+        return None
+    try:
+        if eventlet_patched():
+            from eventlet import tpool
+            return tpool.execute(render, content, SIZES)
+        return render(content, SIZES)
+    except RENDER_ERRORS as exc:
+        # the same bytes would fail again, the file is transferred without renditions
+        logger.warning(f'Image cannot be rendered, renditions skipped: {exc!r}')
+        return None
@@ -0,0 +1,155 @@
+"""Fair scheduling of the asset tasks of many orders sharing the same queues.
+
+Asset tasks are published with a broker priority computed from the event source and the order
+size, so imports requested by the queue worker go before backfills and small orders are not
+stuck behind big ones. Each order also has a cap of tasks in flight, tasks over the cap are
+deferred to the end of the queue.
+"""
+from briefy.reflex import logger
+from briefy.reflex.config import SCHEDULING_DB
+from briefy.reflex.config import SCHEDULING_DEFER_SECONDS
+from briefy.reflex.config import SCHEDULING_MAX_DEFERRALS
+from briefy.reflex.config import SCHEDULING_ORDER_INFLIGHT
+
+import math
+import redis
+import time
+
+
+PRIORITY_STEPS = list(range(10))
+"""Priorities supported by the redis broker, 0 is the highest one."""
+
+QUEUE = 'queue'
+"""Import requested by an event received by the queue worker."""
+
+BACKFILL = 'backfill'
+"""Bulk import of orders from a csv report or an import plan."""
+
+SOURCE_PRIORITY = {
+    QUEUE: 0,
+    BACKFILL: 5,
+}
+"""Base priority of each event source."""
+
+MAX_SIZE_PENALTY = 4
+"""Max number of priority steps added to big orders."""
+
+
+def order_priority(source: str, assets: int) -> int:
+    """Compute the broker priority of the tasks of one order.
+
+    One step is added for each order of magnitude of the number of assets, so orders with
+    tens of assets go before orders with thousands of assets from the same source.
+
+    :param source: event source, QUEUE or BACKFILL
+    :param assets: number of assets in the order
+    :return: priority from 0 (highest) to 9
+    """
+    penalty = min(MAX_SIZE_PENALTY, int(math.log10(assets))) if assets > 0 else 0
+    base = SOURCE_PRIORITY.get(source, SOURCE_PRIORITY[BACKFILL])
+    return min(PRIORITY_STEPS[-1], base + penalty)
+
+
+def task_options(order_id: str, source: str, assets: int) -> dict:
+    """Options to publish the asset tasks of one order.
+
+    :param order_id: order ID
+    :param source: event source, QUEUE or BACKFILL
+    :param assets: number of assets in the order
+    :return: dict to be used with Signature.set
+    """
+    return {
+        'priority': order_priority(source, assets),
+        'headers': {'order_id': order_id},
+    }
+
+
+class InflightLimiter:
+    """Count the tasks of each order being executed by all workers.
+
+    Each order has a sorted set with one member per slot, scored by the time it was taken, so
+    slots never released by a crashed worker expire on their own after ttl seconds.
+    """
+
+    prefix = 'reflex:scheduling:inflight'
+    """Prefix of the redis keys."""
+
+    def __init__(
+            self, url: str=SCHEDULING_DB, limit: int=SCHEDULING_ORDER_INFLIGHT, ttl: int=3600
+    ):
+        """Initialize limiter.
+
+        :param url: redis database url
+        :param limit: max number of tasks of one order in flight, 0 to disable
+        :param ttl: max seconds a slot is held, so slots of crashed workers are recovered
+        """
+        self.redis = redis.StrictRedis.from_url(url)
+        self.limit = limit
+        self.ttl = ttl
+
+    def acquire(self, order_id: str, slot: str) -> bool:
+        """Take one slot of the order.
+
+        :param order_id: order ID
+        :param slot: unique id of the slot, as the task id
+        :return: False if the order reached the limit of tasks in flight
+        """
+        if not self.limit:
+            return True
+        key = f'{self.prefix}:{order_id}'
+        now = time.time()
+        pipeline = self.redis.pipeline()
+        pipeline.zremrangebyscore(key, '-inf', now - self.ttl)
+        pipeline.zadd(key, {slot: now})
+        pipeline.zrank(key, slot)
+        pipeline.expire(key, self.ttl)
+        rank = pipeline.execute()[2]
+        if rank >= self.limit:
+            self.redis.zrem(key, slot)
+            return False
+        return True
+
+    def release(self, order_id: str, slot: str):
+        """Give back one slot of the order."""
+        if self.limit:
+            self.redis.zrem(f'{self.prefix}:{order_id}', slot)
+
+
+_limiter = None
+
+
+def get_limiter() -> InflightLimiter:
+    """Return the limiter shared by the process."""
+    global _limiter
+    if _limiter is None:
+        _limiter = InflightLimiter()
+    return _limiter
+
+
+def run_with_slot(task, order_id: str, run: callable):
+    """Execute a task holding one slot of its order, deferring it if the order is at the limit.
+
+    A task deferred SCHEDULING_MAX_DEFERRALS times runs without a slot, so an order never waits
+    forever for slots that are not released.
+
+    :param task: bound ReflexTask instance
+    :param order_id: order ID
+    :param run: callable executing the task
+    :return: task result
+    """
+    limiter = get_limiter()
+    slot = task.request.id
+    if not limiter.acquire(order_id, slot):
+        deferrals = int(getattr(task.request, 'scheduling_deferrals', None) or 0)
+        if deferrals < SCHEDULING_MAX_DEFERRALS:
+            logger.debug(f'Order {order_id} at the limit of tasks in flight: {task.name} deferred.')
+            task.defer(SCHEDULING_DEFER_SECONDS, scheduling_deferrals=deferrals + 1)
+        logger.warning(
+            f'{task.name} of order {order_id} deferred {deferrals} times, running over the limit '
+            f'of tasks in flight.'
+        )
+        return run()
+    try:
+        return run()
+    finally:
+        limiter.release(order_id, slot)
@@ -1,11 +1,99 @@
 """Define briefy.reflex base task class."""
+from briefy.reflex import breaker
+from briefy.reflex import claimcheck
+from briefy.reflex import configure
 from briefy.reflex import logger
+from briefy.reflex import metrics
+from briefy.reflex import profiling
+from briefy.reflex import scheduling
 from briefy.reflex.celery import app
+from briefy.reflex.tasks.runtime import record_runtime
+from celery.exceptions import Ignore
+
+import time
 
 
 class ReflexTask(app.Task):
     """Base class to be used by all tasks in ms.laure.tasks module."""
 
+    claim_check_result = False
+    """If true large results are stored in the claim check store and a reference is returned."""
+
+    order_slot = False
+    """If true the task holds one of the slots of its order while running."""
+
+    backends = ()
+    """Backends called by the task, it is deferred while the circuit of one of them is open."""
+
+    def __call__(self, *args, **kwargs):
+        """Execute the task resolving claim check references in the arguments.
+
+        Tasks with order_slot are deferred if their order reached the limit of tasks in flight.
+        Tasks are deferred while the circuit of one of their backends, or of the backends of the
+        tasks they call directly, is open.
+        A sample of the executions is profiled if the task is enabled in the profiler.
+
+        :param args: list of additional arguments
+        :param kwargs: dict of additional arguments
+        :return: task result
+        """
+        configure()
+        try:
+            breaker.check(self.backends)
+            return self._run(args, kwargs)
+        except breaker.CircuitOpen as exc:
+            if self.request.called_directly or self.request.is_eager:
+                raise
+            logger.info(f'{self.name} deferred: {exc}')
+            self.defer(exc.retry_after)
+
+    def defer(self, countdown: float, **headers):
+        """Publish the task again after a countdown, without using one of its retries.
+
+        The task keeps its id, retries, callbacks and chord as in a retry, so deferrals by the
+        scheduler or the circuit breakers never exhaust max_retries.
+
+        :param countdown: seconds to wait before executing the task again
+        :param headers: additional message headers, available as attributes of the request
+        :raises Ignore: always, the current execution is acknowledged without a state update
+        """
+        headers = dict(self.request.headers or {}, **headers)
+        order_id = getattr(self.request, 'order_id', None)
+        if order_id:
+            headers['order_id'] = order_id
+        self.signature_from_request(countdown=countdown, headers=headers).apply_async()
+        raise Ignore()
+
+    def _run(self, args: tuple, kwargs: dict):
+        """Execute the task with the claim check, scheduling, metrics and profiling hooks.
+
+        :param args: list of additional arguments
+        :param kwargs: dict of additional arguments
+        :return: task result
+        """
+        args, kwargs = claimcheck.get_claim_check().resolve_args(args, kwargs)
+        if not self.request.called_directly:
+            metrics.observe_queue_wait(self)
+        start = time.monotonic()
+        order_id = getattr(self.request, 'order_id', None)
+        with profiling.profiler.sample(self.name):
+            # in the worker the request is already pushed, Task.__call__ would push a new one
+            # hiding it from retry, so autoretry_for and self.retry would not work
+            if self.request.called_directly:
+                result = super().__call__(*args, **kwargs)
+            elif self.order_slot and order_id:
+                result = scheduling.run_with_slot(self, order_id, lambda: self.run(*args, **kwargs))
+            else:
+                result = self.run(*args, **kwargs)
+        if not self.request.called_directly:
+            elapsed = time.monotonic() - start
+            metrics.observe_task(self, elapsed)
+            # used by the autoscaler to estimate the throughput of each pool
+            record_runtime(self.name, elapsed)
+        if self.claim_check_result and not self.request.called_directly:
+            result = claimcheck.check(result)
+        return result
+
     def on_failure(self, exc, task_id: str, args, kwargs, einfo):
         """Execute callback in case of failure.
 
@@ -16,8 +104,21 @@ class ReflexTask(app.Task):
         :param einfo: additional info
         :return:
         """
+        metrics.TASK_FAILURES.inc(metrics.task_labels(self))
         logger.debug(f'{task_id!r} failed: {exc!r}')
 
+    def on_retry(self, exc, task_id: str, args, kwargs, einfo):
+        """Execute callback when the task is retried.
+
+        :param exc: exception raised by the task
+        :param task_id: id of the task
+        :param args: list of additional arguments
+        :param kwargs: dict of additional arguments
+        :param einfo: additional info
+        :return:
+        """
+        metrics.TASK_RETRIES.inc(metrics.task_labels(self))
+
     def on_success(self, retval, task_id, args, kwargs):
         """Execute callback in case of success.
 
@@ -1,24 +1,34 @@
 """Tasks to query and insert data in briefy.alexandria."""
 from briefy.common.utilities.interfaces import IRemoteRestEndpoint
-from briefy.common.utils.data import Objectify
+from briefy.reflex import claimcheck
 from briefy.reflex import config
+from briefy.reflex import events
+from briefy.reflex import get_utility
 from briefy.reflex import logger
+from briefy.reflex import metrics
+from briefy.reflex import scheduling
 from briefy.reflex.celery import app
+from briefy.reflex.models import Collection
+from briefy.reflex.models import DriveFile
+from briefy.reflex.models import Order
+from briefy.reflex.queue.idempotency import get_store
 from briefy.reflex.tasks import leica
 from briefy.reflex.tasks import gdrive
 from briefy.reflex.tasks import s3
 from briefy.reflex.tasks import ReflexTask
 from briefy.reflex.tasks.kinesis import FOLDER_NAMES
 from celery import chain
+from celery import chord
 from celery import group
 from celery.result import GroupResult
+from redis.exceptions import LockError
 from requests.exceptions import ConnectionError
 from slugify import slugify
 from urllib3.exceptions import ProtocolError
-from zope.component import getUtility
 
 
 import enum
+import redis
 import typing as t
 import uuid
 
@@ -28,6 +38,52 @@ class AssetsImportResult(enum.Enum):
 
     success = 'success'
     failure = 'failure'
+    submitted = 'submitted'
+
+
+def file_extension(image: DriveFile) -> str:
+    """Compute the file extension used to store one gdrive image.
+
+    :param image: image payload from briefy.gdrive
+    :return: file extension without the dot
+    """
+    if image.mimeType == 'image/jpeg':
+        extension = 'jpg'
+    elif len(image.name) >= 3:
+        extension = image.name[-3:]
+    else:
+        extension = 'none'
+    return extension
+
+
+def asset_directory(order_id: str, item_id: str='') -> str:
+    """Local directory where the assets of one order (or requirement item) are saved.
+
+    :param order_id: order ID
+    :param item_id: requirement item ID, if the asset belongs to a requirement item collection
+    :return: directory path
+    """
+    if item_id:
+        return f'{config.TMP_PATH}/{order_id}/{item_id}'
+    return f'{config.TMP_PATH}/{order_id}'
+
+
+def delivery_images(folder_contents: dict) -> list:
+    """Return the images from the delivery folder and from the sub folders with known names.
+
+    :param folder_contents: briefy.gdrive.api.contents result
+    :return: list of gdrive image payloads
+    """
+    images = list(folder_contents.get('images', []))
+    sub_folders = [
+        folder for folder in folder_contents.get('folders', [])
+        if folder.get('name').lower().strip() in FOLDER_NAMES
+    ]
+
+    # make sure que get images also from sub folders
+    for folder in sub_folders:
+        images.extend(folder.get('images'))
+    return images
 
 
 @app.task(
@@ -36,6 +92,7 @@ class AssetsImportResult(enum.Enum):
     autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError),
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
+    backends=('alexandria', ),
 )
 def create_collections(self, order_payload: dict) -> dict:
     """Create all collections in Alexandria if the do not exists.
@@ -44,9 +101,11 @@ def create_collections(self, order_payload: dict) -> dict:
     :param order_payload: payload of order from leica
     :return: order collection payload from the library
     """
-    factory = getUtility(IRemoteRestEndpoint)
-    library_api = factory(config.ALEXANDRIA_BASE, 'collections', 'Collections')
-    order = Objectify(order_payload)
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'collections', 'Collections'), 'alexandria'
+    )
+    order = Order.from_dict(order_payload)
     collections = [
         (order.customer, 'customer'),
         (order.project, 'project'),
@@ -95,11 +154,31 @@ def create_collections(self, order_payload: dict) -> dict:
     return library_api.get(order.id)
 
 
+_lock_client = None
+
+
+def asset_lock(slug: str) -> redis.lock.Lock:
+    """Lock serializing the changes of one asset, which is read, changed and written back.
+
+    :param slug: asset slug, the google drive id of the image
+    :return: redis lock to be used as context manager, raises LockError if not acquired
+    """
+    global _lock_client
+    if _lock_client is None:
+        _lock_client = redis.StrictRedis.from_url(config.ASSETS_LOCK_DB)
+    return _lock_client.lock(
+        f'reflex:asset:{slug}', timeout=config.ASSETS_LOCK_TIMEOUT,
+        blocking_timeout=config.ASSETS_LOCK_TIMEOUT
+    )
+
+
 @app.task(
     base=ReflexTask,
-    autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError),
+    autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError, LockError),
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
+    order_slot=True,
+    backends=('alexandria', ),
 )
 def add_or_update_asset(image_payload: dict, collection_payload: dict) -> t.Tuple[str, str]:
     """Add one assets in Alexandria if it do not exists.
@@ -108,119 +187,139 @@ def add_or_update_asset(image_payload: dict, collection_payload: dict) -> t.Tupl
     :param collection_payload: payload of order collection from briefy.alexandria
     :return: asset file_path
     """
-    collection = Objectify(collection_payload)
-    factory = getUtility(IRemoteRestEndpoint)
-    library_api = factory(config.ALEXANDRIA_BASE, 'assets', 'Assets')
-    image = Objectify(image_payload)
-    data = library_api.query({'slug': image.id})['data']
-
-    if image.mimeType == 'image/jpeg':
-        extension = 'jpg'
-    elif len(image.name) >= 3:
-        extension = image.name[-3:]
-    else:
-        extension = 'none'
-
-    if not data:
-        tags = ['gdrive', 'image']
-        tags.extend(collection.tags)
-        asset_id = uuid.uuid4()
-        file_name = f'{asset_id}.{extension}'
-        source_path = f'{config.AWS_ASSETS_SOURCE}/{file_name}'
-        payload = {
-            'slug': image.id,
-            'id': uuid.uuid4(),
-            'title': image.name,
-            'description': '',
-            'content_type': image.mimeType,
-            'source_path': source_path,
-            'tags': tags,
-            'collections': [collection.id],
-            'size': image.size,
-            'properties': {
-                'metadata': image.imageMediaMetadata,
-                'external_links': {
-                    'view': image.webViewLink,
-                    'download': image.webContentLink
+    collection = Collection.from_dict(collection_payload)
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'assets', 'Assets'), 'alexandria'
+    )
+    image = DriveFile.from_dict(image_payload)
+    with asset_lock(image.id):
+        data = library_api.query({'slug': image.id})['data']
+        extension = file_extension(image)
+
+        if not data:
+            tags = ['gdrive', 'image']
+            tags.extend(collection.tags)
+            asset_id = uuid.uuid4()
+            file_name = f'{asset_id}.{extension}'
+            source_path = f'{config.AWS_ASSETS_SOURCE}/{file_name}'
+            payload = {
+                'slug': image.id,
+                'id': uuid.uuid4(),
+                'title': image.name,
+                'description': '',
+                'content_type': image.mimeType,
+                'source_path': source_path,
+                'tags': tags,
+                'collections': [collection.id],
+                'size': image.size,
+                'properties': {
+                    'metadata': image.imageMediaMetadata,
+                    'external_links': {
+                        'view': image.webViewLink,
+                        'download': image.webContentLink
+                    }
                 }
             }
-        }
-        data = library_api.post(payload)
-    else:
-        data = data[0]
-        asset_id = data.get('id')
-        data = library_api.get(asset_id)
-        asset_collections = data.get('collections')
-        if collection.id not in asset_collections:
-            asset_collections.append(collection.id)
-            data = library_api.put(asset_id, data)
-
-        file_name = f'{asset_id}.{extension}'
+            data = library_api.post(payload)
+        else:
+            data = data[0]
+            asset_id = data.get('id')
+            data = library_api.get(asset_id)
+            asset_collections = data.get('collections')
+            if collection.id not in asset_collections:
+                asset_collections.append(collection.id)
+                data = library_api.put(asset_id, data)
+
+            file_name = f'{asset_id}.{extension}'
 
     if not data:
         raise RuntimeError(f'Failed to add or update asset: {image_payload}')
 
     # in this case we should have one more directory
     if collection.content_type == 'application/collection.leica-order.requirement':
-        order_id = collection.parent_id
-        directory = f'{config.TMP_PATH}/{order_id}/{collection.id}'
+        directory = asset_directory(collection.parent_id, collection.id)
     else:
-        order_id = collection.id
-        directory = f'{config.TMP_PATH}/{order_id}'
+        directory = asset_directory(collection.id)
 
     logger.info(f'Asset added to alexandria. Path to save file: {directory}/{file_name}')
     return directory, file_name
 
 
-def create_assets(collection_payload: dict, order_payload: dict) -> group:
+@app.task(
+    base=ReflexTask,
+    autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError, LockError),
+    retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
+    retry_backoff=True,
+    backends=('alexandria', ),
+)
+def attach_renditions(image_id: str, metadata: dict, keys: dict):
+    """Add the metadata and the renditions of one image to its asset.
+
+    Published by :func:`briefy.reflex.tasks.s3.download_and_upload_file` after the upload.
+
+    :param image_id: google drive id of the image, used as asset slug
+    :param metadata: image metadata, see briefy.reflex.renditions.render
+    :param keys: dict with rendition name as key and S3 key as value
+    """
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'assets', 'Assets'), 'alexandria'
+    )
+    with asset_lock(image_id):
+        data = library_api.query({'slug': image_id})['data']
+        if not data:
+            raise RuntimeError(f'Asset of image {image_id} not found to attach renditions.')
+        asset_id = data[0].get('id')
+        asset = library_api.get(asset_id)
+        properties = asset.get('properties') or {}
+        properties['image'] = metadata
+        properties['renditions'] = keys
+        asset['properties'] = properties
+        library_api.put(asset_id, asset)
+
+
+def create_assets(
+        collection_payload: dict, order_payload: dict, source: str=scheduling.QUEUE
+) -> group:
     """Create all assets in Alexandria if the do not exists.
 
     :param collection_payload: payload of order collection from briefy.alexandria
     :param order_payload: payload of order from leica
+    :param source: event source used to compute the priority of the tasks, see scheduling
     :return: list of orders returned from listing payload
     """
-    factory = getUtility(IRemoteRestEndpoint)
-    library_api = factory(config.ALEXANDRIA_BASE, 'collections', 'Collections')
-    order = Objectify(order_payload)
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'collections', 'Collections'), 'alexandria'
+    )
+    order = Order.from_dict(order_payload, ('id', 'requirement_items', 'delivery'))
 
-    tasks = []
+    assets = []
     if order.requirement_items:
         for item in order.requirement_items:
             folder_contents = gdrive.folder_contents.delay(item.folder_id).get()
-            images = folder_contents.get('images')
-            collection_payload = library_api.get(item.id)
-            image_tasks = [
-                chain(
-                    add_or_update_asset.s(image, collection_payload),
-                    s3.download_and_upload_file.s(image),
-                ) for image in images
-            ]
-
-            tasks.extend(image_tasks)
+            images = claimcheck.resolve(folder_contents).get('images')
+            # the collection is stored once and passed by reference to each image task
+            collection = claimcheck.check(library_api.get(item.id))
+            assets.extend((image, collection) for image in images)
 
     else:
         folder_contents = gdrive.folder_contents.delay(
             order.delivery.gdrive,
             extract_id=True
         ).get()
-        images = folder_contents.get('images')
-        sub_folders = [
-            folder for folder in folder_contents.get('folders')
-            if folder.get('name').lower().strip() in FOLDER_NAMES
-        ]
-
-        # make sure que get images also from sub folders
-        for folder in sub_folders:
-            images.extend(folder.get('images'))
-
-        image_tasks = [
-            chain(
-                add_or_update_asset.s(image, collection_payload),
-                s3.download_and_upload_file.s(image),
-            ) for image in images
-        ]
-        tasks.extend(image_tasks)
-
+        images = delivery_images(claimcheck.resolve(folder_contents))
+        collection = claimcheck.check(collection_payload)
+        assets.extend((image, collection) for image in images)
+
+    options = scheduling.task_options(order.id, source, len(assets))
+    tasks = [
+        chain(
+            add_or_update_asset.s(image, collection).set(**options),
+            s3.download_and_upload_file.s(image).set(**options),
+        ) for image, collection in assets
+    ]
     return group(tasks)
 
 
@@ -229,6 +328,7 @@ def create_assets(collection_payload: dict, order_payload: dict) -> group:
     autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError),
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
+    backends=('leica', 'alexandria', 'gdrive'),
 )
 def add_order(order: dict, from_csv: bool=False) -> GroupResult:
     """Upload one order to alexandria library.
@@ -237,10 +337,12 @@ def add_order(order: dict, from_csv: bool=False) -> GroupResult:
     :param from_csv: means that the order payload is from the csv report and we need to query leica
     :return: async group result fro m celery group execution
     """
+    source = scheduling.QUEUE
     if from_csv:
         order = leica.get_order(order.get('uid'))
+        source = scheduling.BACKFILL
     collection = create_collections(order)
-    return create_assets(collection, order)()
+    return create_assets(collection, order, source)()
 
 
 @app.task(base=ReflexTask)
@@ -257,6 +359,108 @@ def run(order) -> tuple:
     return status, result
 
 
+def notify(event_class: type, order: dict, payload: dict):
+    """Fire one import event for an order.
+
+    :param event_class: event class from briefy.reflex.events
+    :param order: order payload received from the queue
+    :param payload: event payload
+    """
+    response = events.ResponseWrapper(order, payload)
+    event = event_class(response)
+    logger.info(f'Import of order {order.get("id")} finished: {event.event_name}')
+    event()
+
+
+@app.task(base=ReflexTask)
+def import_completed(assets: list, order: dict) -> dict:
+    """Fire the success event after all assets of the order were imported.
+
+    Used as the chord callback of :func:`import_order`.
+
+    The per-asset results are only read by the chord, the result stored for the order is a
+    summary without the asset paths, so one order does not keep two copies of them.
+
+    :param assets: list of S3 source paths of the imported assets
+    :param order: order payload received from the queue
+    :return: import summary
+    """
+    get_store().done(order.get('id'), order.get('sqs_message_id'))
+    notify(events.ImportAssetsSuccess, order, {'assets': assets})
+    return {'order_id': order.get('id'), 'assets': len(assets)}
+
+
+@app.task(base=ReflexTask)
+def import_failed(task_id, *args, order: dict) -> dict:
+    """Fire the failure event if one of the assets of the order could not be imported.
+
+    Used as the error callback of :func:`import_order` and of its chord, celery calls it with
+    the id of the failed task or with (request, exception, traceback).
+
+    :param task_id: failed task id or request
+    :param order: order payload received from the queue
+    :return: import summary
+    """
+    error = args[0] if args else None
+    summary = {'assets': [], 'error': repr(error) if error else f'Task failed: {task_id}'}
+    # release the order so the import can be requested again
+    get_store().release(order.get('id'), order.get('sqs_message_id'))
+    notify(events.ImportAssetsFailure, order, summary)
+    return summary
+
+
+@app.task(
+    base=ReflexTask,
+    autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError),
+    retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
+    retry_backoff=True,
+    backends=('alexandria', 'gdrive'),
+)
+def import_order(order: dict) -> str:
+    """Start the import of one order and track its completion without blocking.
+
+    A chord executes all asset chains of the order and fires the success or failure event when
+    the last one finishes.
+
+    :param order: order payload received from the queue
+    :return: id of the chord callback task
+    """
+    collection = create_collections(order)
+    assets = create_assets(collection, order)
+    reference = claimcheck.check(order)
+    callback = import_completed.s(reference).on_error(import_failed.s(order=reference))
+    if not assets.tasks:
+        return callback.delay([]).id
+    return chord(assets)(callback).id
+
+
+def submit(order: dict) -> tuple:
+    """Submit the import of one order to the tasks workers and return immediately.
+
+    The import events are fired by :func:`import_completed` or :func:`import_failed`, also
+    used as error callback of :func:`import_order` itself, so an import failing before the
+    chord is started still fires the failure event and releases the idempotency claim.
+
+    :param order: order payload received from the queue
+    :return: tuple composed of (status, payload)
+    """
+    reference = claimcheck.check(order)
+    result = import_order.apply_async((reference, ), link_error=import_failed.s(order=reference))
+    return AssetsImportResult.submitted, {'task_id': result.id}
+
+
+def accepted_orders(uri: str) -> t.Sequence[dict]:
+    """Return the accepted orders with a delivery link from the orders csv report.
+
+    :param uri: link to all orders csv file
+    :return: list of orders from the csv file
+    """
+    return [
+        order for order in leica.orders_from_csv(uri)
+        if order.get('order_status') == 'accepted' and order.get('delivery_link')
+    ]
+
+
 def main(uri: str, chunk_size=10) -> list:
     """Create assets for all orders in one project.
 
@@ -264,10 +468,7 @@ def main(uri: str, chunk_size=10) -> list:
     :param chunk_size: number of tasks per chunk of execution
     :return: list of celery async result instances, the number depends of the chunk size
     """
-    orders = [
-        order for order in leica.orders_from_csv(uri)
-        if order.get('order_status') == 'accepted' and order.get('delivery_link')
-    ]
+    orders = accepted_orders(uri)
     number_of_orders = len(orders)
     number_of_chunks = number_of_orders // chunk_size
     param_list = [(order, True) for order in orders]
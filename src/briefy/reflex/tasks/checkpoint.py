@@ -0,0 +1,190 @@
+"""Persistent checkpoints of kinesis shard sequence numbers."""
+from abc import ABC
+from abc import abstractmethod
+from briefy.reflex import logger
+from briefy.reflex.config import KINESIS_CHECKPOINT_RECORDS
+from briefy.reflex.config import KINESIS_CHECKPOINT_SECONDS
+from briefy.reflex.config import KINESIS_CHECKPOINT_STORE
+from datetime import datetime
+
+import os
+import redis
+import sqlite3
+import threading
+import time
+
+
+class CheckpointStore(ABC):
+    """Base class for checkpoint stores."""
+
+    @abstractmethod
+    def load(self, stream: str) -> dict:
+        """Load the checkpoints of one stream.
+
+        :param stream: kinesis stream name
+        :return: dict with shard id as key and the last processed sequence number as value
+        """
+
+    @abstractmethod
+    def save(self, stream: str, sequences: dict):
+        """Save the checkpoints of one stream.
+
+        :param stream: kinesis stream name
+        :param sequences: dict with shard id as key and the last processed sequence number as value
+        """
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    """Keep checkpoints in memory, used for benchmarks and replays."""
+
+    def __init__(self):
+        """Initialize store."""
+        self._data = {}
+
+    def load(self, stream: str) -> dict:
+        """Load the checkpoints of one stream."""
+        return dict(self._data.get(stream, {}))
+
+    def save(self, stream: str, sequences: dict):
+        """Save the checkpoints of one stream."""
+        self._data.setdefault(stream, {}).update(sequences)
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Store checkpoints in a local SQLite file."""
+
+    def __init__(self, path: str):
+        """Initialize store and create the checkpoints table if needed.
+
+        :param path: SQLite file path
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints ('
+                'stream TEXT NOT NULL, shard_id TEXT NOT NULL, sequence_number TEXT NOT NULL, '
+                'updated_at TEXT NOT NULL, PRIMARY KEY (stream, shard_id))'
+            )
+
+    def load(self, stream: str) -> dict:
+        """Load the checkpoints of one stream."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT shard_id, sequence_number FROM checkpoints WHERE stream = ?', (stream, )
+            ).fetchall()
+        return dict(rows)
+
+    def save(self, stream: str, sequences: dict):
+        """Save the checkpoints of one stream."""
+        updated_at = datetime.utcnow().isoformat()
+        rows = [
+            (stream, shard_id, sequence_number, updated_at)
+            for shard_id, sequence_number in sequences.items()
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO checkpoints '
+                '(stream, shard_id, sequence_number, updated_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+
+
+class RedisCheckpointStore(CheckpointStore):
+    """Store checkpoints in a redis hash per stream."""
+
+    prefix = 'reflex:kinesis:checkpoints'
+    """Prefix of the redis keys."""
+
+    def __init__(self, url: str):
+        """Initialize store.
+
+        :param url: redis database url
+        """
+        self.redis = redis.StrictRedis.from_url(url, decode_responses=True)
+
+    def load(self, stream: str) -> dict:
+        """Load the checkpoints of one stream."""
+        return self.redis.hgetall(f'{self.prefix}:{stream}')
+
+    def save(self, stream: str, sequences: dict):
+        """Save the checkpoints of one stream."""
+        if sequences:
+            self.redis.hmset(f'{self.prefix}:{stream}', sequences)
+
+
+def get_store(uri: str=KINESIS_CHECKPOINT_STORE) -> CheckpointStore:
+    """Create a checkpoint store from an uri.
+
+    :param uri: sqlite:///path/to/file.sqlite, redis://host:port/db or memory://,
+                empty to disable
+    :return: checkpoint store instance or None
+    """
+    if not uri:
+        return None
+    elif uri.startswith('memory://'):
+        return MemoryCheckpointStore()
+    elif uri.startswith('sqlite://'):
+        return SQLiteCheckpointStore(uri[len('sqlite://'):])
+    elif uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCheckpointStore(uri)
+    raise ValueError(f'Unknown checkpoint store: {uri}')
+
+
+class Checkpointer:
+    """Write checkpoints of one stream in batches, every N records or T seconds."""
+
+    def __init__(
+            self, store: CheckpointStore, stream: str,
+            every_records: int=KINESIS_CHECKPOINT_RECORDS,
+            every_seconds: float=KINESIS_CHECKPOINT_SECONDS
+    ):
+        """Initialize checkpointer.
+
+        :param store: checkpoint store, if None checkpoints are not persisted
+        :param stream: kinesis stream name
+        :param every_records: flush after this number of records
+        :param every_seconds: flush after this number of seconds
+        """
+        self.store = store
+        self.stream = stream
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self._pending = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    def load(self) -> dict:
+        """Load the last persisted sequence number of each shard."""
+        if not self.store:
+            return {}
+        sequences = self.store.load(self.stream)
+        if sequences:
+            logger.info(f'Resuming stream "{self.stream}" from {len(sequences)} checkpoints.')
+        return sequences
+
+    def update(self, shard_id: str, sequence_number: str):
+        """Register one processed record, flushing if needed.
+
+        :param shard_id: shard id
+        :param sequence_number: sequence number of the processed record
+        """
+        if not self.store:
+            return
+        self._pending[shard_id] = sequence_number
+        self._count += 1
+        elapsed = time.monotonic() - self._last_flush
+        if self._count >= self.every_records or elapsed >= self.every_seconds:
+            self.flush()
+
+    def flush(self):
+        """Persist all pending checkpoints."""
+        if self.store and self._pending:
+            self.store.save(self.stream, self._pending)
+        self._pending = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
@@ -4,23 +4,39 @@ from briefy.reflex.config import CELERY_DEFAULT_QUEUE
 from briefy.reflex.config import CELERY_DEFAULT_QUEUE_DRIVE
 from briefy.reflex.config import CELERY_DEFAULT_QUEUE_S3
 from briefy.reflex.config import TASKS_BROKER
+from briefy.reflex.config import TASKS_LEAN_RESULTS
 from briefy.reflex.config import TASKS_RESULT_DB
+from briefy.reflex.config import TASKS_RESULT_EXPIRES
+from briefy.reflex.config import TASKS_RESULT_SERIALIZER
+from briefy.reflex.config import TASKS_TRACK_STARTED
+from briefy.reflex.scheduling import BACKFILL
+from briefy.reflex.scheduling import PRIORITY_STEPS
+from briefy.reflex.scheduling import SOURCE_PRIORITY
+from fnmatch import fnmatch
 
 
 # Tell celery to use your new serializer:
-accept_content = ['application/json']
+accept_content = ['application/json', 'application/x-msgpack']
 # task_serializer = 'custom_json'
-# result_serializer = 'custom_json'
+result_serializer = TASKS_RESULT_SERIALIZER
 
 # Broker settings.
 broker_url = TASKS_BROKER
 
+# broker priorities (0 is the highest), see briefy.reflex.scheduling
+broker_transport_options = {
+    'priority_steps': PRIORITY_STEPS,
+    'queue_order_strategy': 'priority',
+}
+task_default_priority = SOURCE_PRIORITY[BACKFILL]
+
 # List of modules to import when the Celery worker starts.
 imports = (
     'briefy.reflex.tasks.alexandria',
     'briefy.reflex.tasks.leica',
     'briefy.reflex.tasks.gdrive',
     'briefy.reflex.tasks.kinesis',
+    'briefy.reflex.tasks.planner',
     'briefy.reflex.tasks.s3'
 )
 
@@ -38,6 +54,10 @@ task_routes = {
         'queue': CELERY_DEFAULT_QUEUE,
         'routing_key': 'briefy.reflex.tasks.leica',
     },
+    'briefy.reflex.tasks.planner.*': {
+        'queue': CELERY_DEFAULT_QUEUE,
+        'routing_key': 'briefy.reflex.tasks.planner',
+    },
     'briefy.reflex.tasks.kinesis.*': {
         'queue': CELERY_DEFAULT_QUEUE,
         'routing_key': 'briefy.reflex.tasks.kinesis',
@@ -52,11 +72,34 @@ task_routes = {
     },
 }
 
+
+def task_queue(name: str) -> str:
+    """Return the queue of a task name using the celery task routes."""
+    for pattern, route in task_routes.items():
+        if fnmatch(name, pattern):
+            return route['queue']
+    return CELERY_DEFAULT_QUEUE
+
+
 # Using the database to store task state and results.
 result_backend = TASKS_RESULT_DB
 
 # lifetime to store results in the result database (seconds)
-result_expires = 86400
+result_expires = TASKS_RESULT_EXPIRES
+
+# intermediate chain links: their results are sent to the next link in the task message and
+# never read from the result backend, only the final link of each chain stores its result:
+# the chord of the order joins them from the backend and they expire after result_expires
+INTERMEDIATE_TASKS = (
+    'briefy.reflex.tasks.alexandria.add_or_update_asset',
+    'briefy.reflex.tasks.leica.get_assets_contents',
+    'briefy.reflex.tasks.s3.file_exists',
+    'briefy.reflex.tasks.s3.upload_file',
+)
+
+task_annotations = {
+    name: {'ignore_result': True} for name in INTERMEDIATE_TASKS
+} if TASKS_LEAN_RESULTS else {}
 
 # if true run task local
 task_always_eager = False if config.ENV != 'test' else True
@@ -65,8 +108,9 @@ task_always_eager = False if config.ENV != 'test' else True
 task_acks_late = True
 task_reject_on_worker_lost = True
 
-# limiting the prefetch to one (default is 4) to balance better the tasks between workers
-# worker_prefetch_multiplier = 1
+# limiting the prefetch to one (default is 4) to balance better the tasks between workers,
+# each queue has its own value in the worker profiles, see briefy.reflex.tasks.worker
+worker_prefetch_multiplier = 1
 
-# track tasks started but not finished
-task_track_started = True
+# track tasks started but not finished (one more write to the result backend per task)
+task_track_started = TASKS_TRACK_STARTED
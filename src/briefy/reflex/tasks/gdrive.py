@@ -1,8 +1,12 @@
 """Tasks to query data from google drive."""
-from briefy.common.utils.data import Objectify
-from briefy.gdrive import api
+from briefy.reflex import claimcheck
 from briefy.reflex import config
+from briefy.reflex import configure
+from briefy.reflex import metrics
 from briefy.reflex.celery import app
+from briefy.reflex.checksum import HashingWriter
+from briefy.reflex.lazy import lazy_import
+from briefy.reflex.models import DriveFile
 from briefy.reflex.tasks import ReflexTask
 from celery import group
 from googleapiclient.errors import HttpError
@@ -13,12 +17,17 @@ import os
 import typing as t
 
 
+api = metrics.instrument(lazy_import('briefy.gdrive.api', on_load=configure), 'gdrive')
+
+
 @app.task(
     base=ReflexTask,
     autoretry_for=(HttpError, SSLError, OSError),
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
     rate_limit=config.GDRIVE_RATE_LIMIT,
+    claim_check_result=True,
+    backends=('gdrive', ),
 )
 def folder_contents(folder_id: str, extract_id=False, permissions=False, subfolders=True) -> dict:
     """Return folder contents from gdrive uri.
@@ -40,6 +49,7 @@ def folder_contents(folder_id: str, extract_id=False, permissions=False, subfold
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
     rate_limit=config.GDRIVE_RATE_LIMIT,
+    backends=('gdrive', ),
 )
 def download_file(destiny: t.Tuple[str, str], image_payload: dict) -> t.Tuple[str, str]:
     """Download file from a gdrive api and save in the file system.
@@ -49,13 +59,17 @@ def download_file(destiny: t.Tuple[str, str], image_payload: dict) -> t.Tuple[st
     :return: destiny file path of downloaded file
     """
     directory, file_name = destiny
-    image = Objectify(image_payload)
+    image = DriveFile.from_dict(image_payload, ('id', 'md5Checksum'))
     if not os.path.exists(directory):
         os.makedirs(directory)
 
     file_path = f'{directory}/{file_name}'
-    with open(file_path, 'wb') as data:
-        data.write(api.get_file(image.id))
+    content = api.get_file(image.id)
+    metrics.record_bytes('gdrive', 'download', len(content))
+    with HashingWriter(open(file_path, 'wb'), sha256=False) as data:
+        data.write(content)
+    # ChecksumMismatch is an OSError, the download is retried
+    data.verify(image.md5Checksum, file_name)
 
     return directory, file_name
 
@@ -66,6 +80,7 @@ def download_file(destiny: t.Tuple[str, str], image_payload: dict) -> t.Tuple[st
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
     rate_limit=config.GDRIVE_RATE_LIMIT,
+    backends=('gdrive', ),
 )
 def move(origin: str, destiny: str, extract_ids=False) -> dict:
     """Return folder contents from gdrive uri.
@@ -105,7 +120,7 @@ def run(orders):
         tasks.append(task)
 
     task_group = group(tasks)()
-    return task_group.join()
+    return [claimcheck.resolve(item) for item in task_group.join()]
 
 
 @app.task(
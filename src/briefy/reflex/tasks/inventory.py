@@ -0,0 +1,196 @@
+"""Streaming inventory of the gdrive delivery, archive and submission folders of orders."""
+from array import array
+from briefy.reflex.tasks.kinesis import count_assets
+
+import csv
+import os
+
+
+FIELDNAMES = (
+    'briefy_id', 'number_required_assets', 'number_submissions', 'total_submissions_images',
+    'total_submissions_videos', 'total_submissions_others', 'total_archive_images',
+    'total_archive_videos', 'total_archive_others', 'total_delivery_images',
+    'total_delivery_videos', 'total_delivery_others', 'submission_links', 'archive_link',
+    'delivery_link', 'order_link'
+)
+"""Columns of the inventory csv files."""
+
+COLUMNS = (
+    'number_required_assets', 'number_submissions', 'total_submissions_images',
+    'total_submissions_videos', 'total_submissions_others', 'total_archive_images',
+    'total_archive_videos', 'total_archive_others', 'total_delivery_images',
+    'total_delivery_videos', 'total_delivery_others',
+)
+"""Numeric columns aggregated by the inventory."""
+
+ALL = 'all'
+ZERO = 'zero'
+ARCHIVE = 'archive'
+SUBMISSION = 'submission'
+
+OUTPUTS = {
+    ALL: '/tmp/orders-image-inventory.csv',
+    ARCHIVE: '/tmp/orders-inventory-check-archive.csv',
+    SUBMISSION: '/tmp/orders-inventory-check-submission.csv',
+    ZERO: '/tmp/orders-inventory-zero-images.csv',
+}
+"""Default csv file for each category."""
+
+
+def inventory_row(order: dict, contents: dict) -> dict:
+    """Compute the inventory row of one order.
+
+    :param order: order payload
+    :param contents: contents payload from tasks.leica.get_assets_contents
+    :return: dict with one value for each column in FIELDNAMES
+    """
+    delivery = order.get('delivery') or {}
+    total_delivery = count_assets(contents.get('delivery'))
+    total_archive = count_assets(contents.get('archive'))
+    submissions = contents.get('submissions') or []
+    submissions_images = submissions_videos = submissions_others = 0
+    for submission in submissions:
+        total = count_assets(submission)
+        submissions_images += total.images
+        submissions_videos += total.videos
+        submissions_others += total.others
+
+    submission_links = ','.join(
+        str(assignment.get('submission_path', 'null'))
+        for assignment in order.get('assignments') or []
+    )
+    return {
+        'total_delivery_images': total_delivery.images,
+        'total_delivery_videos': total_delivery.videos,
+        'total_delivery_others': total_delivery.others,
+        'total_archive_images': total_archive.images,
+        'total_archive_videos': total_archive.videos,
+        'total_archive_others': total_archive.others,
+        'total_submissions_images': submissions_images,
+        'total_submissions_videos': submissions_videos,
+        'total_submissions_others': submissions_others,
+        'number_submissions': len(submissions),
+        'briefy_id': order.get('slug'),
+        'delivery_link': delivery.get('gdrive'),
+        'archive_link': delivery.get('archive'),
+        'submission_links': submission_links,
+        'number_required_assets': order.get('number_required_assets'),
+        'order_link': f'https://app.briefy.co/orders/{order.get("id")}'
+    }
+
+
+def debug_category(row: dict) -> str:
+    """Return the debug category of one inventory row.
+
+    :param row: inventory row
+    :return: category name or empty string if the order does not need to be checked
+    """
+    if not row['total_delivery_images']:
+        return ZERO
+    elif row['total_delivery_images'] > row['total_archive_images']:
+        return ARCHIVE
+    elif row['total_submissions_images'] == 0:
+        return SUBMISSION
+    return ''
+
+
+class Inventory:
+    """Aggregate inventory rows in one pass, appending each row to the csv files as it arrives.
+
+    Only the totals and the order slugs are kept in memory: one array with a counter per numeric
+    column and the set of slugs already counted for each category.
+
+    The csv files are appended to, so a consumer resuming from its checkpoints keeps the rows
+    written before a restart. Those rows are added to the totals when the inventory starts, and
+    orders read again from the stream are written only once.
+    """
+
+    def __init__(self, outputs: dict=None):
+        """Initialize inventory, loading the rows already in the csv files.
+
+        :param outputs: dict with category as key and csv file path as value
+        """
+        self.outputs = outputs or OUTPUTS
+        self.orders = {category: 0 for category in self.outputs}
+        self.totals = {category: array('q', [0] * len(COLUMNS)) for category in self.outputs}
+        self._slugs = {category: set() for category in self.outputs}
+        self._files = {}
+        self._writers = {}
+        for category, file_path in self.outputs.items():
+            directory = os.path.dirname(file_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            new = not os.path.exists(file_path) or not os.path.getsize(file_path)
+            if not new:
+                self._load(category, file_path)
+            fout = open(file_path, 'a', buffering=1, newline='')
+            writer = csv.DictWriter(fout, FIELDNAMES)
+            if new:
+                writer.writeheader()
+            self._files[category] = fout
+            self._writers[category] = writer
+
+    def __enter__(self):
+        """Use the inventory as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the csv files."""
+        self.close()
+
+    def add(self, order: dict, contents: dict) -> dict:
+        """Add one order to the inventory, can be used as KinesisConsumer item_callback.
+
+        :param order: order payload
+        :param contents: contents payload from tasks.leica.get_assets_contents
+        :return: inventory row
+        """
+        row = inventory_row(order, contents)
+        self._append(ALL, row)
+        category = debug_category(row)
+        if category:
+            self._append(category, row)
+        return row
+
+    def _load(self, category: str, file_path: str):
+        """Add the rows of an existing csv file to the category totals."""
+        with open(file_path, newline='') as fin:
+            for row in csv.DictReader(fin):
+                self._count(category, row)
+
+    def _append(self, category: str, row: dict):
+        """Write the row to the category csv and add its values to the category totals."""
+        if category in self._writers and self._count(category, row):
+            self._writers[category].writerow(row)
+
+    def _count(self, category: str, row: dict) -> bool:
+        """Add the values of a row to the category totals, once per order.
+
+        :param category: category name
+        :param row: inventory row, values are strings if read from the csv file
+        :return: False if the order was already counted in the category
+        """
+        slug = row['briefy_id']
+        if slug:
+            if slug in self._slugs[category]:
+                return False
+            self._slugs[category].add(slug)
+        self.orders[category] += 1
+        totals = self.totals[category]
+        for index, column in enumerate(COLUMNS):
+            totals[index] += int(row[column] or 0)
+        return True
+
+    def total(self, column: str, category: str=ALL) -> int:
+        """Return the total of one numeric column.
+
+        :param column: column name
+        :param category: category name
+        :return: sum of the column values
+        """
+        return self.totals[category][COLUMNS.index(column)]
+
+    def close(self):
+        """Close the csv files."""
+        for fout in self._files.values():
+            fout.close()
@@ -2,59 +2,475 @@
 from briefy.reflex import logger
 from briefy.reflex.celery import app
 from briefy.reflex.config import GDRIVE_DELIVERY_STREAM
+from briefy.reflex.config import KINESIS_LOCAL_PATH
+from briefy.reflex.config import KINESIS_LOCAL_SHARDS
+from briefy.reflex.config import KINESIS_CONSUMER_QUEUE_SIZE
+from briefy.reflex.config import KINESIS_POLL_IDLE_INTERVAL
+from briefy.reflex.config import KINESIS_POLL_MAX_INTERVAL
+from briefy.reflex.config import KINESIS_PRODUCER_BACKOFF
+from briefy.reflex.config import KINESIS_PRODUCER_LINGER
+from briefy.reflex.config import KINESIS_PRODUCER_MAX_RETRIES
+from briefy.reflex.config import TASK_MAX_RETRY
+from briefy.reflex.lazy import lazy_import
 from briefy.reflex.tasks import ReflexTask
+from briefy.reflex.tasks import records
+from briefy.reflex.tasks.checkpoint import Checkpointer
+from briefy.reflex.tasks.checkpoint import CheckpointStore
+from briefy.reflex.tasks.checkpoint import get_store
+from botocore.exceptions import ClientError
+from celery.signals import worker_process_shutdown
+from celery.signals import worker_shutdown
 from collections import namedtuple
 from dateutil import parser
 from datetime import datetime
 
-import boto3
+import atexit
 import csv
-import json
 import pytz
+import queue
+import threading
+import time
+import typing as t
 
 
+boto3 = lazy_import('boto3')
+
 FOLDER_NAMES = [
     'originals', 'original', 'jpeg', 'original sizes', 'original size', 'original format', 'PRINT'
 ]
 
 
-@app.task(base=ReflexTask, rate_limit='10/s')
+def kinesis_client():
+    """Return a kinesis client.
+
+    If config.KINESIS_LOCAL_PATH is set a file backed local stream is used instead of AWS.
+    """
+    if KINESIS_LOCAL_PATH:
+        # stand-in used for replays and benchmarks, only imported when configured
+        from briefy.reflex.tasks.localkinesis import LocalKinesis
+
+        return LocalKinesis(KINESIS_LOCAL_PATH, shard_count=KINESIS_LOCAL_SHARDS)
+    return boto3.client('kinesis')
+
+
+class ProducerError(Exception):
+    """Records could not be sent to the kinesis stream."""
+
+
+class Delivery:
+    """Outcome of one buffered record, waited by the task that put it in the buffer."""
+
+    def __init__(self):
+        """Initialize delivery."""
+        self.error = None
+        self._done = threading.Event()
+
+    def set(self, error: str=None):
+        """Mark the record as sent, or as failed with an error message."""
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: float=None):
+        """Wait until the record is sent.
+
+        :param timeout: max number of seconds to wait, None waits until the record is sent
+        :raises ProducerError: if the record could not be sent
+        """
+        if not self._done.wait(timeout):
+            raise ProducerError(f'Record not sent after {timeout} seconds.')
+        if self.error is not None:
+            raise ProducerError(self.error)
+
+
+class KinesisProducer:
+    """Buffer records and send them to a kinesis stream in batches using put_records.
+
+    Each batch has at most one record of each partition key, so records that failed are sent
+    again before the next records of the same partition key and their order is kept.
+    """
+
+    max_records = 500
+    """Maximum number of records in one put_records call."""
+
+    max_bytes = 5 * 1024 * 1024
+    """Maximum payload size of one put_records call."""
+
+    max_record_bytes = 1024 * 1024
+    """Maximum size of one record (data and partition key)."""
+
+    def __init__(
+            self, stream: str, client=None, linger: float=KINESIS_PRODUCER_LINGER,
+            max_retries: int=KINESIS_PRODUCER_MAX_RETRIES, backoff: float=KINESIS_PRODUCER_BACKOFF
+    ):
+        """Initialize producer.
+
+        :param stream: kinesis stream name
+        :param client: kinesis client, if not informed a new client is created
+        :param linger: max number of seconds a record waits in the buffer before a flush
+        :param max_retries: max number of retries for records that failed in one batch
+        :param backoff: initial backoff in seconds between retries, doubled on each retry
+        """
+        self.client = client or kinesis_client()
+        self.stream = stream
+        self.linger = linger
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._timer = None
+        self._hash_keys = None
+        self._next_hash_key = 0
+        self._retries = 0
+
+    @property
+    def hash_keys(self) -> list:
+        """Explicit hash keys in the middle of the hash key range of each open shard."""
+        if self._hash_keys is None:
+            response = self.client.describe_stream(StreamName=self.stream)
+            shards = response['StreamDescription']['Shards']
+            hash_keys = []
+            for shard in shards:
+                if shard['SequenceNumberRange'].get('EndingSequenceNumber'):
+                    # closed shard
+                    continue
+                hash_range = shard['HashKeyRange']
+                start = int(hash_range['StartingHashKey'])
+                end = int(hash_range['EndingHashKey'])
+                hash_keys.append(str((start + end) // 2))
+            self._hash_keys = hash_keys
+        return self._hash_keys
+
+    def explicit_hash_key(self) -> str:
+        """Return the hash key of the next shard, spreading records round robin over the shards."""
+        with self._lock:
+            hash_keys = self.hash_keys
+            if not hash_keys:
+                return ''
+            hash_key = hash_keys[self._next_hash_key % len(hash_keys)]
+            self._next_hash_key += 1
+            return hash_key
+
+    def put(self, data: bytes, partition_key: str, hash_key: str='') -> Delivery:
+        """Add one record to the buffer, flushing it when full.
+
+        :param data: record data
+        :param partition_key: record partition key
+        :param hash_key: explicit hash key, if empty the next shard is used
+        :return: delivery of the record, see :meth:`Delivery.wait`, or None if the record is
+                 too big for kinesis
+        """
+        size = len(data) + len(partition_key.encode('utf-8'))
+        if size > self.max_record_bytes:
+            logger.error(f'Record with partition key "{partition_key}" has {size} bytes.')
+            return None
+
+        record = {'Data': data, 'PartitionKey': partition_key}
+        delivery = Delivery()
+        with self._lock:
+            hash_key = hash_key or self.explicit_hash_key()
+            if hash_key:
+                record['ExplicitHashKey'] = hash_key
+            self._buffer.append((record, delivery))
+            self._buffer_bytes += size
+            full = len(self._buffer) >= self.max_records or self._buffer_bytes >= self.max_bytes
+            if not full and not self._timer:
+                self._start_timer(self.linger)
+        if full:
+            self.flush()
+        return delivery
+
+    def flush(self):
+        """Send all buffered records, retrying the failed ones with exponential backoff.
+
+        The lock is released while backing off, so other threads keep buffering records.
+        Records that could not be sent after max_retries are reported to their deliveries.
+        """
+        while True:
+            with self._lock:
+                delay = self._flush()
+            if delay is None:
+                return
+            time.sleep(delay)
+
+    def _start_timer(self, delay: float):
+        """Start the timer flushing the buffer in the background, the lock must be held."""
+        self._timer = threading.Timer(delay, self._background_flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_flush(self):
+        """Flush started by the timer."""
+        with self._lock:
+            self._timer = None
+            try:
+                delay = self._flush()
+            except Exception:
+                logger.exception(f'Failure flushing records to stream "{self.stream}".')
+                delay = self.linger if self._buffer else None
+            if delay is not None and not self._timer:
+                self._start_timer(delay)
+
+    def _flush(self) -> float:
+        """Send the buffered records once, the lock must be held by the caller.
+
+        Records that failed go back to the head of the buffer to be sent after a backoff.
+        Failures are usually caused by the shard write capacity being exceeded, so the
+        throughput of the producer is limited by the number of shards in the stream.
+
+        :return: seconds to wait before sending the failed records, None if all were sent
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        while self._buffer:
+            batch = self._take_batch()
+            try:
+                errors = self._send([record for record, _ in batch])
+            except Exception as exc:
+                logger.warning(f'Failure to put records on stream "{self.stream}": {exc!r}')
+                errors = [repr(exc)] * len(batch)
+
+            failed = []
+            for (record, delivery), error in zip(batch, errors):
+                if error:
+                    failed.append((record, delivery))
+                else:
+                    delivery.set()
+            if not failed:
+                continue
+
+            if self._retries >= self.max_retries:
+                retries, self._retries = self._retries, 0
+                self._fail(
+                    failed,
+                    f'Failure to put records on stream "{self.stream}" after {retries} retries: '
+                    f'{next(error for error in errors if error)}'
+                )
+                continue
+            self._requeue(failed)
+            delay = self.backoff * 2 ** self._retries
+            self._retries += 1
+            # shard map could have changed
+            self._hash_keys = None
+            return delay
+
+        self._retries = 0
+        return None
+
+    def _take_batch(self) -> list:
+        """Remove from the buffer the records of one put_records call.
+
+        Records of a partition key already in the batch are left in the buffer for the next one.
+        """
+        batch = []
+        keys = set()
+        remaining = []
+        size = 0
+        for entry in self._buffer:
+            record = entry[0]
+            record_size = self._record_size(record)
+            full = len(batch) >= self.max_records or (batch and size + record_size > self.max_bytes)
+            if full or record['PartitionKey'] in keys:
+                remaining.append(entry)
+                continue
+            batch.append(entry)
+            keys.add(record['PartitionKey'])
+            size += record_size
+        self._buffer = remaining
+        self._buffer_bytes -= size
+        return batch
+
+    def _requeue(self, entries: list):
+        """Put records back at the head of the buffer."""
+        self._buffer[:0] = entries
+        self._buffer_bytes += sum(self._record_size(record) for record, _ in entries)
+
+    def _fail(self, entries: list, error: str):
+        """Report records that could not be sent to their deliveries.
+
+        Buffered records with the same partition keys fail too, so they are not sent out of
+        order: the tasks that put them send them again when retried.
+
+        :param entries: list of (record, delivery) that failed
+        :param error: error message
+        """
+        logger.error(error)
+        entries = list(entries)
+        keys = {record['PartitionKey'] for record, _ in entries}
+        remaining = []
+        for entry in self._buffer:
+            if entry[0]['PartitionKey'] in keys:
+                entries.append(entry)
+                self._buffer_bytes -= self._record_size(entry[0])
+            else:
+                remaining.append(entry)
+        self._buffer = remaining
+        for _, delivery in entries:
+            delivery.set(error)
+
+    @staticmethod
+    def _record_size(record: dict) -> int:
+        """Size of one record as counted by kinesis (data and partition key)."""
+        return len(record['Data']) + len(record['PartitionKey'].encode('utf-8'))
+
+    def _send(self, records: list) -> list:
+        """Send one batch of records with put_records.
+
+        :param records: list of put_records entries
+        :return: list with the error code of each record, None for the records sent
+        """
+        response = self.client.put_records(Records=records, StreamName=self.stream)
+        if not response.get('FailedRecordCount'):
+            return [None] * len(records)
+        return [result.get('ErrorCode') for result in response['Records']]
+
+
+_producers = {}
+
+
+def get_producer(stream: str=GDRIVE_DELIVERY_STREAM) -> KinesisProducer:
+    """Return the producer for a stream, one instance is shared per worker process.
+
+    :param stream: kinesis stream name
+    :return: kinesis producer instance
+    """
+    producer = _producers.get(stream)
+    if producer is None:
+        producer = _producers[stream] = KinesisProducer(stream)
+    return producer
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def flush_producers(*args, **kwargs):
+    """Flush all kinesis producers before the worker (or the process) exits."""
+    for producer in _producers.values():
+        try:
+            producer.flush()
+        except Exception:
+            logger.exception(f'Failure flushing records to stream "{producer.stream}".')
+
+
+atexit.register(flush_producers)
+
+
+@app.task(
+    base=ReflexTask,
+    autoretry_for=(ProducerError, ),
+    retry_kwargs={'max_retries': TASK_MAX_RETRY},
+    retry_backoff=True,
+)
 def put_gdrive_record(result: tuple, stream: str=GDRIVE_DELIVERY_STREAM) -> bool:
     """Put gdrive folder contents and orders data in a kinesis stream.
 
+    Records are encoded with :func:`briefy.reflex.tasks.records.encode`, buffered by the
+    worker producer and sent in batches. The task waits until its records are sent and is
+    retried if they could not be.
+
     :param result: data tuple
     :param stream: kinesis stream name
     :return: True if success and False if failed
     """
     order, contents = result
-    data = {
-        'contents': contents,
-        'order': order,
-    }
     order_id = order.get('id')
-    client = boto3.client('kinesis')
-    response = client.put_record(
-        Data=json.dumps(data),
-        PartitionKey=order_id,
-        StreamName=stream
-    )
-    success = response['ResponseMetadata']['HTTPStatusCode'] == 200
-    return success if success else False
+    producer = get_producer(stream)
+    chunks = records.encode(order, contents)
+    # all chunks of one record go to the same shard
+    hash_key = producer.explicit_hash_key()
+    deliveries = [producer.put(chunk, order_id, hash_key) for chunk in chunks]
+    if not all(deliveries):
+        return False
+    for delivery in deliveries:
+        delivery.wait()
+    return True
+
+
+class PollingController:
+    """Compute the delay before the next get_records call on each shard.
+
+    Shards behind the tip of the stream (MillisBehindLatest > 0) or returning full batches
+    are read at full speed, partially filled batches slow down the polling and idle shards
+    back off exponentially up to max_interval.
+    """
+
+    batch_limit = 10000
+    """Max number of records returned by get_records."""
+
+    def __init__(
+            self, min_interval: float=0.2, idle_interval: float=KINESIS_POLL_IDLE_INTERVAL,
+            max_interval: float=KINESIS_POLL_MAX_INTERVAL
+    ):
+        """Initialize controller.
+
+        :param min_interval: minimum interval between reads on one shard (5 reads/s)
+        :param idle_interval: interval after an empty batch at the tip of the stream
+        :param max_interval: maximum interval between reads of an idle shard
+        """
+        self.min_interval = min_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self._idle = {}
+
+    @staticmethod
+    def caught_up(records_count: int, millis_behind: int) -> bool:
+        """Return True if the shard has no more records to be read for now."""
+        return records_count == 0 and millis_behind == 0
+
+    def next_delay(self, shard_id: str, records_count: int, millis_behind: int) -> float:
+        """Compute the delay in seconds before reading the shard again.
+
+        :param shard_id: shard id
+        :param records_count: number of records in the last batch
+        :param millis_behind: MillisBehindLatest from the last get_records response
+        :return: delay in seconds
+        """
+        if millis_behind > 0 or records_count >= self.batch_limit:
+            self._idle[shard_id] = 0
+            return self.min_interval
+
+        if records_count:
+            self._idle[shard_id] = 0
+            fill_ratio = records_count / self.batch_limit
+            return max(self.min_interval, self.idle_interval * (1 - fill_ratio))
+
+        idle = self._idle.get(shard_id, 0)
+        self._idle[shard_id] = idle + 1
+        return min(self.idle_interval * 2 ** idle, self.max_interval)
 
 
 class KinesisConsumer:
     """Consume a kinesis stream."""
 
-    def __init__(self, stream: str):
-        """Initialize consumer."""
-        self.client = boto3.client('kinesis')
+    min_read_interval = 0.2
+    """Minimum interval in seconds between get_records calls on one shard (5 reads/s)."""
+
+    def __init__(self, stream: str, checkpoint_store: CheckpointStore=None, client=None):
+        """Initialize consumer.
+
+        :param stream: kinesis stream name
+        :param checkpoint_store: store used to persist the shard sequence numbers,
+                                 if not informed config.KINESIS_CHECKPOINT_STORE is used
+        :param client: kinesis client, if not informed a new client is created
+        """
+        self.client = client or kinesis_client()
         self.stream = stream
         self.update()
+        self.follow = False
+        self.polling = PollingController(min_interval=self.min_read_interval)
         self._iterators = {}
-        self._empty_shards = []
-
-        # TODO: this should be persisted
-        self._sequences = {}
+        self._finished_shards = set()
+        self._closed_shards = set()
+        self._next_poll = {}
+        self._stop = threading.Event()
+        self._errors = []
+        self._fetched = {}
+        self._positions = {}
+        self.decoder = records.RecordDecoder()
+
+        store = checkpoint_store if checkpoint_store is not None else get_store()
+        self.checkpointer = Checkpointer(store, stream)
+        self._sequences = self.checkpointer.load()
 
     def update(self):
         """Update describe information from AWS in the class."""
@@ -68,18 +484,20 @@ class KinesisConsumer:
             else:
                 self.description = response['StreamDescription']
 
-    def get_sequence(self, shard: dict) -> str:
-        """Get sequence number for a given shard.
+    def get_sequence(self, shard: dict) -> t.Tuple[str, str]:
+        """Get iterator type and sequence number to start reading a given shard.
+
+        Reading resumes after the last record fetched in this run or after the last
+        checkpoint, otherwise it starts at the first record of the shard.
 
         :param shard: shard data payload from describe_stream
-        :return: latest sequence number for this shard
+        :return: tuple composed of (shard iterator type, sequence number)
         """
         shard_id = shard['ShardId']
-        sequence_number = self._sequences.get(shard_id)
-        if not sequence_number:
-            sequence_number = shard['SequenceNumberRange']['StartingSequenceNumber']
-            self._sequences[shard_id] = sequence_number
-        return sequence_number
+        sequence_number = self._fetched.get(shard_id) or self._sequences.get(shard_id)
+        if sequence_number:
+            return 'AFTER_SEQUENCE_NUMBER', sequence_number
+        return 'AT_SEQUENCE_NUMBER', shard['SequenceNumberRange']['StartingSequenceNumber']
 
     def get_iterator(self, shard: dict) -> str:
         """Get shard iterator for a given shard.
@@ -99,11 +517,11 @@ class KinesisConsumer:
 
         if not (shard_iterator and date):
             client = self.client
-            sequence_number = self.get_sequence(shard)
+            iterator_type, sequence_number = self.get_sequence(shard)
             response = client.get_shard_iterator(
                 StreamName=self.stream,
                 ShardId=shard_id,
-                ShardIteratorType='AT_SEQUENCE_NUMBER',
+                ShardIteratorType=iterator_type,
                 StartingSequenceNumber=sequence_number,
             )
             date = response.get('ResponseMetadata').get('HTTPHeaders').get('date')
@@ -112,49 +530,268 @@ class KinesisConsumer:
 
         return shard_iterator
 
+    def is_closed(self, shard_id: str) -> bool:
+        """Check if a shard was closed by a resharding, with an ending sequence number.
+
+        :param shard_id: shard id
+        :return: True if the shard is closed, its records must still be read until the end
+        """
+        for shard in self.description.get('Shards', []):
+            if shard['ShardId'] == shard_id:
+                return 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {})
+        return False
+
     @property
     def shards(self) -> list:
-        """Stream shard ids."""
-        return [
-            shard for shard in self.description.get('Shards', [])
-            if shard['ShardId'] not in self._empty_shards
-        ]
-
-    def run(self, item_callback=None):
-        """Start processing all shards."""
+        """Shards ready to be read: not finished and with all parent shards closed.
+
+        After a resharding the child shards are only read after their parents were read
+        until the end, so the records of one partition key are processed in order.
+        """
+        shards = self.description.get('Shards', [])
+        known = {shard['ShardId'] for shard in shards}
+        ready = []
+        for shard in shards:
+            if shard['ShardId'] in self._finished_shards:
+                continue
+            parents = [shard.get('ParentShardId'), shard.get('AdjacentParentShardId')]
+            waiting = [
+                parent for parent in parents
+                if parent in known and parent not in self._closed_shards
+            ]
+            if not waiting:
+                ready.append(shard)
+        return ready
+
+    def run(self, item_callback=None, parallel: bool=False, follow: bool=False):
+        """Start processing all shards.
+
+        :param item_callback: function called with (order, contents) for each record
+        :param parallel: if True use one fetcher thread per shard, see :meth:`run_parallel`
+        :param follow: if True keep polling the open shards after reaching the tip of the stream
+        """
+        self.follow = follow
+        if parallel:
+            return self.run_parallel(item_callback)
+
         self.item_callback = item_callback
         logger.info('Starting consumer. Use CTRL+C to stop.')
-        while self.shards:
-            # time.sleep(0.5)
-            for shard in self.shards:
-                shard_id = shard['ShardId']
-                shard_iterator = self.get_iterator(shard)
-                self.process_records(shard_iterator, shard_id)
+        try:
+            shards = self.shards
+            while shards:
+                for shard in shards:
+                    shard_id = shard['ShardId']
+                    if self._next_poll.get(shard_id, 0) > time.monotonic():
+                        continue
+                    shard_iterator = self.get_iterator(shard)
+                    self.process_records(shard_iterator, shard_id)
+
+                shards = self.shards
+                next_poll = min(
+                    [self._next_poll.get(shard['ShardId'], 0) for shard in shards], default=0
+                )
+                wait = next_poll - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+        finally:
+            self.checkpointer.flush()
+
+    def run_parallel(self, item_callback=None, queue_size: int=KINESIS_CONSUMER_QUEUE_SIZE):
+        """Start processing all shards with one fetcher thread per shard.
+
+        Fetchers put the records in a bounded queue consumed by the calling thread, so a slow
+        item_callback blocks the fetchers instead of piling up records in memory. Fetchers for
+        child shards are started when their parents are closed.
+
+        :param item_callback: function called with (order, contents) for each record
+        :param queue_size: max number of records waiting to be processed
+        """
+        self.item_callback = item_callback
+        self._stop.clear()
+        self._errors = []
+        records_queue = queue.Queue(maxsize=queue_size)
+        fetchers = {}
+        logger.info('Starting parallel consumer. Use CTRL+C to stop.')
+        try:
+            while True:
+                for shard in self.shards:
+                    shard_id = shard['ShardId']
+                    if shard_id not in fetchers:
+                        fetcher = threading.Thread(
+                            target=self._fetch_shard,
+                            args=(shard, records_queue),
+                            name=f'kinesis-{shard_id}',
+                            daemon=True,
+                        )
+                        fetchers[shard_id] = fetcher
+                        fetcher.start()
+                        logger.info(f'Fetcher started for shard: "{shard_id}"')
+
+                running = [fetcher for fetcher in fetchers.values() if fetcher.is_alive()]
+                if not running and records_queue.empty():
+                    if any(shard['ShardId'] not in fetchers for shard in self.shards):
+                        # a parent fetcher finished after the scan above, start its children
+                        continue
+                    break
+
+                try:
+                    shard_id, item = records_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+
+                if item is not None:
+                    self.process_record(item, shard_id)
+                elif self._errors:
+                    break
+        finally:
+            self._stop.set()
+            self.checkpointer.flush()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def _fetch_shard(self, shard: dict, records_queue: queue.Queue):
+        """Read records from one shard and put them in the queue until the shard is finished.
+
+        A (shard_id, None) item is put in the queue when the fetcher finishes.
 
-    def process_records(self, shard_iterator: str, shard_id: str):
-        """Process records from a shard iterator."""
+        :param shard: shard data payload from describe_stream
+        :param records_queue: queue consumed by :meth:`run_parallel`
+        """
+        shard_id = shard['ShardId']
+        try:
+            while not self._stop.is_set() and shard_id not in self._finished_shards:
+                wait = self._next_poll.get(shard_id, 0) - time.monotonic()
+                if wait > 0:
+                    self._stop.wait(wait)
+                    continue
+                try:
+                    response = self.get_records(self.get_iterator(shard), shard_id)
+                except ClientError as exc:
+                    if exc.response['Error']['Code'] != 'ProvisionedThroughputExceededException':
+                        raise
+                    logger.info(f'Read throughput exceeded for shard: "{shard_id}"')
+                    self._next_poll[shard_id] = time.monotonic() + 1
+                    continue
+
+                for item in response['Records']:
+                    if not self._enqueue(records_queue, (shard_id, item)):
+                        return
+        except Exception as exc:
+            logger.exception(f'Failure fetching records from shard: "{shard_id}"')
+            self._errors.append(exc)
+        finally:
+            self._enqueue(records_queue, (shard_id, None), force=True)
+
+    def _enqueue(self, records_queue: queue.Queue, item: tuple, force: bool=False) -> bool:
+        """Put one item in the queue, waiting for space unless the consumer was stopped.
+
+        :param records_queue: queue consumed by :meth:`run_parallel`
+        :param item: tuple (shard_id, record)
+        :param force: drop the oldest item if the consumer was stopped and the queue is full
+        :return: True if the item was added to the queue
+        """
+        while True:
+            try:
+                records_queue.put(item, timeout=1)
+            except queue.Full:
+                if not self._stop.is_set():
+                    continue
+                if not force:
+                    return False
+                try:
+                    records_queue.get_nowait()
+                except queue.Empty:
+                    pass
+            else:
+                return True
+
+    def get_records(self, shard_iterator: str, shard_id: str) -> dict:
+        """Get the next batch of records from a shard and schedule the next read.
+
+        :param shard_iterator: shard iterator id
+        :param shard_id: shard id
+        :return: get_records response
+        """
         response = self.client.get_records(
             ShardIterator=shard_iterator
         )
 
         logger.debug('Getting data from shard: {shard_id}', extra=response)
         records = response['Records']
+        if records:
+            self._fetched[shard_id] = records[-1]['SequenceNumber']
+        next_shard_iterator = response.get('NextShardIterator')
+        date = response.get('ResponseMetadata').get('HTTPHeaders').get('date')
+        self._iterators[shard_id] = next_shard_iterator, date
 
-        if len(records) == 0:
+        millis_behind = response.get('MillisBehindLatest', 0)
+        if not next_shard_iterator:
+            logger.info(f'Shard closed: "{shard_id}"')
+            self._closed_shards.add(shard_id)
+            self._finished_shards.add(shard_id)
+            # child shards are now ready to be read
+            self.update()
+        elif self.is_closed(shard_id):
+            # closed shards are read until the end, even after empty batches
+            self._next_poll[shard_id] = time.monotonic() + self.polling.min_interval
+        elif not self.follow and self.polling.caught_up(len(records), millis_behind):
             logger.info(f'Nothing to process for shard: "{shard_id}"')
-            self._empty_shards.append(shard_id)
+            self._finished_shards.add(shard_id)
         else:
-            for item in records:
-                if self.item_callback:
-                    data = json.loads(item.get('Data'))
-                    order = data.get('order')
-                    contents = data.get('contents')
-                    self.item_callback(order, contents)
-                self._sequences[shard_id] = item['SequenceNumber']
-
-        next_shard_iterator = response['NextShardIterator']
-        date = response.get('ResponseMetadata').get('HTTPHeaders').get('date')
-        self._iterators[shard_id] = next_shard_iterator, date
+            delay = self.polling.next_delay(shard_id, len(records), millis_behind)
+            self._next_poll[shard_id] = time.monotonic() + delay
+        return response
+
+    def process_record(self, item: dict, shard_id: str):
+        """Process one record and update the shard sequence number.
+
+        Chunks of a record are only checkpointed when the record is complete, see
+        :meth:`checkpoint_sequence`.
+
+        :param item: record from get_records
+        :param shard_id: shard id
+        """
+        sequence_number = item['SequenceNumber']
+        previous = self._positions.get(shard_id, self._sequences.get(shard_id))
+        self._positions[shard_id] = sequence_number
+        data = self.decoder.decode(item.get('Data'), position=(shard_id, previous))
+        if data is None:
+            # waiting for the remaining chunks of this record
+            return
+
+        if self.item_callback:
+            order = data.get('order')
+            contents = data.get('contents')
+            self.item_callback(order, contents)
+        checkpoint = self.checkpoint_sequence(shard_id, sequence_number)
+        if checkpoint:
+            self._sequences[shard_id] = checkpoint
+            self.checkpointer.update(shard_id, checkpoint)
+
+    def checkpoint_sequence(self, shard_id: str, sequence_number: str) -> str:
+        """Return the sequence number to checkpoint after processing a record of a shard.
+
+        Records read after the first chunk of a record still incomplete are not checkpointed,
+        so after a restart the shard is read again from that chunk and the record is completed.
+        The complete records read in between are processed again.
+
+        :param shard_id: shard id
+        :param sequence_number: sequence number of the processed record
+        :return: sequence number of the record before the first chunk of the oldest incomplete
+                 record of the shard, the processed one if there is none, or None if the
+                 incomplete record starts at the beginning of the shard
+        """
+        for pending_shard, previous in self.decoder.pending_positions():
+            if pending_shard == shard_id:
+                return previous
+        return sequence_number
+
+    def process_records(self, shard_iterator: str, shard_id: str):
+        """Process records from a shard iterator."""
+        response = self.get_records(shard_iterator, shard_id)
+        for item in response['Records']:
+            self.process_record(item, shard_id)
 
 
 TotalAssets = namedtuple('TotalAssets', ['images', 'videos', 'others'])
@@ -167,27 +804,18 @@ def count_assets(contents, filter_folders=False) -> TotalAssets:
     :param filter_folders: only count images on folders with specific names.
     :return: total number of images in the folder and sub folders.
     """
-    if filter_folders:
-        sub_folders = [
-            folder for folder in contents.get('folders', [])
-            if folder.get('name').lower().strip() in FOLDER_NAMES
-        ]
-    else:
-        sub_folders = contents.get('folders', [])
-
-    total = TotalAssets(
-        len(contents.get('images', [])) + sum(
-            [len(folder.get('images', [])) for folder in sub_folders]
-        ),
-        len(contents.get('videos', [])) + sum(
-            [len(folder.get('videos', [])) for folder in sub_folders]
-        ),
-        len(contents.get('other_files', [])) + sum(
-            [len(folder.get('other_files', [])) for folder in sub_folders]
-        )
-    )
+    contents = contents or {}
+    images = len(contents.get('images', []))
+    videos = len(contents.get('videos', []))
+    others = len(contents.get('other_files', []))
+    for folder in contents.get('folders', []):
+        if filter_folders and folder.get('name').lower().strip() not in FOLDER_NAMES:
+            continue
+        images += len(folder.get('images', []))
+        videos += len(folder.get('videos', []))
+        others += len(folder.get('other_files', []))
 
-    return total
+    return TotalAssets(images, videos, others)
 
 
 def export_csv(data: dict, file_path: str):
@@ -218,61 +846,11 @@ if __name__ == '__main__':
     # from briefy.reflex.tasks.leica import read_all_delivery_contents
     # read_all_delivery_contents(uri)
 
-    TOTAL_IMG_PER_ORDER = {}
-    TO_DEBUG_LINKS = {}
-    TO_DEBUG_ZERO = {}
-    TO_DEBUG_ARCHIVE = {}
-    TO_DEBUG_SUBMISSION = {}
-
-    def callback(order, contents):
-        """Compute the values for each order."""
-        order_id = order.get('slug')
-        delivery = order.get('delivery')
-        number_required_assets = order.get('number_required_assets')
-        total_delivery = count_assets(contents.get('delivery'))
-        submissions = contents.get('submissions')
-        total_submissions = [count_assets(submission) for submission in submissions]
-        total_archive = count_assets(contents.get('archive'))
-        submission_links = ','.join(
-            [str(a.get('submission_path', 'null')) for a in order.get('assignments')]
-        )
+    from briefy.reflex.tasks.inventory import Inventory
+
+    with Inventory() as inventory:
+        c = KinesisConsumer(GDRIVE_DELIVERY_STREAM)
+        c.run(inventory.add, parallel=True)
 
-        data = {
-            'total_delivery_images': total_delivery.images,
-            'total_delivery_videos': total_delivery.videos,
-            'total_delivery_others': total_delivery.others,
-            'total_archive_images': total_archive.images,
-            'total_archive_videos': total_archive.videos,
-            'total_archive_others': total_archive.others,
-            'total_submissions_images': sum([item.images for item in total_submissions]),
-            'total_submissions_videos': sum([item.videos for item in total_submissions]),
-            'total_submissions_others': sum([item.others for item in total_submissions]),
-            'number_submissions': len(submissions),
-            'briefy_id': order_id,
-            'delivery_link': delivery.get('gdrive'),
-            'archive_link': delivery.get('archive'),
-            'submission_links': submission_links,
-            'number_required_assets': number_required_assets,
-            'order_link': f'https://app.briefy.co/orders/{order.get("id")}'
-        }
-        TOTAL_IMG_PER_ORDER[order_id] = data
-
-        if not total_delivery.images:
-            TO_DEBUG_ZERO[order_id] = data
-        elif total_delivery.images > total_archive.images:
-            TO_DEBUG_ARCHIVE[order_id] = data
-        elif data['total_submissions_images'] == 0:
-            TO_DEBUG_SUBMISSION[order_id] = data
-
-        logger.info(f'Order id {order_id} processed. Number of images: {total_delivery}')
-
-    c = KinesisConsumer(GDRIVE_DELIVERY_STREAM)
-    c.run(callback)
-
-    export_csv(TOTAL_IMG_PER_ORDER, '/tmp/orders-image-inventory.csv')
-    export_csv(TO_DEBUG_ARCHIVE, '/tmp/orders-inventory-check-archive.csv')
-    export_csv(TO_DEBUG_SUBMISSION, '/tmp/orders-inventory-check-submission.csv')
-    export_csv(TO_DEBUG_ZERO, '/tmp/orders-inventory-zero-images.csv')
-
-    TOTAL_IMG = sum([value.get('total_delivery_images') for value in TOTAL_IMG_PER_ORDER.values()])
+    TOTAL_IMG = inventory.total('total_delivery_images')
     logger.info(f'Total of delivery images found: {TOTAL_IMG}')
@@ -1,7 +1,9 @@
 """Tasks querying information on Leica endpoints."""
 from briefy.common.utilities.interfaces import IRemoteRestEndpoint
 from briefy.reflex import config
+from briefy.reflex import get_utility
 from briefy.reflex import logger
+from briefy.reflex import metrics
 from briefy.reflex.celery import app
 from briefy.reflex.tasks import ReflexTask
 from briefy.reflex.tasks.gdrive import folder_contents
@@ -11,13 +13,12 @@ from celery import group
 from csv import DictReader
 from googleapiclient.errors import HttpError
 from io import StringIO
-from zope.component import getUtility
 
 import requests
 import typing as t
 
 
-@app.task(base=ReflexTask)
+@app.task(base=ReflexTask, backends=('leica', ))
 def query_orders(project_id: str='', states: list=None, page: int=1) -> t.Sequence[dict]:
     """Query orders from leica endpoint.
 
@@ -27,8 +28,8 @@ def query_orders(project_id: str='', states: list=None, page: int=1) -> t.Sequen
     :return: list of orders returned from listing payload
     """
     states = states or []
-    factory = getUtility(IRemoteRestEndpoint)
-    remote = factory(config.LEICA_BASE, 'orders', 'Orders')
+    factory = get_utility(IRemoteRestEndpoint)
+    remote = metrics.instrument(factory(config.LEICA_BASE, 'orders', 'Orders'), 'leica')
     params = {
         'in_state': ','.join(states),
         'current_type': 'order',
@@ -42,7 +43,7 @@ def query_orders(project_id: str='', states: list=None, page: int=1) -> t.Sequen
     return data, pagination
 
 
-@app.task(bind=True, base=ReflexTask)
+@app.task(bind=True, base=ReflexTask, backends=('leica', ))
 def get_order(self, order_id: str) -> dict:
     """Get one order from leica endpoint.
 
@@ -50,8 +51,8 @@ def get_order(self, order_id: str) -> dict:
     :param order_id: Order ID to get the full payload
     :return: order full payload
     """
-    factory = getUtility(IRemoteRestEndpoint)
-    remote = factory(config.LEICA_BASE, 'orders', 'Orders')
+    factory = get_utility(IRemoteRestEndpoint)
+    remote = metrics.instrument(factory(config.LEICA_BASE, 'orders', 'Orders'), 'leica')
     return remote.get(order_id)
 
 
@@ -0,0 +1,369 @@
+"""Local file backed stand-in for the kinesis client, used to replay and benchmark streams.
+
+Records of each shard are stored in memory mapped, append only, segment files::
+
+    {path}/{stream}/{shard_id}/{segment:08d}.seg
+
+Each record is a header (data length, partition key length, arrival timestamp) followed by the
+partition key and the data. The data length is written last, so a reader never sees a partial
+record. The sequence number of a record is its absolute position in the shard.
+
+Only one process should write to a stream at a time.
+"""
+from botocore.exceptions import ClientError
+from email.utils import formatdate
+
+import base64
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+RECORD_HEADER = struct.Struct('>IHd')
+"""Record header: data length, partition key length and arrival timestamp."""
+
+MAX_HASH_KEY = 2 ** 128 - 1
+"""Max hash key of a kinesis stream."""
+
+
+def _throttled(operation: str) -> ClientError:
+    """Build the same exception raised by boto3 when a shard limit is exceeded."""
+    return ClientError(
+        {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Rate exceeded'}},
+        operation
+    )
+
+
+def _response(**kwargs) -> dict:
+    """Add the response metadata used by the consumer to a response payload."""
+    kwargs['ResponseMetadata'] = {
+        'HTTPStatusCode': 200,
+        'HTTPHeaders': {'date': formatdate(usegmt=True)},
+    }
+    return kwargs
+
+
+class RateLimit:
+    """Count events in one second windows."""
+
+    def __init__(self, limit: float):
+        """Initialize rate limit.
+
+        :param limit: max amount per second, zero disables the limit
+        """
+        self.limit = limit
+        self._window = 0
+        self._amount = 0
+
+    def allow(self, amount: float=1) -> bool:
+        """Register the amount if it fits in the current window."""
+        if not self.limit:
+            return True
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._amount = 0
+        if self._amount + amount > self.limit:
+            return False
+        self._amount += amount
+        return True
+
+
+class LocalShard:
+    """One shard of a local stream."""
+
+    def __init__(
+            self, path: str, shard_id: str, starting_hash_key: int, ending_hash_key: int,
+            segment_size: int, read_rate: float, write_rate: float, write_bytes_rate: float
+    ):
+        """Initialize shard and recover the write position from the segment files."""
+        self.path = path
+        self.shard_id = shard_id
+        self.starting_hash_key = starting_hash_key
+        self.ending_hash_key = ending_hash_key
+        self.reads = RateLimit(read_rate)
+        self.writes = RateLimit(write_rate)
+        self.write_bytes = RateLimit(write_bytes_rate)
+        self.lock = threading.Lock()
+        self._segments = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        segments = sorted(
+            int(name.split('.')[0]) for name in os.listdir(path) if name.endswith('.seg')
+        )
+        self.position = 0
+        self.last_arrival = 0.0
+        self.segment_size = segment_size
+        if segments:
+            # existing streams keep the segment size used to create them
+            self.segment_size = os.path.getsize(os.path.join(path, f'{segments[0]:08d}.seg'))
+            self.position = segments[-1] * self.segment_size
+            while True:
+                record = self.read(self.position)
+                if record is None:
+                    break
+                self.position, self.last_arrival = record[0], record[3]
+
+    def segment(self, index: int) -> mmap.mmap:
+        """Return the memory map of one segment file, creating the file if needed."""
+        segment = self._segments.get(index)
+        if segment is None:
+            file_path = os.path.join(self.path, f'{index:08d}.seg')
+            with open(file_path, 'a+b') as fout:
+                if os.path.getsize(file_path) < self.segment_size:
+                    fout.truncate(self.segment_size)
+                segment = mmap.mmap(fout.fileno(), self.segment_size)
+            self._segments[index] = segment
+        return segment
+
+    def append(self, data: bytes, partition_key: str) -> str:
+        """Append one record to the shard.
+
+        :param data: record data
+        :param partition_key: record partition key
+        :return: sequence number
+        """
+        key = partition_key.encode('utf-8')
+        size = RECORD_HEADER.size + len(key) + len(data)
+        if size > self.segment_size:
+            raise ValueError(f'Record with {size} bytes is bigger than the segment size.')
+        with self.lock:
+            index, offset = divmod(self.position, self.segment_size)
+            if offset + size > self.segment_size:
+                index, offset = index + 1, 0
+            segment = self.segment(index)
+            arrival = time.time()
+            start = offset + RECORD_HEADER.size
+            segment[start:start + len(key)] = key
+            segment[start + len(key):start + len(key) + len(data)] = data
+            # data length is written last: readers stop at a zero length
+            segment[offset:offset + RECORD_HEADER.size] = RECORD_HEADER.pack(
+                len(data), len(key), arrival
+            )
+            sequence_number = index * self.segment_size + offset
+            self.position = sequence_number + size
+            self.last_arrival = arrival
+        return str(sequence_number)
+
+    def read(self, position: int) -> tuple:
+        """Read the record at one position.
+
+        :param position: absolute position in the shard
+        :return: tuple composed of (next position, partition key, data, arrival) or None
+        """
+        index, offset = divmod(position, self.segment_size)
+        for index in (index, index + 1):
+            file_path = os.path.join(self.path, f'{index:08d}.seg')
+            if index not in self._segments and not os.path.exists(file_path):
+                return None
+            segment = self.segment(index)
+            if offset + RECORD_HEADER.size <= self.segment_size:
+                length, key_length, arrival = RECORD_HEADER.unpack_from(segment, offset)
+                if length:
+                    start = offset + RECORD_HEADER.size
+                    key = segment[start:start + key_length].decode('utf-8')
+                    data = segment[start + key_length:start + key_length + length]
+                    end = start + key_length + length
+                    return index * self.segment_size + end, key, data, arrival
+            # end of segment: continue in the next one
+            offset = 0
+        return None
+
+    def close(self):
+        """Close all memory maps."""
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+
+
+class LocalKinesis:
+    """Local kinesis client implementing the calls used by the producer and the consumer."""
+
+    def __init__(
+            self, path: str, shard_count: int=2, segment_size: int=64 * 1024 * 1024,
+            read_rate: float=5, write_rate: float=1000, write_bytes_rate: float=1024 * 1024
+    ):
+        """Initialize local client.
+
+        :param path: base directory of the streams
+        :param shard_count: number of shards of new streams
+        :param segment_size: size of each segment file
+        :param read_rate: max get_records calls per second per shard, zero disables throttling
+        :param write_rate: max records written per second per shard, zero disables throttling
+        :param write_bytes_rate: max bytes written per second per shard, zero disables throttling
+        """
+        self.path = path
+        self.shard_count = shard_count
+        self.segment_size = segment_size
+        self.read_rate = read_rate
+        self.write_rate = write_rate
+        self.write_bytes_rate = write_bytes_rate
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _shards(self, stream: str) -> list:
+        """Return the shards of a stream, creating the stream if needed."""
+        with self._lock:
+            shards = self._streams.get(stream)
+            if shards is None:
+                stream_path = os.path.join(self.path, stream)
+                existing = sorted(os.listdir(stream_path)) if os.path.exists(stream_path) else []
+                shard_count = len(existing) or self.shard_count
+                step = (MAX_HASH_KEY + 1) // shard_count
+                shards = [
+                    LocalShard(
+                        os.path.join(stream_path, f'shardId-{index:012d}'),
+                        f'shardId-{index:012d}',
+                        index * step,
+                        MAX_HASH_KEY if index == shard_count - 1 else (index + 1) * step - 1,
+                        self.segment_size,
+                        self.read_rate,
+                        self.write_rate,
+                        self.write_bytes_rate,
+                    )
+                    for index in range(shard_count)
+                ]
+                self._streams[stream] = shards
+        return shards
+
+    def _shard(self, stream: str, shard_id: str) -> LocalShard:
+        """Return one shard by id."""
+        for shard in self._shards(stream):
+            if shard.shard_id == shard_id:
+                return shard
+        raise ClientError(
+            {'Error': {'Code': 'ResourceNotFoundException', 'Message': shard_id}}, 'GetShard'
+        )
+
+    def describe_stream(self, StreamName: str, **kwargs) -> dict:
+        """Describe a local stream."""
+        shards = [
+            {
+                'ShardId': shard.shard_id,
+                'HashKeyRange': {
+                    'StartingHashKey': str(shard.starting_hash_key),
+                    'EndingHashKey': str(shard.ending_hash_key),
+                },
+                'SequenceNumberRange': {'StartingSequenceNumber': '0'},
+            }
+            for shard in self._shards(StreamName)
+        ]
+        return _response(StreamDescription={
+            'StreamName': StreamName,
+            'StreamStatus': 'ACTIVE',
+            'Shards': shards,
+            'HasMoreShards': False,
+        })
+
+    def _put(self, stream: str, data: bytes, partition_key: str, hash_key: str=None) -> dict:
+        """Append one record to the shard selected by hash key or partition key."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if hash_key:
+            hash_value = int(hash_key)
+        else:
+            hash_value = int(hashlib.md5(partition_key.encode('utf-8')).hexdigest(), 16)
+        shard = [
+            shard for shard in self._shards(stream)
+            if shard.starting_hash_key <= hash_value <= shard.ending_hash_key
+        ][0]
+        size = len(data) + len(partition_key)
+        with shard.lock:
+            allowed = shard.writes.allow() and shard.write_bytes.allow(size)
+        if not allowed:
+            raise _throttled('PutRecord')
+        return {'ShardId': shard.shard_id, 'SequenceNumber': shard.append(data, partition_key)}
+
+    def put_record(
+            self, StreamName: str, Data: bytes, PartitionKey: str, ExplicitHashKey: str=None,
+            **kwargs
+    ) -> dict:
+        """Put one record in a local stream."""
+        return _response(**self._put(StreamName, Data, PartitionKey, ExplicitHashKey))
+
+    def put_records(self, Records: list, StreamName: str, **kwargs) -> dict:
+        """Put a batch of records in a local stream, throttled records are reported as failed."""
+        results = []
+        failed = 0
+        for record in Records:
+            try:
+                result = self._put(
+                    StreamName, record['Data'], record['PartitionKey'],
+                    record.get('ExplicitHashKey')
+                )
+            except ClientError as exc:
+                failed += 1
+                error = exc.response['Error']
+                result = {'ErrorCode': error['Code'], 'ErrorMessage': error['Message']}
+            results.append(result)
+        return _response(FailedRecordCount=failed, Records=results)
+
+    def get_shard_iterator(
+            self, StreamName: str, ShardId: str, ShardIteratorType: str,
+            StartingSequenceNumber: str=None, **kwargs
+    ) -> dict:
+        """Return an iterator for a position in one shard."""
+        shard = self._shard(StreamName, ShardId)
+        if ShardIteratorType == 'TRIM_HORIZON':
+            position = 0
+        elif ShardIteratorType == 'LATEST':
+            position = shard.position
+        elif ShardIteratorType == 'AT_SEQUENCE_NUMBER':
+            position = int(StartingSequenceNumber)
+        elif ShardIteratorType == 'AFTER_SEQUENCE_NUMBER':
+            record = shard.read(int(StartingSequenceNumber))
+            position = record[0] if record else shard.position
+        else:
+            raise ValueError(f'Unsupported shard iterator type: {ShardIteratorType}')
+        return _response(ShardIterator=self._iterator(StreamName, ShardId, position))
+
+    @staticmethod
+    def _iterator(stream: str, shard_id: str, position: int) -> str:
+        """Encode a shard iterator."""
+        data = json.dumps([stream, shard_id, position]).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def get_records(self, ShardIterator: str, Limit: int=10000, **kwargs) -> dict:
+        """Read a batch of records (max Limit records or 10 MB) from a shard iterator."""
+        stream, shard_id, position = json.loads(base64.urlsafe_b64decode(ShardIterator))
+        shard = self._shard(stream, shard_id)
+        with shard.lock:
+            allowed = shard.reads.allow()
+        if not allowed:
+            raise _throttled('GetRecords')
+
+        records = []
+        size = 0
+        arrival = None
+        while len(records) < Limit and size < 10 * 1024 * 1024:
+            record = shard.read(position)
+            if record is None:
+                break
+            next_position, key, data, arrival = record
+            records.append({
+                'SequenceNumber': str(position),
+                'ApproximateArrivalTimestamp': arrival,
+                'Data': data,
+                'PartitionKey': key,
+            })
+            size += len(data)
+            position = next_position
+
+        millis_behind = 0
+        if arrival is not None and position < shard.position:
+            millis_behind = max(1, int((shard.last_arrival - arrival) * 1000))
+        return _response(
+            Records=records,
+            NextShardIterator=self._iterator(stream, shard_id, position),
+            MillisBehindLatest=millis_behind,
+        )
+
+    def close(self):
+        """Close all segment files."""
+        for shards in self._streams.values():
+            for shard in shards:
+                shard.close()
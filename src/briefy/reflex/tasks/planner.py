@@ -0,0 +1,306 @@
+"""Dry-run planning of order imports to briefy.alexandria and S3."""
+from briefy.common.utilities.interfaces import IRemoteRestEndpoint
+from briefy.reflex import claimcheck
+from briefy.reflex import config
+from briefy.reflex import get_utility
+from briefy.reflex import logger
+from briefy.reflex import metrics
+from briefy.reflex import scheduling
+from briefy.reflex.celery import app
+from briefy.reflex.models import DriveFile
+from briefy.reflex.models import Order
+from briefy.reflex.tasks import alexandria
+from briefy.reflex.tasks import gdrive
+from briefy.reflex.tasks import leica
+from briefy.reflex.tasks import s3
+from briefy.reflex.tasks import ReflexTask
+from celery import chain
+from celery import group
+from celery.result import GroupResult
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from requests.exceptions import ConnectionError
+from urllib3.exceptions import ProtocolError
+
+import enum
+import json
+import os
+import typing as t
+
+
+class PlanAction(enum.Enum):
+    """Action needed to import one gdrive image."""
+
+    create = 'create'
+    """Asset does not exist in Alexandria: create it and transfer the file."""
+
+    link = 'link'
+    """Asset exists in Alexandria but is not part of the collection yet."""
+
+    transfer = 'transfer'
+    """Asset exists in Alexandria and in the collection but the file is missing in S3."""
+
+    skip = 'skip'
+    """Nothing to do."""
+
+
+@lru_cache(maxsize=None)
+def _folder_contents(folder_id: str, extract_id: bool=False) -> dict:
+    """Return the cached gdrive folder listing."""
+    return gdrive.folder_contents(folder_id, extract_id=extract_id)
+
+
+@lru_cache(maxsize=None)
+def _asset_by_slug(slug: str) -> dict:
+    """Return the cached Alexandria asset, looked up using the gdrive file id as slug."""
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'assets', 'Assets'), 'alexandria'
+    )
+    data = library_api.query({'slug': slug})['data']
+    return library_api.get(data[0].get('id')) if data else {}
+
+
+@lru_cache(maxsize=None)
+def _file_in_s3(file_name: str) -> bool:
+    """Check if the asset file was already uploaded to S3, the result is cached."""
+    return s3.file_exists((config.AWS_ASSETS_SOURCE, file_name))
+
+
+def clear_cache():
+    """Clear the cached read paths used by the planner."""
+    _folder_contents.cache_clear()
+    _asset_by_slug.cache_clear()
+    _file_in_s3.cache_clear()
+
+
+def plan_image(image_payload: dict, collection_id: str, directory: str) -> dict:
+    """Compute the plan entry for one gdrive image.
+
+    :param image_payload: image payload from briefy.gdrive
+    :param collection_id: ID of the collection the asset should be part of
+    :param directory: local directory used when the file is transferred
+    :return: plan entry
+    """
+    image = DriveFile.from_dict(image_payload)
+    asset = _asset_by_slug(image.id)
+    destiny = None
+    if not asset:
+        action = PlanAction.create
+        transfer = True
+    else:
+        file_name = f'{asset.get("id")}.{alexandria.file_extension(image)}'
+        destiny = [directory, file_name]
+        transfer = not _file_in_s3(file_name)
+        if collection_id not in asset.get('collections', []):
+            action = PlanAction.link
+        elif transfer:
+            action = PlanAction.transfer
+        else:
+            action = PlanAction.skip
+
+    return {
+        'action': action.value,
+        'transfer': transfer,
+        'collection_id': collection_id,
+        'destiny': destiny,
+        'size': int(image.size or 0),
+        'image': image_payload,
+    }
+
+
+def plan_order(order_id: str) -> dict:
+    """Compute the plan for all assets of one order.
+
+    :param order_id: Order ID in Leica
+    :return: order plan with the full order payload and one entry per image
+    """
+    order_payload = leica.get_order(order_id)
+    order = Order.from_dict(order_payload)
+    entries = []
+    if order.requirement_items:
+        for item in order.requirement_items:
+            contents = _folder_contents(item.folder_id)
+            directory = alexandria.asset_directory(order.id, item.id)
+            entries.extend(
+                plan_image(image, item.id, directory) for image in contents.get('images', [])
+            )
+    else:
+        contents = _folder_contents(order.delivery.gdrive, extract_id=True)
+        directory = alexandria.asset_directory(order.id)
+        entries.extend(
+            plan_image(image, order.id, directory)
+            for image in alexandria.delivery_images(contents)
+        )
+    return {'order': order_payload, 'entries': entries}
+
+
+def _safe_plan_order(order_id: str) -> dict:
+    """Plan one order and record the error instead of failing the whole plan."""
+    try:
+        return plan_order(order_id)
+    except Exception as exc:
+        logger.exception(f'Failure planning order "{order_id}".')
+        return {'order': {'id': order_id}, 'entries': [], 'error': repr(exc)}
+
+
+class ImportPlan:
+    """Assets to create, link and transfer when importing a list of orders."""
+
+    def __init__(self, orders: t.Sequence[dict], uri: str='', created_at: str=''):
+        """Initialize the plan.
+
+        :param orders: list of order plans, see :func:`plan_order`
+        :param uri: link to the orders csv file used to build the plan
+        :param created_at: plan creation date in ISO format
+        """
+        self.orders = list(orders)
+        self.uri = uri
+        self.created_at = created_at or datetime.utcnow().isoformat()
+
+    @property
+    def totals(self) -> dict:
+        """Number of assets per action and number of bytes to transfer."""
+        totals = {action.value: 0 for action in PlanAction}
+        totals.update(orders=len(self.orders), errors=0, assets=0, transfers=0, bytes=0)
+        for order in self.orders:
+            totals['errors'] += 1 if order.get('error') else 0
+            for entry in order['entries']:
+                totals[entry['action']] += 1
+                totals['assets'] += 1
+                if entry['transfer']:
+                    totals['transfers'] += 1
+                    totals['bytes'] += entry['size']
+        return totals
+
+    @property
+    def estimated_duration(self) -> float:
+        """Estimated duration of the import in seconds based on the configured throughput."""
+        totals = self.totals
+        operations = totals['assets'] - totals[PlanAction.skip.value]
+        return max(
+            totals['bytes'] / config.PLANNER_THROUGHPUT_BYTES,
+            operations / config.PLANNER_THROUGHPUT_ASSETS,
+        )
+
+    def to_dict(self) -> dict:
+        """Serialize the plan."""
+        return {
+            'uri': self.uri,
+            'created_at': self.created_at,
+            'totals': self.totals,
+            'estimated_duration': self.estimated_duration,
+            'orders': self.orders,
+        }
+
+    def save(self, path: str='') -> str:
+        """Persist the plan as a json file.
+
+        :param path: file path, if empty a new file is created in config.PLANNER_PATH
+        :return: file path
+        """
+        if not path:
+            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+            path = os.path.join(config.PLANNER_PATH, f'{timestamp}-import-plan.json')
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'w') as fout:
+            json.dump(self.to_dict(), fout)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'ImportPlan':
+        """Load a plan from a json file.
+
+        :param path: file path
+        :return: plan instance
+        """
+        with open(path, 'r') as fin:
+            data = json.load(fin)
+        return cls(data['orders'], uri=data.get('uri', ''), created_at=data.get('created_at', ''))
+
+
+def plan(uri: str, path: str='') -> ImportPlan:
+    """Build and persist the import plan of all accepted orders in the csv report.
+
+    Only the read paths are executed: nothing is created in Alexandria or uploaded to S3.
+
+    :param uri: link to all orders csv file
+    :param path: file path to save the plan
+    :return: import plan
+    """
+    clear_cache()
+    order_ids = [order.get('uid') for order in alexandria.accepted_orders(uri)]
+    with ThreadPoolExecutor(max_workers=config.PLANNER_CONCURRENCY) as executor:
+        orders = list(executor.map(_safe_plan_order, order_ids))
+
+    import_plan = ImportPlan(orders, uri=uri)
+    path = import_plan.save(path)
+    totals = import_plan.totals
+    logger.info(
+        f'Import plan saved to "{path}": {totals["orders"]} orders, '
+        f'{totals["create"]} assets to create, {totals["link"]} to link, '
+        f'{totals["transfers"]} transfers ({totals["bytes"]} bytes), '
+        f'estimated duration {import_plan.estimated_duration:.0f}s.'
+    )
+    return import_plan
+
+
+@app.task(
+    base=ReflexTask,
+    autoretry_for=(ConnectionError, ProtocolError, RuntimeError, OSError),
+    retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
+    retry_backoff=True,
+)
+def add_planned_order(order_plan: dict) -> GroupResult:
+    """Import the assets of one order following the plan, without listing the folders again.
+
+    :param order_plan: order plan, see :func:`plan_order`
+    :return: async group result from celery group execution
+    """
+    alexandria.create_collections(order_plan['order'])
+    factory = get_utility(IRemoteRestEndpoint)
+    library_api = metrics.instrument(
+        factory(config.ALEXANDRIA_BASE, 'collections', 'Collections'), 'alexandria'
+    )
+    collections = {}
+    tasks = []
+    entries = [
+        entry for entry in order_plan['entries'] if entry['action'] != PlanAction.skip.value
+    ]
+    options = scheduling.task_options(
+        order_plan['order'].get('id'), scheduling.BACKFILL, len(entries)
+    )
+    for entry in entries:
+        action = PlanAction(entry['action'])
+        image = entry['image']
+        if action == PlanAction.transfer:
+            tasks.append(s3.download_and_upload_file.s(entry['destiny'], image).set(**options))
+            continue
+
+        collection_id = entry['collection_id']
+        if collection_id not in collections:
+            collections[collection_id] = claimcheck.check(library_api.get(collection_id))
+        task = alexandria.add_or_update_asset.s(image, collections[collection_id]).set(**options)
+        if entry['transfer']:
+            task = chain(task, s3.download_and_upload_file.s(image).set(**options))
+        tasks.append(task)
+
+    return group(tasks)()
+
+
+def execute(path: str, chunk_size=10) -> list:
+    """Execute a persisted import plan.
+
+    :param path: import plan file path
+    :param chunk_size: number of orders per chunk of execution
+    :return: list of celery async result instances, the number depends of the chunk size
+    """
+    import_plan = ImportPlan.load(path)
+    param_list = [
+        (claimcheck.check(order_plan), ) for order_plan in import_plan.orders
+        if any(entry['action'] != PlanAction.skip.value for entry in order_plan['entries'])
+    ]
+    return add_planned_order.chunks(param_list, chunk_size).apply_async()
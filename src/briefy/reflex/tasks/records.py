@@ -0,0 +1,203 @@
+"""Compact record format of the gdrive delivery kinesis stream.
+
+Each record is a versioned envelope with a fixed size header followed by the compressed json
+payload. Payloads bigger than the kinesis record limit are split in chunks with the same record
+id, to be reassembled by the consumer. Legacy records (plain json) are still decoded.
+"""
+from briefy.reflex import logger
+from briefy.reflex.config import KINESIS_RECORD_CODEC
+from collections import OrderedDict
+
+import json
+import math
+import struct
+import uuid
+import zlib
+
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b'\xbf\x52'
+"""First bytes of an envelope, never the first bytes of a legacy json record."""
+
+VERSION = 1
+"""Current envelope version."""
+
+HEADER = struct.Struct('>2sBB16sHH')
+"""Envelope header: magic, version, codec, record id, chunk index, number of chunks."""
+
+MAX_DATA_SIZE = 1024 * 1024 - 256
+"""Max size of the data of one record, kinesis limit minus the max partition key size."""
+
+CODECS = {
+    'none': 0,
+    'zlib': 1,
+    'zstd': 2,
+}
+"""Codec ids used in the envelope header."""
+
+ORDER_FIELDS = ('id', 'slug', 'number_required_assets')
+"""Order fields read by the stream consumers."""
+
+DELIVERY_FIELDS = ('gdrive', 'archive')
+"""Order delivery fields read by the stream consumers."""
+
+ASSIGNMENT_FIELDS = ('id', 'submission_path')
+"""Order assignment fields read by the stream consumers."""
+
+FILE_FIELDS = ('id', 'name', 'mimeType', 'size', 'md5Checksum')
+"""Gdrive file fields read by the stream consumers."""
+
+FILE_LISTS = ('images', 'videos', 'other_files')
+"""Keys of the file lists in a briefy.gdrive.api.contents result."""
+
+
+def _project(item: dict, fields: tuple) -> dict:
+    """Return a new dict only with the informed fields."""
+    return {key: item[key] for key in fields if key in item}
+
+
+def project_order(order: dict) -> dict:
+    """Keep only the order fields read by the consumers.
+
+    :param order: full order payload from leica
+    :return: projected order payload
+    """
+    data = _project(order, ORDER_FIELDS)
+    data['delivery'] = _project(order.get('delivery') or {}, DELIVERY_FIELDS)
+    data['assignments'] = [
+        _project(assignment, ASSIGNMENT_FIELDS) for assignment in order.get('assignments') or []
+    ]
+    return data
+
+
+def project_folder(folder: dict) -> dict:
+    """Keep only the folder and file fields read by the consumers.
+
+    :param folder: briefy.gdrive.api.contents result
+    :return: projected folder contents
+    """
+    if not folder:
+        return folder
+    data = _project(folder, ('id', 'name'))
+    for key in FILE_LISTS:
+        if key in folder:
+            data[key] = [_project(item, FILE_FIELDS) for item in folder[key]]
+    if 'folders' in folder:
+        data['folders'] = [project_folder(item) for item in folder['folders']]
+    return data
+
+
+def project_contents(contents: dict) -> dict:
+    """Keep only the fields read by the consumers in the delivery, archive and submissions.
+
+    :param contents: contents payload from tasks.leica.get_assets_contents
+    :return: projected contents
+    """
+    return {
+        'delivery': project_folder(contents.get('delivery')),
+        'archive': project_folder(contents.get('archive')),
+        'submissions': [project_folder(item) for item in contents.get('submissions') or []],
+    }
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """Compress data using one of the supported codecs."""
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('Codec "zstd" requires the zstandard package.')
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def decompress(data: bytes, codec_id: int) -> bytes:
+    """Decompress data using the codec id from the envelope header."""
+    if codec_id == CODECS['zlib']:
+        return zlib.decompress(data)
+    elif codec_id == CODECS['zstd']:
+        if zstandard is None:
+            raise ValueError('Codec "zstd" requires the zstandard package.')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode(
+        order: dict, contents: dict, codec: str=KINESIS_RECORD_CODEC, max_size: int=MAX_DATA_SIZE
+) -> list:
+    """Encode one order and its folder contents in one or more record chunks.
+
+    :param order: full order payload from leica
+    :param contents: contents payload from tasks.leica.get_assets_contents
+    :param codec: compression codec: none, zlib or zstd
+    :param max_size: max size of each chunk
+    :return: list of chunks, each one to be sent as one kinesis record
+    """
+    payload = json.dumps(
+        {'order': project_order(order), 'contents': project_contents(contents)},
+        separators=(',', ':')
+    ).encode('utf-8')
+    data = compress(payload, codec)
+    chunk_size = max_size - HEADER.size
+    count = max(1, math.ceil(len(data) / chunk_size))
+    record_id = uuid.uuid4().bytes
+    return [
+        HEADER.pack(MAGIC, VERSION, CODECS[codec], record_id, index, count) +
+        data[index * chunk_size:(index + 1) * chunk_size]
+        for index in range(count)
+    ]
+
+
+class RecordDecoder:
+    """Decode records of the gdrive delivery stream in the legacy and the envelope formats."""
+
+    def __init__(self, max_pending: int=100):
+        """Initialize decoder.
+
+        :param max_pending: max number of incomplete chunked records kept in memory
+        """
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+
+    def decode(self, data: bytes, position=None) -> dict:
+        """Decode one record.
+
+        :param data: record data
+        :param position: position of the record in the stream, kept while a chunked record waits
+                         for its remaining chunks, see :meth:`pending_positions`
+        :return: dict with order and contents or None if the record is waiting for more chunks
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not data.startswith(MAGIC):
+            return json.loads(data.decode('utf-8'))
+
+        magic, version, codec_id, record_id, index, count = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError(f'Unknown record version: {version}')
+
+        chunk = data[HEADER.size:]
+        if count > 1:
+            chunks, _ = self._pending.setdefault(record_id, ([None] * count, position))
+            chunks[index] = chunk
+            if any(item is None for item in chunks):
+                if len(self._pending) > self.max_pending:
+                    dropped, _ = self._pending.popitem(last=False)
+                    logger.warning(f'Incomplete record dropped: {uuid.UUID(bytes=dropped)}')
+                return None
+            del self._pending[record_id]
+            chunk = b''.join(chunks)
+
+        return json.loads(decompress(chunk, codec_id).decode('utf-8'))
+
+    def pending_positions(self) -> list:
+        """Return the positions of the first chunk received of each incomplete record.
+
+        :return: list of positions informed to :meth:`decode`, oldest record first
+        """
+        return [position for _, position in self._pending.values()]
@@ -0,0 +1,70 @@
+"""Task runtimes recorded by the workers, used by the autoscaler."""
+from briefy.reflex import logger
+from briefy.reflex.config import TASKS_BROKER
+from collections import defaultdict
+
+import redis
+import threading
+import time
+
+
+RUNTIME_KEY = 'reflex:autoscale:runtime'
+"""Redis hash with the total runtime and number of executions of each task name."""
+
+
+class RuntimeRecorder:
+    """Aggregate task runtimes in the worker process and flush them to redis periodically."""
+
+    def __init__(self, url: str=TASKS_BROKER, interval: float=10.0):
+        """Initialize recorder.
+
+        :param url: redis database url
+        :param interval: seconds between flushes
+        """
+        self.url = url
+        self.interval = interval
+        self._redis = None
+        self._lock = threading.Lock()
+        self._seconds = defaultdict(float)
+        self._count = defaultdict(int)
+        self._last_flush = time.monotonic()
+
+    def record(self, name: str, seconds: float):
+        """Record one task execution.
+
+        :param name: task name
+        :param seconds: task runtime
+        """
+        with self._lock:
+            self._seconds[name] += seconds
+            self._count[name] += 1
+            if time.monotonic() - self._last_flush < self.interval:
+                return
+            seconds, count = self._seconds, self._count
+            self._seconds, self._count = defaultdict(float), defaultdict(int)
+            self._last_flush = time.monotonic()
+        self.flush(seconds, count)
+
+    def flush(self, seconds: dict, count: dict):
+        """Add the aggregated runtimes to the redis hash."""
+        try:
+            if self._redis is None:
+                self._redis = redis.StrictRedis.from_url(self.url)
+            pipeline = self._redis.pipeline(transaction=False)
+            for name, value in seconds.items():
+                pipeline.hincrbyfloat(RUNTIME_KEY, f'{name}:seconds', value)
+                pipeline.hincrby(RUNTIME_KEY, f'{name}:count', count[name])
+            pipeline.execute()
+        except Exception as exc:
+            logger.debug(f'Failure recording task runtimes: {exc!r}')
+
+
+_recorder = None
+
+
+def record_runtime(name: str, seconds: float):
+    """Record one task execution in the recorder shared by the process."""
+    global _recorder
+    if _recorder is None:
+        _recorder = RuntimeRecorder()
+    _recorder.record(name, seconds)
@@ -1,21 +1,30 @@
 """Communication with amazon S3 service."""
 from briefy.common.config import _queue_suffix
-from briefy.common.utils.data import Objectify
-from briefy.gdrive import api
 from briefy.reflex import config
+from briefy.reflex import configure
 from briefy.reflex import logger
+from briefy.reflex import metrics
+from briefy.reflex import renditions
+from briefy.reflex.checksum import ChecksumMismatch
+from briefy.reflex.checksum import HashingWriter
 from briefy.reflex.celery import app
+from briefy.reflex.lazy import lazy_import
+from briefy.reflex.models import DriveFile
 from briefy.reflex.tasks import ReflexTask
+from botocore.exceptions import ClientError
 from googleapiclient.errors import HttpError
 from http.client import IncompleteRead
 from ssl import SSLError
 
-import boto3
-import botocore
 import os
 import typing as t
 
 
+api = metrics.instrument(lazy_import('briefy.gdrive.api', on_load=configure), 'gdrive')
+boto3 = lazy_import('boto3')
+alexandria = lazy_import('briefy.reflex.tasks.alexandria')
+
+
 # TODO: crete a function to count assets
 # aws s3api list-objects --bucket images-dev-briefy --prefix "source/assets/"
 # --output json --query "[length(Contents[])]"
@@ -35,8 +44,10 @@ def file_exists(destiny: t.Tuple[str, str]) -> bool:
     result = True
 
     try:
-        s3.Object(bucket, file_path).load()
-    except botocore.exceptions.ClientError as exc:
+        # not found is an expected answer, not a failed call
+        with metrics.timed('s3', 'head_object', ignore=(ClientError, )):
+            s3.Object(bucket, file_path).load()
+    except ClientError as exc:
         if exc.response['Error']['Code'] == '404':
             result = False
         else:
@@ -46,48 +57,112 @@ def file_exists(destiny: t.Tuple[str, str]) -> bool:
 
 
 @app.task(base=ReflexTask)
-def upload_file(destiny: t.Tuple[str, str]) -> str:
+def upload_file(destiny: t.Tuple[str, str], checksums: dict=None) -> str:
     """Upload file to S3 bucket.
 
+    Files up to CHECKSUM_PUT_MAX_BYTES with checksums are uploaded with a single PUT request
+    with the Content-MD5 (and x-amz-checksum-sha256) headers, so S3 rejects corrupted bodies.
+    Bigger files use a multipart upload, the MD5 is stored in the object metadata.
+
     :param destiny: tuple composed of (directory, file_name)
+    :param checksums: base64 encoded digests, see briefy.reflex.checksum.HashingWriter
     :return: return the file_path
     """
     directory, file_name = destiny
     source_path = f'{config.AWS_ASSETS_SOURCE}/{file_name}'
     bucket = f'images-{_queue_suffix}-briefy'
     file_path = os.path.join(directory, file_name)
+    size = os.path.getsize(file_path)
     s3 = boto3.resource('s3')
-    s3.meta.client.upload_file(file_path, bucket, source_path)
+    if checksums and size <= config.CHECKSUM_PUT_MAX_BYTES:
+        extra = {'ContentMD5': checksums['md5']}
+        if checksums.get('sha256'):
+            extra['ChecksumSHA256'] = checksums['sha256']
+        try:
+            with metrics.timed('s3', 'put_object'), open(file_path, 'rb') as body:
+                s3.meta.client.put_object(Bucket=bucket, Key=source_path, Body=body, **extra)
+        except ClientError as exc:
+            if exc.response['Error']['Code'] in ('BadDigest', 'XAmzContentChecksumMismatch'):
+                raise ChecksumMismatch(f'S3 rejected the checksum of {file_path}.') from exc
+            raise
+    else:
+        extra = {'Metadata': {'md5': checksums['md5']}} if checksums else None
+        with metrics.timed('s3', 'upload_file'):
+            s3.meta.client.upload_file(file_path, bucket, source_path, ExtraArgs=extra)
+    metrics.record_bytes('s3', 'upload', size)
     logger.info(f'File name "{file_path}" uploaded to bucket "{bucket}"')
     return source_path
 
 
+def upload_renditions(source_path: str, files: dict) -> dict:
+    """Upload the renditions of one image next to its source file.
+
+    :param source_path: S3 key of the source file
+    :param files: dict with rendition name as key and jpeg bytes as value
+    :return: dict with rendition name as key and S3 key as value
+    """
+    bucket = f'images-{_queue_suffix}-briefy'
+    s3 = boto3.resource('s3')
+    keys = {}
+    for name, data in files.items():
+        key = renditions.rendition_key(source_path, name)
+        with metrics.timed('s3', 'put_object'):
+            s3.meta.client.put_object(Bucket=bucket, Key=key, Body=data, ContentType='image/jpeg')
+        metrics.record_bytes('s3', 'upload', len(data))
+        keys[name] = key
+    return keys
+
+
 @app.task(
     base=ReflexTask,
     autoretry_for=(HttpError, FileNotFoundError, SSLError, IncompleteRead, OSError),
     retry_kwargs={'max_retries': config.TASK_MAX_RETRY},
     retry_backoff=True,
     rate_limit=config.GDRIVE_RATE_LIMIT,
+    order_slot=True,
+    backends=('gdrive', ),
 )
 def download_and_upload_file(destiny: t.Tuple[str, str], image_payload: dict) -> str:
     """Download from GDrive and upload file to S3 bucket.
 
+    The MD5 of the file is computed while it is written to disk and compared with the
+    md5Checksum of google drive, a mismatch raises ChecksumMismatch and the transfer is retried.
+
+    If renditions are enabled they are computed from the downloaded bytes and uploaded before
+    the source file, so a failure retries the whole transfer. They are attached to the asset
+    with the image metadata by :func:`briefy.reflex.tasks.alexandria.attach_renditions`.
+
     :param destiny: tuple composed of (directory, file_name)
     :param image_payload: google drive file id
     :return: return the file_path
     """
     directory, file_name = destiny
-    image = Objectify(image_payload)
+    image = DriveFile.from_dict(image_payload, ('id', 'md5Checksum'))
     if not file_exists(destiny):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
         file_path = f'{directory}/{file_name}'
-        with open(file_path, 'wb') as data:
-            data.write(api.get_file(image.id))
-
-        result = upload_file(destiny)
+        content = api.get_file(image.id)
+        metrics.record_bytes('gdrive', 'download', len(content))
+        with HashingWriter(open(file_path, 'wb')) as data:
+            data.write(content)
+        try:
+            data.verify(image.md5Checksum, file_name)
+        except ChecksumMismatch:
+            os.remove(file_path)
+            raise
+
+        # an existing source file means the transfer is complete, so renditions go first
+        rendered = renditions.render_image(content)
+        if rendered is not None:
+            metadata, files = rendered
+            keys = upload_renditions(f'{config.AWS_ASSETS_SOURCE}/{file_name}', files)
+
+        result = upload_file(destiny, data.checksums())
         os.remove(file_path)
+        if rendered is not None:
+            alexandria.attach_renditions.delay(image.id, metadata, keys)
     else:
         result = f'{config.AWS_ASSETS_SOURCE}/{file_name}'
     return result
@@ -1,22 +1,99 @@
 #!/usr/bin/python
-"""Wrapper to execute ms.laure tasks worker."""
+"""Wrapper to execute ms.laure tasks worker.
+
+Each queue has a profile with the pool type and sizing of its workers::
+
+    tasks_worker tasks
+    tasks_worker gdrive
+    tasks_worker s3
+
+The wrapper replaces itself with the celery command line, which monkey patches the process for
+the eventlet pool before celery and the tasks are imported (app.worker_main does not).
+"""
 from briefy.common.config import ENV
-from briefy.reflex.celery import app
-from briefy.reflex.config import CELERY_CONCURRENCY_DEFAULT
+from briefy.reflex import config
 from briefy.reflex.config import CELERY_LOG_LEVEL
 
+import os
+import sys
 
-def main():
-    """Start celery worker."""
+
+CELERY_COMMAND = ('celery', '-A', 'briefy.reflex.tasks')
+"""Celery command line, followed by the worker arguments."""
+
+
+PREFORK_POOLS = ('prefork', 'processes')
+"""Pools with child processes, the only ones supporting max tasks and max memory per child."""
+
+PROFILES = {
+    'tasks': {
+        'queue': config.CELERY_DEFAULT_QUEUE,
+        'pool': config.CELERY_POOL_DEFAULT,
+        'concurrency': config.CELERY_CONCURRENCY_DEFAULT,
+        'prefetch': config.CELERY_PREFETCH_DEFAULT,
+        'max_tasks_per_child': config.CELERY_MAX_TASKS_PER_CHILD,
+        'max_memory_per_child': config.CELERY_MAX_MEMORY_PER_CHILD,
+    },
+    'gdrive': {
+        'queue': config.CELERY_DEFAULT_QUEUE_DRIVE,
+        'pool': config.CELERY_POOL_GDRIVE,
+        'concurrency': config.CELERY_CONCURRENCY_GDRIVE,
+        'prefetch': config.CELERY_PREFETCH_GDRIVE,
+        'max_tasks_per_child': config.CELERY_MAX_TASKS_PER_CHILD,
+        'max_memory_per_child': config.CELERY_MAX_MEMORY_PER_CHILD,
+    },
+    's3': {
+        'queue': config.CELERY_DEFAULT_QUEUE_S3,
+        'pool': config.CELERY_POOL_S3,
+        'concurrency': config.CELERY_CONCURRENCY_S3,
+        'prefetch': config.CELERY_PREFETCH_S3,
+        'max_tasks_per_child': config.CELERY_MAX_TASKS_PER_CHILD,
+        'max_memory_per_child': config.CELERY_MAX_MEMORY_PER_CHILD,
+    },
+}
+"""Worker profile of each queue.
+
+I/O bound queues (drive listing, drive to S3 transfers and REST calls) use eventlet, CPU bound
+queues should use prefork. Long running transfers use a prefetch of one task so priorities
+and the tasks of other orders are not stuck in the buffer of a busy worker.
+"""
+
+
+def worker_argv(name: str) -> list:
+    """Build the celery worker arguments of one profile.
+
+    :param name: profile name
+    :return: list of command line arguments
+    """
+    profile = PROFILES[name]
     argv = [
         'worker',
-        f'--concurrency={CELERY_CONCURRENCY_DEFAULT}',
+        f'--queues={profile["queue"]}',
+        f'--pool={profile["pool"]}',
+        f'--concurrency={profile["concurrency"]}',
+        f'--prefetch-multiplier={profile["prefetch"]}',
+        # fixed node name of each queue, so flower identifies the workers across restarts
+        f'--hostname=briefy-reflex-{name}-dev',
         '--events',
         f'--loglevel={CELERY_LOG_LEVEL}',
     ]
+    if profile['pool'] in PREFORK_POOLS:
+        if profile['max_tasks_per_child']:
+            argv.append(f'--max-tasks-per-child={profile["max_tasks_per_child"]}')
+        if profile['max_memory_per_child']:
+            argv.append(f'--max-memory-per-child={profile["max_memory_per_child"]}')
     if ENV in ('production', 'staging', 'development'):
         argv.append('--uid=33')
-    app.worker_main(argv)
+    return argv
+
+
+def main():
+    """Start celery worker using the profile informed in the command line."""
+    name = sys.argv[1] if len(sys.argv) > 1 else 'tasks'
+    if name not in PROFILES:
+        sys.exit(f'Unknown worker profile "{name}", use one of: {", ".join(sorted(PROFILES))}')
+    argv = [*CELERY_COMMAND, *worker_argv(name)]
+    os.execvp(argv[0], argv)
 
 
 if __name__ == '__main__':
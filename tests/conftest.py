@@ -0,0 +1,23 @@
+"""Fixtures shared by the tests."""
+from briefy import reflex
+from briefy.reflex import config
+from briefy.reflex.celery import app
+
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def redis_client():
+    """In memory redis client."""
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+@pytest.fixture
+def eager(monkeypatch):
+    """Execute tasks in the current process, without components and circuit breakers."""
+    monkeypatch.setattr(reflex, '_configured', True)
+    monkeypatch.setattr(config, 'BREAKER_ENABLED', False)
+    monkeypatch.setattr(app.conf, 'task_always_eager', True)
+    monkeypatch.setattr(app.conf, 'task_store_eager_result', False)
+    return app
@@ -0,0 +1,45 @@
+"""Test the asynchronous import of orders."""
+from briefy.reflex import events
+from briefy.reflex.tasks import alexandria
+from unittest import mock
+
+
+ORDER = {'id': 'order-id', 'sqs_message_id': 'message-id'}
+
+
+def test_import_failing_before_chord(eager, monkeypatch):
+    """Test the failure event is fired and the claim released if import_order fails."""
+    store = mock.Mock()
+    notified = []
+    monkeypatch.setattr(alexandria, 'get_store', lambda: store)
+    monkeypatch.setattr(
+        alexandria, 'notify', lambda event_class, order, payload: notified.append(event_class)
+    )
+    monkeypatch.setattr(
+        alexandria, 'create_collections', mock.Mock(side_effect=ValueError('Leica failure'))
+    )
+
+    status, _ = alexandria.submit(ORDER)
+
+    assert status == alexandria.AssetsImportResult.submitted
+    assert notified == [events.ImportAssetsFailure]
+    store.release.assert_called_once_with('order-id', 'message-id')
+    store.done.assert_not_called()
+
+
+def test_import_completed_summary(eager, monkeypatch):
+    """Test the success event has the asset paths and the stored result only a summary."""
+    store = mock.Mock()
+    notified = []
+    monkeypatch.setattr(alexandria, 'get_store', lambda: store)
+    monkeypatch.setattr(
+        alexandria, 'notify',
+        lambda event_class, order, payload: notified.append((event_class, payload))
+    )
+    assets = ['source/assets/1.jpg', 'source/assets/2.jpg']
+
+    result = alexandria.import_completed(assets, ORDER)
+
+    assert result == {'order_id': 'order-id', 'assets': 2}
+    assert notified == [(events.ImportAssetsSuccess, {'assets': assets})]
+    store.done.assert_called_once_with('order-id', 'message-id')
@@ -0,0 +1,75 @@
+"""Test the autoscaling of the worker pools."""
+from briefy.reflex import autoscale
+from briefy.reflex.autoscale import Autoscaler
+from briefy.reflex.autoscale import DeisScaler
+from briefy.reflex.autoscale import Pool
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def pools() -> list:
+    """One pool without drive calls and two pools sharing the drive quota."""
+    return [
+        Pool('tasks', 'tasks', 10, min_replicas=1, max_replicas=10),
+        Pool('gdrive', 'gdrive', 10, drive=True, min_replicas=1, max_replicas=20),
+        Pool('s3', 's3', 10, drive=True, min_replicas=1, max_replicas=20),
+    ]
+
+
+@pytest.fixture
+def autoscaler(pools, redis_client) -> Autoscaler:
+    """Autoscaler draining the queues in 60 seconds, with a drive quota of 100 requests/s."""
+    instance = Autoscaler(
+        mock.Mock(), pools=pools, drain_seconds=60, down_delay=300, drive_quota=100,
+        drive_rate_limit='', default_runtime=2.0
+    )
+    instance.redis = redis_client
+    return instance
+
+
+def test_desired(autoscaler, pools):
+    """Test the replicas needed to drain a queue, within the pool limits."""
+    tasks = pools[0]
+    # one replica runs 10 tasks each 2 seconds: 300 tasks in 60 seconds
+    assert autoscaler.desired(tasks, 0) == 1
+    assert autoscaler.desired(tasks, 300) == 1
+    assert autoscaler.desired(tasks, 301) == 2
+    assert autoscaler.desired(tasks, 900) == 3
+    assert autoscaler.desired(tasks, 100000) == 10
+
+
+def test_hysteresis(autoscaler, pools):
+    """Test scaling up right away and down to the highest demand after down_delay."""
+    tasks = pools[0]
+    assert autoscaler.hysteresis(tasks, 5, 2, now=0) == 5
+    assert autoscaler.hysteresis(tasks, 2, 5, now=10) == 5
+    assert autoscaler.hysteresis(tasks, 3, 5, now=100) == 5
+    assert autoscaler.hysteresis(tasks, 1, 5, now=309) == 5
+    assert autoscaler.hysteresis(tasks, 1, 5, now=310) == 3
+    # a higher demand restarts the delay
+    assert autoscaler.hysteresis(tasks, 2, 3, now=400) == 3
+    assert autoscaler.hysteresis(tasks, 4, 3, now=500) == 4
+    assert autoscaler.hysteresis(tasks, 2, 4, now=600) == 4
+
+
+def test_apply_drive_ceiling(autoscaler):
+    """Test the drive pools are reduced proportionally to fit the drive quota."""
+    # each drive replica calls drive 5 times per second: 20 replicas fit in the quota
+    targets = {'tasks': 10, 'gdrive': 10, 's3': 10}
+    assert autoscaler.apply_drive_ceiling(dict(targets)) == targets
+    targets = autoscaler.apply_drive_ceiling({'tasks': 10, 'gdrive': 30, 's3': 10})
+    assert targets == {'tasks': 10, 'gdrive': 15, 's3': 5}
+    targets = autoscaler.apply_drive_ceiling({'tasks': 10, 'gdrive': 200, 's3': 1})
+    assert targets == {'tasks': 10, 'gdrive': 19, 's3': 1}
+
+
+def test_deis_scaler_lists_replicas_each_cycle(autoscaler, pools):
+    """Test replicas changed outside the autoscaler are seen in the next cycle."""
+    autoscaler.pools = pools[:1]
+    autoscaler.scaler = DeisScaler('reflex')
+    outputs = ['reflex-tasks-1 up\n', 'reflex-tasks-1 up\nreflex-tasks-2 up\n']
+    with mock.patch.object(autoscale.subprocess, 'check_output', side_effect=outputs):
+        assert autoscaler.run_once()['tasks']['current'] == 1
+        assert autoscaler.run_once()['tasks']['current'] == 2
@@ -0,0 +1,77 @@
+"""Test the circuit breakers of the backends."""
+from briefy.reflex.breaker import CircuitBreaker
+from briefy.reflex.breaker import CircuitOpen
+from briefy.reflex.breaker import CLOSED
+from briefy.reflex.breaker import HALF_OPEN
+from briefy.reflex.breaker import OPEN
+
+import pytest
+
+
+@pytest.fixture
+def circuit(redis_client):
+    """Circuit breaker sharing its state in every call."""
+    return CircuitBreaker(
+        'leica', redis_client, error_rate=0.5, slow_seconds=10, slow_rate=1.0, min_calls=4,
+        window=60, open_seconds=60, probe_interval=5, refresh=0
+    )
+
+
+def open_circuit(circuit: CircuitBreaker):
+    """Fail enough calls to open the circuit."""
+    for _ in range(4):
+        circuit.record(0.1, failed=True)
+
+
+def test_closed_under_min_calls(circuit):
+    """Test the circuit stays closed until the window has enough calls."""
+    for _ in range(3):
+        circuit.record(0.1, failed=True)
+    assert circuit.state() == CLOSED
+    circuit.check()
+
+
+def test_open_on_error_rate(circuit):
+    """Test the circuit opens when the error rate of the window reaches the threshold."""
+    circuit.record(0.1, failed=False)
+    circuit.record(0.1, failed=False)
+    circuit.record(0.1, failed=True)
+    assert circuit.state() == CLOSED
+    circuit.record(0.1, failed=True)
+    assert circuit.state() == OPEN
+    with pytest.raises(CircuitOpen) as exc:
+        circuit.check()
+    assert 0 < exc.value.retry_after <= 65
+
+
+def test_open_on_slow_rate(circuit):
+    """Test the circuit opens when all calls of the window are slow."""
+    for _ in range(4):
+        circuit.record(12, failed=False)
+    assert circuit.state() == OPEN
+
+
+def test_half_open_probe(circuit):
+    """Test only one task runs as probe after the circuit was open, and closes it."""
+    open_circuit(circuit)
+    circuit.redis.delete(circuit._key('open'))
+    assert circuit.state() == HALF_OPEN
+    assert circuit.allow() is True
+    # the probe lock is taken
+    assert circuit.allow() is False
+
+    circuit.record(0.1, failed=False)
+    assert circuit.state() == CLOSED
+    # the failures before the circuit opened are cleared
+    circuit.record(0.1, failed=True)
+    assert circuit.state() == CLOSED
+
+
+def test_half_open_probe_failure(circuit):
+    """Test a failed probe opens the circuit again."""
+    open_circuit(circuit)
+    circuit.redis.delete(circuit._key('open'))
+    assert circuit.allow() is True
+    circuit.record(0.1, failed=True)
+    assert circuit.state() == OPEN
+    assert circuit.allow() is False
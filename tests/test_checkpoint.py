@@ -0,0 +1,74 @@
+"""Test the kinesis checkpoints and the consumer resume."""
+from briefy.reflex.tasks import records
+from briefy.reflex.tasks.checkpoint import Checkpointer
+from briefy.reflex.tasks.checkpoint import CheckpointStore
+from briefy.reflex.tasks.checkpoint import MemoryCheckpointStore
+from briefy.reflex.tasks.checkpoint import SQLiteCheckpointStore
+from briefy.reflex.tasks.kinesis import KinesisConsumer
+from briefy.reflex.tasks.localkinesis import LocalKinesis
+
+import pytest
+
+
+STREAM = 'test-stream'
+
+
+def local_kinesis(path) -> LocalKinesis:
+    """Create a local kinesis client without throttling."""
+    return LocalKinesis(
+        str(path), shard_count=1, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+
+
+def put_orders(client: LocalKinesis, slugs: list):
+    """Put one record for each order slug."""
+    for slug in slugs:
+        for chunk in records.encode({'id': slug, 'slug': slug}, {}, codec='zlib'):
+            client.put_record(StreamName=STREAM, Data=chunk, PartitionKey=slug)
+
+
+def consume(client: LocalKinesis, store: CheckpointStore) -> list:
+    """Read the stream until its tip and return the slugs of the orders processed."""
+    slugs = []
+    consumer = KinesisConsumer(STREAM, checkpoint_store=store, client=client)
+    consumer.run(lambda order, contents: slugs.append(order['slug']))
+    return slugs
+
+
+def test_store_is_abstract():
+    """Test the checkpoint store base class cannot be used directly."""
+    with pytest.raises(TypeError):
+        CheckpointStore()
+
+
+def test_sqlite_store(tmp_path):
+    """Test checkpoints saved in SQLite are loaded by a new store."""
+    path = str(tmp_path / 'checkpoints.sqlite')
+    SQLiteCheckpointStore(path).save(STREAM, {'shard-1': '10', 'shard-2': '20'})
+    SQLiteCheckpointStore(path).save(STREAM, {'shard-1': '11'})
+    assert SQLiteCheckpointStore(path).load(STREAM) == {'shard-1': '11', 'shard-2': '20'}
+    assert SQLiteCheckpointStore(path).load('other-stream') == {}
+
+
+def test_checkpointer_flushes_every_records():
+    """Test the checkpointer only writes to the store every N records."""
+    store = MemoryCheckpointStore()
+    checkpointer = Checkpointer(store, STREAM, every_records=3, every_seconds=3600)
+    checkpointer.update('shard-1', '1')
+    checkpointer.update('shard-1', '2')
+    assert store.load(STREAM) == {}
+    checkpointer.update('shard-1', '3')
+    assert store.load(STREAM) == {'shard-1': '3'}
+
+
+def test_consumer_resumes_after_checkpoint(tmp_path):
+    """Test a new consumer only processes the records after the last checkpoint."""
+    store = SQLiteCheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    put_orders(local_kinesis(tmp_path / 'stream'), ['a', 'b', 'c'])
+    assert consume(local_kinesis(tmp_path / 'stream'), store) == ['a', 'b', 'c']
+
+    # restart: nothing new to read
+    assert consume(local_kinesis(tmp_path / 'stream'), store) == []
+
+    put_orders(local_kinesis(tmp_path / 'stream'), ['d', 'e'])
+    assert consume(local_kinesis(tmp_path / 'stream'), store) == ['d', 'e']
@@ -0,0 +1,59 @@
+"""Test the checksums computed while the transferred files are written."""
+from briefy.reflex import checksum
+from briefy.reflex.checksum import ChecksumMismatch
+from briefy.reflex.checksum import HashingWriter
+from io import BytesIO
+
+import base64
+import hashlib
+import pytest
+
+
+CONTENT = b'briefy' * 1000
+
+
+def write(sha256: bool=False) -> HashingWriter:
+    """Write the content in a memory file."""
+    writer = HashingWriter(BytesIO(), sha256=sha256)
+    assert writer.write(CONTENT) == len(CONTENT)
+    return writer
+
+
+def test_verify():
+    """Test the MD5 of the written bytes is compared with the one of google drive."""
+    writer = write()
+    writer.verify(hashlib.md5(CONTENT).hexdigest().upper(), 'image.jpg')
+    # google drive does not report the MD5 of every file
+    writer.verify('', 'image.jpg')
+    with pytest.raises(ChecksumMismatch) as exc:
+        writer.verify(hashlib.md5(b'corrupted').hexdigest(), 'image.jpg')
+    assert 'image.jpg' in str(exc.value)
+    # retried by the transfer tasks as any other I/O error
+    assert isinstance(exc.value, OSError)
+
+
+def test_chunks(monkeypatch):
+    """Test the digests and the written bytes do not depend on the chunk size."""
+    monkeypatch.setattr(checksum, 'CHUNK_SIZE', 7)
+    writer = write(sha256=True)
+    assert writer.fileobj.getvalue() == CONTENT
+    assert writer.size == len(CONTENT)
+    assert writer.md5.hexdigest() == hashlib.md5(CONTENT).hexdigest()
+    assert writer.sha256.hexdigest() == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_checksums():
+    """Test the digests are base64 encoded for S3, with the SHA-256 only if enabled."""
+    md5 = base64.b64encode(hashlib.md5(CONTENT).digest()).decode('ascii')
+    sha256 = base64.b64encode(hashlib.sha256(CONTENT).digest()).decode('ascii')
+    assert write().checksums() == {'md5': md5}
+    assert write(sha256=True).checksums() == {'md5': md5, 'sha256': sha256}
+
+
+def test_close(tmp_path):
+    """Test the wrapped file is closed by the context manager."""
+    path = tmp_path / 'image.jpg'
+    with HashingWriter(open(str(path), 'wb')) as writer:
+        writer.write(CONTENT)
+    assert writer.fileobj.closed
+    assert path.read_bytes() == CONTENT
@@ -0,0 +1,48 @@
+"""Test the claim check of large task payloads."""
+from briefy.reflex.claimcheck import ClaimCheck
+from briefy.reflex.claimcheck import RedisBlobStore
+
+import fakeredis
+import pytest
+
+
+PAYLOAD = {'images': [f'image-{index}.jpg' for index in range(100)]}
+
+
+@pytest.fixture
+def store():
+    """Blob store using an in memory redis."""
+    instance = RedisBlobStore('redis://localhost:6379/0', ttl=60)
+    instance.redis = fakeredis.FakeStrictRedis()
+    return instance
+
+
+def key(store, reference: dict) -> str:
+    """Redis key of a stored payload."""
+    return f'{store.prefix}:{reference["__claim_check__"]}'
+
+
+def test_check_and_resolve(store):
+    """Test a large payload is replaced by a reference and resolved by another process."""
+    reference = ClaimCheck(store, threshold=100).check(PAYLOAD)
+    assert reference != PAYLOAD
+    assert ClaimCheck(store, threshold=100).resolve(reference) == PAYLOAD
+    assert ClaimCheck(store, threshold=10000).check(PAYLOAD) == PAYLOAD
+
+
+def test_check_refreshes_ttl_on_cache_hit(store):
+    """Test a cached payload checked again refreshes the expiration of its blob."""
+    claim_check = ClaimCheck(store, threshold=100)
+    reference = claim_check.check(PAYLOAD)
+    store.redis.expire(key(store, reference), 5)
+    assert claim_check.check(PAYLOAD) == reference
+    assert store.redis.ttl(key(store, reference)) == 60
+
+
+def test_check_stores_expired_payload(store):
+    """Test a cached payload is stored again when its blob expired."""
+    claim_check = ClaimCheck(store, threshold=100)
+    reference = claim_check.check(PAYLOAD)
+    store.redis.delete(key(store, reference))
+    claim_check.check(PAYLOAD)
+    assert ClaimCheck(store, threshold=100).resolve(reference) == PAYLOAD
@@ -0,0 +1,68 @@
+"""Test the lazy loading of the ZCML configuration."""
+from briefy import reflex
+from unittest import mock
+
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def xmlconfig(monkeypatch):
+    """Slow XMLConfig mock, recording the loaded packages, with reflex not configured yet."""
+    loaded = []
+
+    def load(file_name, package):
+        def execute():
+            time.sleep(0.05)
+            loaded.append(package.__name__)
+        return execute
+
+    monkeypatch.setattr(reflex, '_configured', False)
+    monkeypatch.setattr('zope.configuration.xmlconfig.XMLConfig', load)
+    return loaded
+
+
+def test_configure_once(xmlconfig):
+    """Test the configuration is loaded on the first call only."""
+    reflex.configure()
+    reflex.configure()
+    assert xmlconfig == ['briefy.common', 'briefy.gdrive', 'briefy.reflex']
+    assert reflex._configured is True
+
+
+def test_configure_once_under_threads(xmlconfig):
+    """Test concurrent first calls load the configuration once and all wait for it."""
+    start = threading.Barrier(8)
+    configured = []
+
+    def call():
+        start.wait()
+        reflex.configure()
+        configured.append(len(xmlconfig))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert xmlconfig == ['briefy.common', 'briefy.gdrive', 'briefy.reflex']
+    # no thread returned before the configuration was complete
+    assert configured == [3] * 8
+
+
+def test_configure_failure_is_retried(xmlconfig, monkeypatch):
+    """Test a failed configuration is not marked as done."""
+    failing = mock.Mock(side_effect=ImportError('zcml'))
+    monkeypatch.setattr('zope.configuration.xmlconfig.XMLConfig', failing)
+    with pytest.raises(ImportError):
+        reflex.configure()
+    assert reflex._configured is False
+
+
+def test_get_utility_configures(xmlconfig, monkeypatch):
+    """Test utilities are looked up after the configuration is loaded."""
+    get = mock.Mock(side_effect=lambda interface, name: len(xmlconfig))
+    monkeypatch.setattr(reflex, 'getUtility', get)
+    assert reflex.get_utility('interface', 'name') == 3
+    get.assert_called_once_with('interface', 'name')
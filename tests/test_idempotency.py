@@ -0,0 +1,96 @@
+"""Test the deduplication of queue messages and order imports."""
+from briefy.reflex import logger
+from briefy.reflex.queue import idempotency
+from briefy.reflex.queue import worker
+from briefy.reflex.queue.idempotency import CLAIMED
+from briefy.reflex.queue.idempotency import DONE
+from briefy.reflex.queue.idempotency import IN_PROGRESS
+from briefy.reflex.queue.idempotency import IdempotencyStore
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def store(redis_client):
+    """Idempotency store using an in memory redis."""
+    instance = IdempotencyStore(ttl=3600, in_progress_ttl=60)
+    instance.redis = redis_client
+    return instance
+
+
+def test_claim_done_drops_duplicates(store):
+    """Test a message and its order are dropped after they are done."""
+    assert store.claim('message-1', 'order-1') == CLAIMED
+    store.done('order-1', 'message-1')
+    assert store.claim('message-1', 'order-1') == DONE
+    # another message for the same order is merged into the done import
+    assert store.claim('message-2', 'order-1') == DONE
+    assert store.state('message', 'message-2') == DONE
+
+
+def test_redelivery_after_crash(store):
+    """Test a message claimed by a crashed worker is retried, never dropped."""
+    assert store.claim('message-1', 'order-1') == CLAIMED
+    # the worker crashed before done or release, SQS delivers the message again
+    assert store.claim('message-1', 'order-1') == IN_PROGRESS
+    assert 0 < store.redis.ttl(store._key('message', 'message-1')) <= 60
+    assert 0 < store.redis.ttl(store._key('order', 'order-1')) <= 60
+
+    # the in progress claims expire
+    store.redis.delete(store._key('message', 'message-1'), store._key('order', 'order-1'))
+    assert store.claim('message-1', 'order-1') == CLAIMED
+
+
+def test_order_in_progress(store):
+    """Test another message of an order being imported is retried later."""
+    assert store.claim('message-1', 'order-1') == CLAIMED
+    assert store.claim('message-2', 'order-1') == IN_PROGRESS
+    # the message claim is removed, so it can be claimed when the order is done or released
+    assert store.state('message', 'message-2') is None
+
+    store.release('order-1', 'message-1')
+    assert store.claim('message-2', 'order-1') == CLAIMED
+
+
+def queue_worker(action: mock.Mock) -> worker.Worker:
+    """Create a queue worker with one idempotent event."""
+    dispatch_map = {
+        'order.workflow.accept': dict(
+            name='test', action=action, notification_actions={}, on_failure_retry=True,
+            idempotent=True,
+        )
+    }
+    return worker.Worker(
+        logger_=logger, input_queue=mock.Mock(), name='test', dispatch_map=dispatch_map
+    )
+
+
+def message(message_id: str, order_id: str) -> mock.Mock:
+    """Queue message of an accepted order."""
+    message = mock.Mock()
+    message.body = {
+        'id': message_id, 'event_name': 'order.workflow.accept', 'data': {'id': order_id}
+    }
+    return message
+
+
+def test_worker_drops_done_messages(store, monkeypatch):
+    """Test the worker acknowledges a duplicated message without dispatching it."""
+    monkeypatch.setattr(idempotency, 'get_store', lambda: store)
+    store.done('order-1', 'message-1')
+    action = mock.Mock()
+    assert queue_worker(action).process_message(message('message-1', 'order-1')) is True
+    action.assert_not_called()
+
+
+def test_worker_retries_in_progress_messages(store, monkeypatch):
+    """Test the worker keeps a message of an order in progress in the queue."""
+    monkeypatch.setattr(idempotency, 'get_store', lambda: store)
+    store.claim('message-1', 'order-1')
+    action = mock.Mock()
+    received = message('message-1', 'order-1')
+    assert queue_worker(action).process_message(received) is False
+    action.assert_not_called()
+    # not released: visible again only after the visibility timeout
+    received._message.change_visibility.assert_not_called()
@@ -0,0 +1,42 @@
+"""Test the streaming inventory."""
+from briefy.reflex.tasks.inventory import ALL
+from briefy.reflex.tasks.inventory import Inventory
+from briefy.reflex.tasks.inventory import ZERO
+
+import csv
+
+
+def order(slug: str) -> dict:
+    """Order payload."""
+    return {'id': slug, 'slug': slug, 'number_required_assets': 10}
+
+
+def contents(images: int) -> dict:
+    """Contents payload with a number of images in the delivery folder."""
+    return {'delivery': {'images': [{'id': str(index)} for index in range(images)]}}
+
+
+def read_slugs(file_path: str) -> list:
+    """Return the order slugs in a csv file."""
+    with open(file_path, newline='') as fin:
+        return [row['briefy_id'] for row in csv.DictReader(fin)]
+
+
+def test_inventory_resumes_after_restart(tmp_path):
+    """Test rows written before a restart are kept and orders are only counted once."""
+    outputs = {ALL: str(tmp_path / 'all.csv'), ZERO: str(tmp_path / 'zero.csv')}
+    with Inventory(outputs) as inventory:
+        inventory.add(order('a'), contents(5))
+        inventory.add(order('b'), contents(0))
+
+    with Inventory(outputs) as inventory:
+        assert inventory.total('total_delivery_images') == 5
+        # read again from the stream after the restart
+        inventory.add(order('b'), contents(0))
+        inventory.add(order('c'), contents(3))
+        assert inventory.orders == {ALL: 3, ZERO: 1}
+        assert inventory.total('total_delivery_images') == 8
+        assert inventory.total('number_required_assets') == 30
+
+    assert read_slugs(outputs[ALL]) == ['a', 'b', 'c']
+    assert read_slugs(outputs[ZERO]) == ['b']
@@ -0,0 +1,245 @@
+"""Test the kinesis producer and consumer."""
+from briefy.reflex.tasks import kinesis
+from briefy.reflex.tasks import records
+from briefy.reflex.tasks.checkpoint import MemoryCheckpointStore
+from briefy.reflex.tasks.kinesis import KinesisConsumer
+from briefy.reflex.tasks.kinesis import KinesisProducer
+from briefy.reflex.tasks.kinesis import ProducerError
+from briefy.reflex.tasks.localkinesis import LocalKinesis
+from botocore.exceptions import ClientError
+from unittest import mock
+
+import base64
+import json
+import pytest
+import threading
+import time
+
+
+class FakeKinesis:
+    """Kinesis client failing the first record of the first put_records calls."""
+
+    def __init__(self, failures: int=0):
+        """Initialize client."""
+        self.failures = failures
+        self.calls = 0
+        self.sent = []
+
+    def describe_stream(self, StreamName):
+        return {'StreamDescription': {'Shards': []}}
+
+    def put_records(self, Records, StreamName):
+        self.calls += 1
+        results = [{} for _ in Records]
+        if self.calls <= self.failures:
+            results[0] = {'ErrorCode': 'ProvisionedThroughputExceededException'}
+        self.sent.extend(record for record, result in zip(Records, results) if not result)
+        failed = len([result for result in results if result])
+        return {'FailedRecordCount': failed, 'Records': results}
+
+
+def producer(client: FakeKinesis, **kwargs) -> KinesisProducer:
+    """Create a producer with a long linger and a short backoff."""
+    options = {'linger': 60, 'max_retries': 3, 'backoff': 0.001}
+    options.update(kwargs)
+    return KinesisProducer('stream', client=client, **options)
+
+
+def test_failed_records_are_retried():
+    """Test records failed by put_records are sent again on flush."""
+    client = FakeKinesis(failures=2)
+    instance = producer(client)
+    for index in range(5):
+        instance.put(b'data', str(index))
+    instance.flush()
+    assert client.calls == 3
+    assert sorted(record['PartitionKey'] for record in client.sent) == list('01234')
+
+
+def test_batches_respect_max_records():
+    """Test one put_records call is made for each max_records records."""
+    client = FakeKinesis()
+    instance = producer(client)
+    instance.max_records = 3
+    for index in range(7):
+        instance.put(b'data', str(index))
+    instance.flush()
+    assert client.calls == 3
+    assert len(client.sent) == 7
+
+
+def test_failed_records_keep_partition_key_order():
+    """Test a record that failed is sent again before the next records of its partition key."""
+    client = FakeKinesis(failures=1)
+    instance = producer(client)
+    for data, key in ((b'a1', 'a'), (b'b1', 'b'), (b'a2', 'a')):
+        instance.put(data, key)
+    instance.flush()
+    assert [record['Data'] for record in client.sent] == [b'b1', b'a1', b'a2']
+
+
+def test_failure_after_max_retries_is_reported_to_the_delivery():
+    """Test records that cannot be sent fail their deliveries, with the next ones of their key."""
+    client = FakeKinesis(failures=3)
+    instance = producer(client, max_retries=2)
+    first = instance.put(b'first', 'a')
+    second = instance.put(b'second', 'a')
+    other = instance.put(b'other', 'b')
+    instance.flush()
+    with pytest.raises(ProducerError):
+        first.wait(0)
+    with pytest.raises(ProducerError):
+        second.wait(0)
+    other.wait(0)
+    assert [record['Data'] for record in client.sent] == [b'other']
+
+
+def test_background_flush_failure_is_not_raised_by_other_puts():
+    """Test a failure of the linger timer flush is only reported to the failed records."""
+    client = FakeKinesis(failures=1)
+    instance = producer(client, linger=0.001, max_retries=0)
+    first = instance.put(b'first', 'first')
+    with pytest.raises(ProducerError):
+        first.wait(5)
+    second = instance.put(b'second', 'second')
+    second.wait(5)
+    assert [record['Data'] for record in client.sent] == [b'second']
+
+
+def test_put_gdrive_record_waits_for_the_delivery(eager):
+    """Test the task returns once its records are sent and raises if they could not be."""
+    client = FakeKinesis()
+    with mock.patch.object(kinesis, 'get_producer', return_value=producer(client, linger=0.001)):
+        assert kinesis.put_gdrive_record(({'id': 'order-1'}, {}), stream='stream') is True
+        assert len(client.sent) == 1
+        client.failures = 100
+        with pytest.raises(ProducerError):
+            kinesis.put_gdrive_record(({'id': 'order-2'}, {}), stream='stream')
+
+
+class ReshardedKinesis(LocalKinesis):
+    """Local kinesis with the first shard closed and split into the second one.
+
+    The closed shard returns empty batches before the end of the shard, as kinesis does.
+    """
+
+    empty_batches = 2
+
+    def describe_stream(self, StreamName: str, **kwargs) -> dict:
+        response = super().describe_stream(StreamName, **kwargs)
+        parent, child = response['StreamDescription']['Shards']
+        parent['SequenceNumberRange']['EndingSequenceNumber'] = '1000'
+        child['ParentShardId'] = parent['ShardId']
+        return response
+
+    def get_records(self, ShardIterator: str, **kwargs) -> dict:
+        response = super().get_records(ShardIterator, **kwargs)
+        stream, shard_id, position = json.loads(base64.urlsafe_b64decode(ShardIterator))
+        if shard_id == 'shardId-000000000000' and not response['Records']:
+            if self.empty_batches:
+                self.empty_batches -= 1
+            else:
+                response['NextShardIterator'] = None
+        return response
+
+
+def test_consumer_reads_child_shards_after_closed_parent(tmp_path):
+    """Test empty batches of a closed shard do not hold its child shards back."""
+    client = ReshardedKinesis(
+        str(tmp_path), shard_count=2, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+    for slug, hash_key in (('parent', '0'), ('child', str(2 ** 128 - 1))):
+        for chunk in records.encode({'id': slug, 'slug': slug}, {}, codec='zlib'):
+            client.put_record(
+                StreamName='stream', Data=chunk, PartitionKey=slug, ExplicitHashKey=hash_key
+            )
+
+    slugs = []
+    consumer = KinesisConsumer('stream', checkpoint_store=MemoryCheckpointStore(), client=client)
+    consumer.run(lambda order, contents: slugs.append(order['slug']))
+    assert slugs == ['parent', 'child']
+    assert client.empty_batches == 0
+
+
+def put_order_updates(client: LocalKinesis, keys: str, updates: int):
+    """Put a sequence of updates for each order, one partition key per order."""
+    for index in range(updates):
+        for key in keys:
+            order = {'id': key, 'slug': f'{key}-{index}'}
+            for chunk in records.encode(order, {}, codec='zlib'):
+                client.put_record(StreamName='stream', Data=chunk, PartitionKey=key)
+
+
+def kinesis_threads() -> list:
+    """Fetcher threads of the parallel consumer still running."""
+    return [thread for thread in threading.enumerate() if thread.name.startswith('kinesis-')]
+
+
+def test_run_parallel_keeps_partition_key_order(tmp_path):
+    """Test the parallel consumer reads all shards keeping the order of each partition key."""
+    client = LocalKinesis(
+        str(tmp_path), shard_count=4, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+    put_order_updates(client, 'abcdefgh', 20)
+    store = MemoryCheckpointStore()
+    processed = []
+    consumer = KinesisConsumer('stream', checkpoint_store=store, client=client)
+    consumer.run(lambda order, contents: processed.append(order['slug']), parallel=True)
+
+    assert len(processed) == 160
+    for key in 'abcdefgh':
+        assert [slug for slug in processed if slug[0] == key] == [
+            f'{key}-{index}' for index in range(20)
+        ]
+    assert len(store.load('stream')) == 4
+    assert not kinesis_threads()
+
+
+def test_run_parallel_reads_children_after_closed_parent(tmp_path):
+    """Test the fetcher of a child shard starts only after its parent is read until the end."""
+    client = ReshardedKinesis(
+        str(tmp_path), shard_count=2, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+    for slug, hash_key in (('parent', '0'), ('child', str(2 ** 128 - 1))):
+        for chunk in records.encode({'id': slug, 'slug': slug}, {}, codec='zlib'):
+            client.put_record(
+                StreamName='stream', Data=chunk, PartitionKey=slug, ExplicitHashKey=hash_key
+            )
+
+    slugs = []
+    consumer = KinesisConsumer('stream', checkpoint_store=MemoryCheckpointStore(), client=client)
+    consumer.run(lambda order, contents: slugs.append(order['slug']), parallel=True)
+    assert slugs == ['parent', 'child']
+
+
+def test_run_parallel_stops_fetchers_on_callback_failure(tmp_path):
+    """Test a failure processing a record stops the fetchers blocked on the full queue."""
+    client = LocalKinesis(
+        str(tmp_path), shard_count=2, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+    put_order_updates(client, 'abcd', 20)
+    consumer = KinesisConsumer('stream', checkpoint_store=MemoryCheckpointStore(), client=client)
+
+    def fail(order, contents):
+        raise ValueError(order['slug'])
+
+    with pytest.raises(ValueError):
+        consumer.run_parallel(fail, queue_size=2)
+    deadline = time.monotonic() + 5
+    while kinesis_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not kinesis_threads()
+
+
+def test_run_parallel_raises_fetcher_errors(tmp_path):
+    """Test an error reading one shard stops the consumer and is raised."""
+    client = LocalKinesis(
+        str(tmp_path), shard_count=2, read_rate=0, write_rate=0, write_bytes_rate=0
+    )
+    put_order_updates(client, 'ab', 2)
+    error = ClientError({'Error': {'Code': 'ExpiredIteratorException'}}, 'GetRecords')
+    client.get_records = mock.Mock(side_effect=error)
+    consumer = KinesisConsumer('stream', checkpoint_store=MemoryCheckpointStore(), client=client)
+
+    with pytest.raises(ClientError):
+        consumer.run(parallel=True)
@@ -0,0 +1,37 @@
+"""Test the metrics endpoints of the worker processes."""
+from briefy.reflex import config
+from briefy.reflex import metrics
+from briefy.reflex.tasks.config import task_queue
+from unittest import mock
+
+import pytest
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Metrics server mocked, with the metrics port enabled."""
+    monkeypatch.setattr(metrics, 'METRICS_PORT', 9100)
+    monkeypatch.setattr(metrics, '_server', None)
+    start = mock.Mock()
+    monkeypatch.setattr(metrics, 'start_http_server', start)
+    return start
+
+
+def test_prefork_children_start_their_own_endpoint(server, monkeypatch):
+    """Test each prefork child serves its registry on its own port."""
+    metrics.start_worker_metrics()
+    server.assert_called_once_with(9100)
+    parent = metrics._server
+
+    monkeypatch.setattr(metrics, 'current_process', lambda: mock.Mock(index=2))
+    metrics.start_child_metrics()
+    # the socket inherited from the parent is closed in the child
+    parent.socket.close.assert_called_once_with()
+    server.assert_called_with(9103)
+
+
+def test_task_queue():
+    """Test the queue of a task comes from the celery task routes."""
+    assert task_queue('briefy.reflex.tasks.s3.upload_file') == config.CELERY_DEFAULT_QUEUE_S3
+    assert task_queue('briefy.reflex.tasks.gdrive.contents') == config.CELERY_DEFAULT_QUEUE_DRIVE
+    assert task_queue('unknown.task') == config.CELERY_DEFAULT_QUEUE
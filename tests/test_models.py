@@ -0,0 +1,78 @@
+"""Test the compact payload models."""
+from briefy.reflex.models import Dispatch
+from briefy.reflex.models import DriveFile
+from briefy.reflex.models import NotificationAction
+from briefy.reflex.models import Order
+from briefy.reflex.models import Reference
+from briefy.reflex.models import RequirementItem
+
+
+ORDER = {
+    'id': 'order-1',
+    'slug': 'order-slug',
+    'title': 'Order',
+    'customer': {'id': 'customer-1', 'title': 'Customer', 'extra': 'ignored'},
+    'delivery': {'gdrive': 'https://drive/folder', 'archive': None},
+    'requirement_items': [{'id': 'item-1', 'folder_id': 'folder-1'}, {'id': 'item-2'}],
+    'state': 'accepted',
+}
+
+
+def test_from_dict_nested_models():
+    """Test nested payloads are built as models and missing fields are None."""
+    order = Order.from_dict(ORDER)
+    assert order.id == 'order-1'
+    assert order.description is None
+    assert order.project is None
+    assert isinstance(order.customer, Reference)
+    assert order.customer.title == 'Customer'
+    assert order.delivery.gdrive == 'https://drive/folder'
+    assert [type(item) for item in order.requirement_items] == [RequirementItem] * 2
+    assert order.requirement_items[0].folder_id == 'folder-1'
+    assert order.requirement_items[1].folder_id is None
+    assert not hasattr(order, 'state')
+
+
+def test_from_dict_projection():
+    """Test only the projected fields are read from the payload."""
+    order = Order.from_dict(ORDER, fields=('id', 'delivery'))
+    assert order.id == 'order-1'
+    assert order.delivery.gdrive == 'https://drive/folder'
+    assert order.slug is None
+    assert order.customer is None
+    assert order.requirement_items is None
+    assert order.to_dict() == {'id': 'order-1', 'delivery': {'gdrive': 'https://drive/folder'}}
+
+
+def test_to_dict_round_trip():
+    """Test serializing a model skips the missing fields and unknown payload keys."""
+    expected = dict(ORDER)
+    del expected['state']
+    expected['customer'] = {'id': 'customer-1', 'title': 'Customer'}
+    expected['delivery'] = {'gdrive': 'https://drive/folder'}
+    assert Order.from_dict(ORDER).to_dict() == expected
+    assert Order.from_dict(expected).to_dict() == expected
+
+
+def test_model_uses_slots():
+    """Test models have no instance dict and keep the payload values as they are."""
+    image = DriveFile.from_dict({'id': 'file-1', 'size': '100', 'imageMediaMetadata': {}})
+    assert not hasattr(image, '__dict__')
+    assert image.size == '100'
+    assert image.imageMediaMetadata == {}
+    assert repr(image) == '<DriveFile file-1>'
+    assert DriveFile(id='file-2').name is None
+
+
+def test_dispatch_notification_actions():
+    """Test the notification actions of a dispatch are built as models."""
+    dispatch = Dispatch.from_dict({
+        'name': 'test',
+        'notification_actions': {
+            'success': {'action': 'notify', 'success': True, 'message': 'Done'},
+        },
+    })
+    action = dispatch.notification_actions['success']
+    assert isinstance(action, NotificationAction)
+    assert action.message == 'Done'
+    assert Dispatch.from_dict({'name': 'empty'}).notification_actions == {}
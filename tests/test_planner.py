@@ -0,0 +1,132 @@
+"""Test the dry-run planning and the execution of order imports."""
+from briefy.reflex import config
+from briefy.reflex import scheduling
+from briefy.reflex.tasks import alexandria
+from briefy.reflex.tasks import planner
+from briefy.reflex.tasks import s3
+from briefy.reflex.tasks.planner import ImportPlan
+from celery.canvas import _chain
+from unittest import mock
+
+import pytest
+
+
+ORDER = {
+    'id': 'order-1',
+    'requirement_items': [{'id': 'item-1', 'folder_id': 'folder-1'}],
+}
+
+IMAGES = [
+    {'id': 'new', 'name': 'new.jpg', 'mimeType': 'image/jpeg', 'size': '100'},
+    {'id': 'other', 'name': 'other.png', 'mimeType': 'image/png', 'size': '200'},
+    {'id': 'missing', 'name': 'missing.jpg', 'mimeType': 'image/jpeg', 'size': '300'},
+    {'id': 'done', 'name': 'done.jpg', 'mimeType': 'image/jpeg', 'size': '400'},
+]
+
+ASSETS = {
+    'other': {'id': 'asset-other', 'collections': ['another-collection']},
+    'missing': {'id': 'asset-missing', 'collections': ['item-1']},
+    'done': {'id': 'asset-done', 'collections': ['item-1']},
+}
+
+S3_FILES = {'asset-done.jpg'}
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    """Leica, google drive, alexandria and S3 read paths of the planner."""
+    folders = {'folder-1': {'images': IMAGES}}
+    monkeypatch.setattr(planner.leica, 'get_order', lambda order_id: dict(ORDER, id=order_id))
+    monkeypatch.setattr(
+        planner, '_folder_contents', lambda folder_id, extract_id=False: folders[folder_id]
+    )
+    monkeypatch.setattr(planner, '_asset_by_slug', lambda slug: ASSETS.get(slug, {}))
+    monkeypatch.setattr(planner, '_file_in_s3', lambda file_name: file_name in S3_FILES)
+    return folders
+
+
+def test_plan_order_actions(sources):
+    """Test the action and the transfer decision of each image of a requirement item."""
+    order_plan = planner.plan_order('order-1')
+    directory = f'{config.TMP_PATH}/order-1/item-1'
+    assert order_plan['order']['id'] == 'order-1'
+    assert [
+        (entry['image']['id'], entry['action'], entry['transfer'], entry['destiny'])
+        for entry in order_plan['entries']
+    ] == [
+        ('new', 'create', True, None),
+        ('other', 'link', True, [directory, 'asset-other.png']),
+        ('missing', 'transfer', True, [directory, 'asset-missing.jpg']),
+        ('done', 'skip', False, [directory, 'asset-done.jpg']),
+    ]
+    assert {entry['collection_id'] for entry in order_plan['entries']} == {'item-1'}
+    assert [entry['size'] for entry in order_plan['entries']] == [100, 200, 300, 400]
+
+
+def test_plan_order_delivery_folder(sources, monkeypatch):
+    """Test orders without requirement items plan the delivery folder images in the order."""
+    monkeypatch.setattr(
+        planner.leica, 'get_order',
+        lambda order_id: {'id': order_id, 'delivery': {'gdrive': 'delivery-link'}}
+    )
+    sources['delivery-link'] = {
+        'images': IMAGES[:1],
+        'folders': [
+            {'name': 'Originals', 'images': IMAGES[3:]},
+            {'name': 'Rejected', 'images': IMAGES[1:3]},
+        ],
+    }
+    order_plan = planner.plan_order('order-2')
+    assert [
+        (entry['image']['id'], entry['action'], entry['collection_id'])
+        for entry in order_plan['entries']
+    ] == [('new', 'create', 'order-2'), ('done', 'link', 'order-2')]
+
+
+def test_import_plan_save_load(sources, tmp_path):
+    """Test a saved plan is loaded back with the same orders and totals."""
+    import_plan = ImportPlan([planner.plan_order('order-1')], uri='https://orders.csv')
+    path = import_plan.save(str(tmp_path / 'plans' / 'plan.json'))
+    loaded = ImportPlan.load(path)
+    assert loaded.orders == import_plan.orders
+    assert loaded.uri == 'https://orders.csv'
+    assert loaded.created_at == import_plan.created_at
+    assert loaded.totals == {
+        'create': 1, 'link': 1, 'transfer': 1, 'skip': 1, 'orders': 1, 'errors': 0,
+        'assets': 4, 'transfers': 3, 'bytes': 600,
+    }
+    assert loaded.estimated_duration == import_plan.estimated_duration
+
+
+def test_add_planned_order_signatures(eager, sources, monkeypatch):
+    """Test the planned order is imported with one signature per entry to execute."""
+    collection = {'id': 'item-1', 'title': 'Item 1'}
+    factory = mock.Mock()
+    factory.return_value.get.return_value = collection
+    monkeypatch.setattr(planner, 'get_utility', lambda interface: factory)
+    monkeypatch.setattr(alexandria, 'create_collections', mock.Mock())
+    monkeypatch.setattr(planner, 'group', lambda tasks: lambda: tasks)
+    order_plan = planner.plan_order('order-1')
+
+    tasks = planner.add_planned_order(order_plan)
+
+    alexandria.create_collections.assert_called_once_with(order_plan['order'])
+    options = scheduling.task_options('order-1', scheduling.BACKFILL, 3)
+    new, other, missing = [entry['image'] for entry in order_plan['entries'][:3]]
+    assert len(tasks) == 3
+    assert all(isinstance(task, _chain) for task in tasks[:2])
+    for task, image in zip(tasks[:2], (new, other)):
+        add, upload = task.tasks
+        assert add.task == alexandria.add_or_update_asset.name
+        assert add.args == (image, collection)
+        assert upload.task == s3.download_and_upload_file.name
+        assert upload.args == (image, )
+        for signature in (add, upload):
+            assert signature.options['priority'] == options['priority']
+            assert signature.options['headers'] == options['headers']
+    transfer = tasks[2]
+    assert transfer.task == s3.download_and_upload_file.name
+    assert transfer.args == (order_plan['entries'][2]['destiny'], missing)
+    assert transfer.options['headers'] == {'order_id': 'order-1'}
+    # the collection is fetched once for all the entries
+    factory.return_value.get.assert_called_once_with('item-1')
@@ -0,0 +1,87 @@
+"""Test the sampled profiling of the tasks."""
+from briefy.reflex import profiling
+from briefy.reflex.profiling import Profiler
+
+import os
+import pstats
+import pytest
+import threading
+
+
+def work():
+    """Profiled function."""
+    return sum(range(1000))
+
+
+@pytest.fixture
+def profiler(tmp_path) -> Profiler:
+    """Profiler sampling all executions of the upload task."""
+    return Profiler(['upload_file'], rate=1.0, path=str(tmp_path), flush_every=2)
+
+
+def test_sample_matching_tasks(profiler):
+    """Test only the profiled tasks are sampled, by full or short name."""
+    for name in ('briefy.reflex.tasks.s3.upload_file', 'upload_file', 'other_task'):
+        with profiler.sample(name):
+            work()
+    assert profiler.summary() == {'briefy.reflex.tasks.s3.upload_file': 1, 'upload_file': 1}
+
+    profiler.configure(['*'], rate=0)
+    with profiler.sample('other_task'):
+        work()
+    assert 'other_task' not in profiler.summary()
+
+
+def test_sample_one_execution_at_a_time(profiler):
+    """Test executions running while another one is profiled are not sampled."""
+    with profiler.sample('upload_file'):
+        with profiler.sample('upload_file'):
+            work()
+    assert profiler.summary() == {'upload_file': 1}
+
+    inside = threading.Event()
+    done = threading.Event()
+
+    def profiled():
+        with profiler.sample('upload_file'):
+            inside.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=profiled)
+    thread.start()
+    inside.wait(5)
+    with profiler.sample('upload_file'):
+        work()
+    done.set()
+    thread.join()
+    assert profiler.summary() == {'upload_file': 2}
+
+
+def test_sample_released_after_failure(profiler):
+    """Test a failed execution is aggregated and the next one is sampled."""
+    with pytest.raises(ValueError):
+        with profiler.sample('upload_file'):
+            raise ValueError('failure')
+    with profiler.sample('upload_file'):
+        work()
+    assert profiler.summary() == {'upload_file': 2}
+
+
+def test_flush_every_samples(profiler, tmp_path):
+    """Test the task file is written every flush_every samples and can be merged."""
+    with profiler.sample('upload_file'):
+        work()
+    assert os.listdir(str(tmp_path)) == []
+    with profiler.sample('upload_file'):
+        work()
+    filename = profiler.filename('upload_file')
+    assert os.listdir(str(tmp_path)) == [os.path.basename(filename)]
+    functions = {function for _, _, function in pstats.Stats(filename).stats}
+    assert 'work' in functions
+
+    profiler.reset()
+    assert profiler.summary() == {}
+    assert profiler.flush() == []
+
+    merged = profiling.merge([filename, filename], str(tmp_path / 'merged.pstats'))
+    assert merged.total_calls == 2 * pstats.Stats(filename).total_calls
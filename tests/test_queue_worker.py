@@ -0,0 +1,95 @@
+"""Test the concurrent processing of the queue messages."""
+from briefy.reflex import logger
+from briefy.reflex.queue import worker
+from unittest import mock
+
+import pytest
+import threading
+
+
+def queue_worker(concurrency: int, batches: list) -> worker.Worker:
+    """Create a concurrent queue worker receiving the batches of messages in order."""
+    input_queue = mock.Mock()
+    input_queue.get_messages.side_effect = batches
+    return worker.Worker(
+        logger_=logger, input_queue=input_queue, name='test', dispatch_map={},
+        concurrency=concurrency
+    )
+
+
+def messages(*ids) -> list:
+    """Queue messages with the given ids."""
+    return [mock.Mock(body={'id': message_id}) for message_id in ids]
+
+
+def free_slots(instance: worker.Worker) -> int:
+    """Number of slots of the worker not reserved, all slots are taken back by the call."""
+    count = 0
+    while instance._slots.acquire(blocking=False):
+        count += 1
+    return count
+
+
+def test_run_acks_processed_messages(monkeypatch):
+    """Test processed messages are deleted, failed ones are not, and all slots are released."""
+    batch = messages('ok-1', 'failed', 'ok-2', 'error')
+    instance = queue_worker(4, [batch, []])
+
+    def process(message):
+        if message.body['id'] == 'error':
+            raise ValueError('failure')
+        return message.body['id'].startswith('ok')
+
+    monkeypatch.setattr(instance, 'process_message', process)
+    instance.run()
+    instance.shutdown()
+
+    assert [message.delete.called for message in batch] == [True, False, True, False]
+    # a full batch is followed by another receive in the same run
+    assert instance.input_queue.get_messages.call_count == 2
+    assert instance.input_queue.get_messages.call_args_list[0] == mock.call(num_messages=4)
+    assert free_slots(instance) == 4
+
+
+def test_run_processes_messages_concurrently(monkeypatch):
+    """Test the messages of one batch are processed at the same time."""
+    barrier = threading.Barrier(3, timeout=5)
+    batch = messages('1', '2', '3')
+    instance = queue_worker(3, [batch, []])
+    monkeypatch.setattr(instance, 'process_message', lambda message: barrier.wait() >= 0)
+    instance.run()
+    instance.shutdown()
+    assert all(message.delete.called for message in batch)
+
+
+def test_run_receives_only_for_idle_slots(monkeypatch):
+    """Test messages being processed keep their slots reserved until they are acknowledged."""
+    processing = threading.Event()
+    instance = queue_worker(3, [messages('1', '2'), []])
+    monkeypatch.setattr(instance, 'process_message', lambda message: processing.wait(5))
+
+    instance.run()
+    # two messages in process: only one slot left
+    instance.run()
+    assert instance.input_queue.get_messages.call_args_list == [
+        mock.call(num_messages=3), mock.call(num_messages=1)
+    ]
+    processing.set()
+    instance.shutdown()
+    assert free_slots(instance) == 3
+
+
+@pytest.mark.parametrize('failure', ['receive', 'delete'])
+def test_run_releases_slots_on_failures(failure, monkeypatch):
+    """Test failures receiving or acknowledging messages do not leak slots."""
+    batch = messages('1', '2')
+    if failure == 'receive':
+        instance = queue_worker(2, [ConnectionError('receive failure')])
+    else:
+        for message in batch:
+            message.delete.side_effect = ConnectionError('delete failure')
+        instance = queue_worker(2, [batch, []])
+    monkeypatch.setattr(instance, 'process_message', lambda message: True)
+    instance.run()
+    instance.shutdown()
+    assert free_slots(instance) == 2
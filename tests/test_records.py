@@ -0,0 +1,115 @@
+"""Test the record format of the gdrive delivery stream."""
+from briefy.reflex.tasks import records
+from briefy.reflex.tasks.checkpoint import MemoryCheckpointStore
+from briefy.reflex.tasks.kinesis import KinesisConsumer
+from briefy.reflex.tasks.localkinesis import LocalKinesis
+
+import json
+import pytest
+
+
+ORDER = {
+    'id': 'order-id',
+    'slug': '1234-ABC',
+    'number_required_assets': 10,
+    'customer': 'not sent to the stream',
+}
+
+CONTENTS = {
+    'delivery': {
+        'id': 'folder-id',
+        'name': 'delivery',
+        'images': [
+            {'id': f'file-{index}', 'name': f'IMG_{index}.jpg', 'size': '1000', 'kind': 'x'}
+            for index in range(200)
+        ],
+    },
+    'archive': {},
+    'submissions': [],
+}
+
+
+@pytest.mark.parametrize('codec', ['none', 'zlib'])
+def test_encode_decode(codec):
+    """Test one record is decoded with the projected order and contents."""
+    chunks = records.encode(ORDER, CONTENTS, codec=codec)
+    assert len(chunks) == 1
+    assert chunks[0].startswith(records.MAGIC)
+    data = records.RecordDecoder().decode(chunks[0])
+    assert data['order'] == {
+        'id': 'order-id', 'slug': '1234-ABC', 'number_required_assets': 10,
+        'delivery': {}, 'assignments': [],
+    }
+    image = data['contents']['delivery']['images'][0]
+    assert image == {'id': 'file-0', 'name': 'IMG_0.jpg', 'size': '1000'}
+
+
+def test_decode_legacy_json():
+    """Test plain json records written before the envelope format are still decoded."""
+    data = json.dumps({'order': ORDER, 'contents': CONTENTS}).encode('utf-8')
+    assert records.RecordDecoder().decode(data)['order'] == ORDER
+
+
+def test_decode_unknown_version():
+    """Test records with an unknown envelope version are rejected."""
+    chunk = bytearray(records.encode(ORDER, CONTENTS)[0])
+    chunk[2] = records.VERSION + 1
+    with pytest.raises(ValueError):
+        records.RecordDecoder().decode(bytes(chunk))
+
+
+def test_chunks_reassembly():
+    """Test chunks are reassembled in any order and the pending positions are tracked."""
+    chunks = records.encode(ORDER, CONTENTS, codec='none', max_size=1024)
+    assert len(chunks) > 2
+    decoder = records.RecordDecoder()
+    chunks = list(reversed(chunks))
+    for index, chunk in enumerate(chunks[:-1]):
+        assert decoder.decode(chunk, position=index) is None
+    assert decoder.pending_positions() == [0]
+
+    data = decoder.decode(chunks[-1], position=len(chunks))
+    assert data['order']['slug'] == '1234-ABC'
+    assert len(data['contents']['delivery']['images']) == 200
+    assert decoder.pending_positions() == []
+
+
+def test_incomplete_records_dropped():
+    """Test the oldest incomplete record is dropped when max_pending is reached."""
+    decoder = records.RecordDecoder(max_pending=1)
+    first = records.encode(ORDER, CONTENTS, codec='none', max_size=1024)
+    second = records.encode(ORDER, CONTENTS, codec='none', max_size=1024)
+    decoder.decode(first[0], position='first')
+    decoder.decode(second[0], position='second')
+    assert decoder.pending_positions() == ['second']
+
+
+def test_checkpoint_before_incomplete_record(tmp_path):
+    """Test the checkpoint stays before the first chunk of an incomplete record."""
+    client = LocalKinesis(str(tmp_path), shard_count=1, read_rate=0, write_rate=0)
+    store = MemoryCheckpointStore()
+
+    def put(chunks: list) -> list:
+        responses = [
+            client.put_record(StreamName='stream', Data=chunk, PartitionKey='key')
+            for chunk in chunks
+        ]
+        return [response['SequenceNumber'] for response in responses]
+
+    first, = put(records.encode({'slug': 'first'}, {}))
+    chunked = records.encode({'slug': 'chunked'}, CONTENTS, codec='none', max_size=1024)
+    put(chunked[:1])
+    put(records.encode({'slug': 'interleaved'}, {}))
+
+    slugs = []
+    consumer = KinesisConsumer('stream', checkpoint_store=store, client=client)
+    consumer.run(lambda order, contents: slugs.append(order['slug']))
+    assert slugs == ['first', 'interleaved']
+    assert store.load('stream') == {'shardId-000000000000': first}
+
+    # restart after the remaining chunks were written
+    put(chunked[1:])
+    slugs = []
+    consumer = KinesisConsumer('stream', checkpoint_store=store, client=client)
+    consumer.run(lambda order, contents: slugs.append(order['slug']))
+    assert slugs == ['interleaved', 'chunked']
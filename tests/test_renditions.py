@@ -0,0 +1,124 @@
+"""Test the renditions of the images computed while they are transferred to S3."""
+from briefy.reflex import renditions
+from briefy.reflex.tasks import alexandria
+from briefy.reflex.tasks import s3
+from io import BytesIO
+from unittest import mock
+
+import hashlib
+import pytest
+
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def jpeg(width: int=800, height: int=600) -> bytes:
+    """Contents of a jpeg image."""
+    output = BytesIO()
+    Image.new('RGB', (width, height)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    """Enable the renditions stage with one thumbnail."""
+    monkeypatch.setattr(renditions, 'RENDITIONS_ENABLED', True)
+    monkeypatch.setattr(renditions, 'SIZES', {'thumbnail': (320, 320)})
+
+
+def test_render_image(enabled):
+    """Test the metadata and renditions of an image are computed from its bytes."""
+    metadata, files = renditions.render_image(jpeg())
+    assert (metadata['width'], metadata['height'], metadata['format']) == (800, 600, 'JPEG')
+    assert Image.open(BytesIO(files['thumbnail'])).size == (320, 240)
+
+
+def test_render_image_invalid(enabled):
+    """Test a file Pillow cannot read is transferred without renditions."""
+    assert renditions.render_image(b'not an image') is None
+
+
+def test_render_image_disabled(monkeypatch):
+    """Test nothing is computed if the stage is disabled."""
+    monkeypatch.setattr(renditions, 'RENDITIONS_ENABLED', False)
+    assert renditions.render_image(jpeg()) is None
+
+
+def test_transfer_with_renditions(eager, enabled, monkeypatch, tmp_path):
+    """Test the renditions are uploaded from the downloaded bytes before the source file."""
+    content = jpeg()
+    calls = mock.Mock()
+    monkeypatch.setattr(s3, 'file_exists', lambda destiny: False)
+    monkeypatch.setattr(s3, 'api', mock.Mock(get_file=lambda image_id: content))
+    monkeypatch.setattr(s3, 'upload_renditions', calls.upload_renditions)
+    calls.upload_renditions.return_value = {'thumbnail': 'source/assets/asset.thumbnail.jpg'}
+    monkeypatch.setattr(s3, 'upload_file', calls.upload_file)
+    calls.upload_file.return_value = 'source/assets/asset.jpg'
+    monkeypatch.setattr(s3, 'alexandria', calls.alexandria)
+    image = {'id': 'image-id', 'md5Checksum': hashlib.md5(content).hexdigest()}
+
+    result = s3.download_and_upload_file((str(tmp_path), 'asset.jpg'), image)
+
+    assert result == 'source/assets/asset.jpg'
+    assert [call[0] for call in calls.mock_calls] == [
+        'upload_renditions', 'upload_file', 'alexandria.attach_renditions.delay'
+    ]
+    image_id, metadata, keys = calls.alexandria.attach_renditions.delay.call_args[0]
+    assert (image_id, metadata['width']) == ('image-id', 800)
+    assert keys == {'thumbnail': 'source/assets/asset.thumbnail.jpg'}
+    assert not (tmp_path / 'asset.jpg').exists()
+
+
+def test_transfer_retried_on_renditions_failure(eager, enabled, monkeypatch, tmp_path):
+    """Test a failed upload of the renditions fails the transfer before the source upload."""
+    content = jpeg()
+    monkeypatch.setattr(s3, 'file_exists', lambda destiny: False)
+    monkeypatch.setattr(s3, 'api', mock.Mock(get_file=lambda image_id: content))
+    monkeypatch.setattr(
+        s3, 'upload_renditions', mock.Mock(side_effect=ConnectionResetError('S3 failure'))
+    )
+    upload_file = mock.Mock()
+    monkeypatch.setattr(s3, 'upload_file', upload_file)
+    image = {'id': 'image-id', 'md5Checksum': hashlib.md5(content).hexdigest()}
+
+    with pytest.raises(ConnectionResetError):
+        s3.download_and_upload_file.run((str(tmp_path), 'asset.jpg'), image)
+    upload_file.assert_not_called()
+
+
+@pytest.fixture
+def library_api(monkeypatch):
+    """Alexandria assets endpoint with one asset, updated holding the asset lock."""
+    api = mock.Mock()
+    api.query.return_value = {'data': [{'id': 'asset-id'}]}
+    asset = {'id': 'asset-id', 'properties': {'metadata': {'iso': 100}}}
+    monkeypatch.setattr(alexandria, 'get_utility', lambda interface: lambda *args: api)
+    monkeypatch.setattr(alexandria.metrics, 'instrument', lambda endpoint, service: endpoint)
+    api.events = []
+    api.get.side_effect = lambda asset_id: api.events.append('get') or asset
+    api.put.side_effect = lambda asset_id, data: api.events.append('put')
+    lock = mock.MagicMock()
+    lock.__enter__.side_effect = lambda: api.events.append('lock')
+    lock.__exit__.side_effect = lambda *exc_info: api.events.append('unlock')
+    monkeypatch.setattr(alexandria, 'asset_lock', mock.Mock(return_value=lock))
+    return api
+
+
+def test_attach_renditions(eager, library_api):
+    """Test the metadata and renditions are added to the asset properties under its lock."""
+    alexandria.attach_renditions('image-id', {'width': 800}, {'thumbnail': 'key'})
+    alexandria.asset_lock.assert_called_once_with('image-id')
+    assert library_api.events == ['lock', 'get', 'put', 'unlock']
+    asset_id, asset = library_api.put.call_args[0]
+    assert asset_id == 'asset-id'
+    assert asset['properties'] == {
+        'metadata': {'iso': 100}, 'image': {'width': 800}, 'renditions': {'thumbnail': 'key'}
+    }
+
+
+def test_attach_renditions_asset_not_found(eager, library_api):
+    """Test the task fails, to be retried, if the asset is not found."""
+    library_api.query.return_value = {'data': []}
+    with pytest.raises(RuntimeError):
+        alexandria.attach_renditions.run('image-id', {'width': 800}, {'thumbnail': 'key'})
+    library_api.put.assert_not_called()
@@ -0,0 +1,48 @@
+"""Test the fair scheduling of the tasks of many orders."""
+from briefy.reflex import scheduling
+from briefy.reflex.scheduling import InflightLimiter
+
+import pytest
+
+
+@pytest.fixture
+def limiter(redis_client) -> InflightLimiter:
+    """Limiter of two tasks in flight per order, holding slots for one minute at most."""
+    limiter = InflightLimiter(limit=2, ttl=60)
+    limiter.redis = redis_client
+    return limiter
+
+
+def test_limit(limiter):
+    """Test the slots of an order are limited and given back on release."""
+    assert limiter.acquire('order-1', 'task-1')
+    assert limiter.acquire('order-1', 'task-2')
+    assert not limiter.acquire('order-1', 'task-3')
+    # other orders have their own slots
+    assert limiter.acquire('order-2', 'task-4')
+
+    limiter.release('order-1', 'task-1')
+    assert limiter.acquire('order-1', 'task-3')
+
+
+def test_leaked_slots_expire(limiter, monkeypatch):
+    """Test slots never released expire, even while tasks of the order are rejected."""
+    now = 1000.0
+    monkeypatch.setattr(scheduling.time, 'time', lambda: now)
+    assert limiter.acquire('order-1', 'crashed-1')
+    assert limiter.acquire('order-1', 'crashed-2')
+
+    for now in range(1000, 1060, 5):
+        assert not limiter.acquire('order-1', 'task-1')
+
+    now = 1061.0
+    assert limiter.acquire('order-1', 'task-1')
+    assert limiter.acquire('order-1', 'task-2')
+
+
+def test_priority():
+    """Test queue imports and small orders get higher priorities."""
+    assert scheduling.order_priority(scheduling.QUEUE, 5) == 0
+    assert scheduling.order_priority(scheduling.QUEUE, 5000) == 3
+    assert scheduling.order_priority(scheduling.BACKFILL, 50) == 6
+    assert scheduling.order_priority(scheduling.BACKFILL, 10 ** 9) == 9
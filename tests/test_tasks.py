@@ -0,0 +1,127 @@
+"""Test the base task class."""
+from briefy.reflex import breaker
+from briefy.reflex import scheduling
+from briefy.reflex.celery import app
+from briefy.reflex.tasks import ReflexTask
+from celery.exceptions import Ignore
+from unittest import mock
+
+import pytest
+
+
+attempts = []
+"""Retries of the request seen by each execution of the task."""
+
+requests = []
+"""Number of requests pushed to the task when each execution started."""
+
+
+@app.task(
+    base=ReflexTask, bind=True, autoretry_for=(ValueError, ), retry_kwargs={'max_retries': 3},
+    default_retry_delay=0,
+)
+def flaky(self, failures: int) -> int:
+    """Fail a number of times before succeeding."""
+    attempts.append(self.request.retries)
+    requests.append(len(self.request_stack.stack))
+    if len(attempts) <= failures:
+        raise ValueError('Temporary failure')
+    return len(attempts)
+
+
+def test_autoretry(eager):
+    """Test autoretry_for retries a task executed by the worker through ReflexTask.__call__."""
+    attempts.clear()
+    requests.clear()
+    flaky.apply((2, ))
+    assert attempts == [0, 1, 2]
+    # the task runs with the request of the worker, celery < 5 does not copy it to a new one
+    assert requests == [1, 1, 1]
+
+
+def test_autoretry_max_retries(eager):
+    """Test the retries of the worker request are counted, so max_retries is respected."""
+    attempts.clear()
+    result = flaky.apply((10, ))
+    assert attempts == [0, 1, 2, 3]
+    assert isinstance(result.result, ValueError)
+
+
+@app.task(base=ReflexTask, bind=True, backends=('leica', ))
+def leica_task(self, value: int) -> int:
+    """Task calling leica."""
+    return value
+
+
+@app.task(base=ReflexTask, bind=True, order_slot=True)
+def asset_task(self, value: int) -> int:
+    """Task holding a slot of its order."""
+    return value
+
+
+def deferred_options(task: ReflexTask, monkeypatch) -> dict:
+    """Execute a task as the worker does, returning the options it was published again with."""
+    apply_async = mock.Mock()
+    monkeypatch.setattr(task, 'apply_async', apply_async)
+    task.push_request(
+        id='task-id', args=(1, ), kwargs={}, retries=2, order_id='order-id',
+        called_directly=False, is_eager=False
+    )
+    try:
+        with pytest.raises(Ignore):
+            task(1)
+    finally:
+        task.pop_request()
+
+    apply_async.assert_called_once()
+    assert apply_async.call_args[0][0] == (1, )
+    return apply_async.call_args[1]
+
+
+def test_circuit_deferral_keeps_retries(eager, monkeypatch):
+    """Test a task deferred by an open circuit is published again without using a retry."""
+    monkeypatch.setattr(
+        breaker, 'check', mock.Mock(side_effect=breaker.CircuitOpen('leica', 30))
+    )
+    options = deferred_options(leica_task, monkeypatch)
+    assert options['task_id'] == 'task-id'
+    assert options['retries'] == 2
+    assert options['countdown'] == 30
+    assert options['headers']['order_id'] == 'order-id'
+
+
+@pytest.fixture
+def limiter(monkeypatch, redis_client) -> scheduling.InflightLimiter:
+    """Limiter of one task in flight per order, with the slot of the order already taken."""
+    limiter = scheduling.InflightLimiter(limit=1)
+    limiter.redis = redis_client
+    monkeypatch.setattr(scheduling, 'get_limiter', lambda: limiter)
+    assert limiter.acquire('order-id', 'other-task-id')
+    return limiter
+
+
+def test_scheduling_deferral_keeps_retries(eager, monkeypatch, limiter):
+    """Test a task of an order at the limit of tasks in flight is deferred without a retry."""
+    options = deferred_options(asset_task, monkeypatch)
+    assert options['task_id'] == 'task-id'
+    assert options['retries'] == 2
+    assert options['countdown'] == scheduling.SCHEDULING_DEFER_SECONDS
+    assert options['headers']['order_id'] == 'order-id'
+    assert options['headers']['scheduling_deferrals'] == 1
+    # the deferred task does not keep a slot
+    assert limiter.redis.zrange(f'{limiter.prefix}:order-id', 0, -1) == ['other-task-id']
+
+
+def test_scheduling_deferrals_cap(eager, monkeypatch, limiter):
+    """Test a task deferred too many times runs over the limit instead of waiting forever."""
+    apply_async = mock.Mock()
+    monkeypatch.setattr(asset_task, 'apply_async', apply_async)
+    asset_task.push_request(
+        id='task-id', args=(1, ), kwargs={}, order_id='order-id', called_directly=False,
+        is_eager=False, scheduling_deferrals=scheduling.SCHEDULING_MAX_DEFERRALS
+    )
+    try:
+        assert asset_task(1) == 1
+    finally:
+        asset_task.pop_request()
+    apply_async.assert_not_called()
@@ -0,0 +1,53 @@
+"""Test the launcher of the tasks workers."""
+from briefy.reflex.tasks import worker
+from unittest import mock
+
+import celery
+import sys
+
+
+def option(argv: list, name: str) -> str:
+    """Return the value of one option of the command line."""
+    values = [arg.partition('=')[2] for arg in argv if arg.startswith(f'--{name}=')]
+    return values[0] if values else None
+
+
+def test_worker_argv_eventlet(monkeypatch):
+    """Test an eventlet profile has a fixed node name and no limits of child processes."""
+    monkeypatch.setitem(worker.PROFILES['s3'], 'pool', 'eventlet')
+    argv = worker.worker_argv('s3')
+    assert argv[0] == 'worker'
+    assert option(argv, 'pool') == 'eventlet'
+    assert option(argv, 'queues') == 'briefy_reflex_s3'
+    assert option(argv, 'hostname') == 'briefy-reflex-s3-dev'
+    assert option(argv, 'max-tasks-per-child') is None
+    assert option(argv, 'max-memory-per-child') is None
+
+
+def test_worker_argv_prefork(monkeypatch):
+    """Test a prefork profile recycles its child processes."""
+    monkeypatch.setitem(worker.PROFILES['tasks'], 'pool', 'prefork')
+    argv = worker.worker_argv('tasks')
+    assert option(argv, 'pool') == 'prefork'
+    assert option(argv, 'max-tasks-per-child') == '1000'
+    assert option(argv, 'max-memory-per-child') == '512000'
+
+
+def test_main_runs_celery_command(monkeypatch):
+    """Test the launcher is replaced by the celery command line of the profile."""
+    execvp = mock.Mock()
+    monkeypatch.setattr(worker.os, 'execvp', execvp)
+    monkeypatch.setattr(sys, 'argv', ['tasks_worker', 'gdrive'])
+    worker.main()
+    command, argv = execvp.call_args[0]
+    assert command == 'celery'
+    assert argv == ['celery', '-A', 'briefy.reflex.tasks', *worker.worker_argv('gdrive')]
+
+
+def test_celery_command_patches_eventlet(monkeypatch):
+    """Test the celery command line monkey patches the eventlet profiles before starting."""
+    monkeypatch.setitem(worker.PROFILES['gdrive'], 'pool', 'eventlet')
+    patch = mock.Mock()
+    argv = [*worker.CELERY_COMMAND, *worker.worker_argv('gdrive')]
+    celery.maybe_patch_concurrency(argv, patches={'eventlet': patch})
+    patch.assert_called_once_with()
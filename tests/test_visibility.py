@@ -0,0 +1,40 @@
+"""Test the visibility timeout of the queue messages."""
+from briefy.reflex.queue.visibility import release_message
+from briefy.reflex.queue.visibility import VisibilityHeartbeat
+from unittest import mock
+
+import pytest
+
+
+def message(receive_count: str=None) -> mock.Mock:
+    """Queue message wrapping a boto message with its attributes."""
+    received = mock.Mock()
+    received.body = {'id': 'message-1'}
+    received._message.attributes = (
+        {'ApproximateReceiveCount': receive_count} if receive_count else {}
+    )
+    return received
+
+
+@pytest.mark.parametrize('receive_count,timeout', [
+    (None, 10),
+    ('1', 10),
+    ('3', 40),
+    ('5', 120),
+    ('1000', 120),
+])
+def test_release_backs_off_with_the_receive_count(receive_count, timeout):
+    """Test a released message is visible again after a backoff growing with its receives."""
+    received = message(receive_count)
+    release_message(received, backoff=10, max_timeout=120)
+    received._message.change_visibility.assert_called_once_with(VisibilityTimeout=timeout)
+
+
+def test_heartbeat_releases_failed_message_with_backoff():
+    """Test processing failures release the message after a backoff, not right away."""
+    received = message('2')
+    with pytest.raises(RuntimeError):
+        with VisibilityHeartbeat(received, timeout=0):
+            raise RuntimeError('failure')
+    timeout = received._message.change_visibility.call_args[1]['VisibilityTimeout']
+    assert timeout > 0